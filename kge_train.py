@@ -44,6 +44,9 @@ def parse_args(args=None):
     parser.add_argument('-dr', '--double_relation_embedding', action='store_true')
     
     parser.add_argument('-n', '--negative_sample_size', default=128, type=int)
+    parser.add_argument('--negative_sampling', default='per-sample', choices=TrainDataset.NEGATIVE_SAMPLING_MODES,
+                        help='per-sample: filtered negatives per triple, shared: one pool of negative_sample_size '
+                             'entities per batch, in-batch: the answers of the other triples of the batch')
     parser.add_argument('-d', '--hidden_dim', default=500, type=int)
     parser.add_argument('-g', '--gamma', default=12.0, type=float)
     parser.add_argument('-adv', '--negative_adversarial_sampling', action='store_true')
@@ -256,7 +259,9 @@ def main(args):
     if args.do_train:
         # Set training dataloader iterator
         train_dataloader_head = DataLoader(
-            TrainDataset(train_triples, nentity, nrelation, args.negative_sample_size, 'head-batch'), 
+            TrainDataset(
+                train_triples, nentity, nrelation, args.negative_sample_size, 'head-batch', args.negative_sampling
+            ),
             batch_size=args.batch_size,
             shuffle=True, 
             num_workers=max(1, args.cpu_num//2),
@@ -264,7 +269,9 @@ def main(args):
         )
         
         train_dataloader_tail = DataLoader(
-            TrainDataset(train_triples, nentity, nrelation, args.negative_sample_size, 'tail-batch'), 
+            TrainDataset(
+                train_triples, nentity, nrelation, args.negative_sample_size, 'tail-batch', args.negative_sampling
+            ),
             batch_size=args.batch_size,
             shuffle=True, 
             num_workers=max(1, args.cpu_num//2),
@@ -304,6 +311,7 @@ def main(args):
     logging.info('init_step = %d' % init_step)
     logging.info('batch_size = %d' % args.batch_size)
     logging.info('negative_adversarial_sampling = %d' % args.negative_adversarial_sampling)
+    logging.info('negative_sampling = %s' % args.negative_sampling)
     logging.info('hidden_dim = %d' % args.hidden_dim)
     logging.info('gamma = %f' % args.gamma)
     logging.info('negative_adversarial_sampling = %s' % str(args.negative_adversarial_sampling))
@@ -46,7 +46,7 @@ from multihopkg.run_configs import alpha
 from multihopkg.run_configs.common import overload_parse_defaults_with_yaml
 from multihopkg.utils.convenience import tensor_normalization
 from multihopkg.utils.setup import set_seeds
-from multihopkg.vector_search import ANN_IndexMan, ANN_IndexMan_pRotatE
+from multihopkg.vector_search import ANN_IndexMan_Sharded, build_kge_index_managers
 from multihopkg.logs import torch_module_logging
 from multihopkg.utils.wandb import histogram_all_modules
 from multihopkg.utils_debug.dump_evals import dump_evaluation_metrics
@@ -1175,27 +1175,17 @@ def main():
     ########################################
     # Setup the Vector Searchers
     ########################################
-    # TODO: Improve the ANN index manager for rotational models
-    if args.model == "pRotatE": # for rotational kge models
-        ann_index_manager_ent = ANN_IndexMan_pRotatE(
-            kge_model.get_all_entity_embeddings_wo_dropout(),
-            embedding_range=kge_model.embedding_range.item(),
-        )
-        ann_index_manager_rel = ANN_IndexMan_pRotatE(
-            kge_model.get_all_relations_embeddings_wo_dropout(),
-            embedding_range=kge_model.embedding_range.item(),
-        )
-    else: # for non-rotational kge models
-        ann_index_manager_ent = ANN_IndexMan(
-            kge_model.get_all_entity_embeddings_wo_dropout(),
-            exact_computation=True,
-            nlist=100,
-        )
-        ann_index_manager_rel = ANN_IndexMan(
-            kge_model.get_all_relations_embeddings_wo_dropout(),
-            exact_computation=True,
-            nlist=100,
-        )
+    ann_index_manager_ent, ann_index_manager_rel = build_kge_index_managers(
+        kge_model,
+        args.model,
+        args.trained_model_path,
+        num_shards=args.ann_num_shards,
+        index_factory=args.ann_index_factory,
+        search_params=args.ann_search_params,
+        storage=args.ann_storage,
+        device=args.ann_device,
+        rotational_index=args.ann_rotational_index,
+    )
 
     # TODO: Improve Visualization for both rotational and non-rotational models
     if args.visualize:
@@ -1329,27 +1319,31 @@ def main():
     if args.visualize:
         args.verbose = True
 
-    train_multihopkg(
-        batch_size=args.batch_size,
-        batch_size_dev=args.batch_size_dev,
-        epochs=args.epochs,
-        nav_agent=nav_agent,
-        hunch_llm=hunch_llm,
-        learning_rate=args.learning_rate,
-        steps_in_episode=args.num_rollout_steps,
-        env=env,
-        start_epoch=args.start_epoch,
-        train_data=train_df,
-        dev_df=dev_df,
-        mbatches_b4_eval=args.batches_b4_eval,
-        verbose=args.verbose,
-        visualize=args.visualize,
-        question_tokenizer=question_tokenizer,
-        answer_tokenizer=answer_tokenizer,
-        track_gradients=args.track_gradients,
-        num_batches_till_eval=args.num_batches_till_eval,
-        wandb_on=args.wandb,
-    )
+    try:
+        train_multihopkg(
+            batch_size=args.batch_size,
+            batch_size_dev=args.batch_size_dev,
+            epochs=args.epochs,
+            nav_agent=nav_agent,
+            hunch_llm=hunch_llm,
+            learning_rate=args.learning_rate,
+            steps_in_episode=args.num_rollout_steps,
+            env=env,
+            start_epoch=args.start_epoch,
+            train_data=train_df,
+            dev_df=dev_df,
+            mbatches_b4_eval=args.batches_b4_eval,
+            verbose=args.verbose,
+            visualize=args.visualize,
+            question_tokenizer=question_tokenizer,
+            answer_tokenizer=answer_tokenizer,
+            track_gradients=args.track_gradients,
+            num_batches_till_eval=args.num_batches_till_eval,
+            wandb_on=args.wandb,
+        )
+    finally:
+        if isinstance(ann_index_manager_ent, ANN_IndexMan_Sharded):
+            ann_index_manager_ent.close()
     logger.info("Done with everything. Exiting...")
 
     # TODO: Evaluation of the model
@@ -0,0 +1,182 @@
+"""
+Tensorized answer sets of a knowledge graph split.
+
+All the (e1, r, e2) facts of a split are kept in two sorted views, each with an offset table over its query keys:
+- objects of (e1, r) queries: key e1 * num_relations + r, answers e2
+- subjects of (r, e2) queries: key r * num_entities + e2, answers e1
+
+Looking up the answers of a whole batch of queries is then a `searchsorted` on the keys followed by a gather,
+instead of one dictionary lookup (and one tiny tensor) per query. Membership tests of whole [batch, num_candidates]
+blocks (answer and false negative masks) search the sorted full triple keys of each view.
+"""
+
+from typing import Dict, Set, Tuple
+
+import numpy as np
+import torch
+
+
+def _build_view(keys: np.ndarray, answers: np.ndarray) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Sorts (key, answer) pairs, drops duplicates and returns (unique keys, offsets, answers)."""
+    order = np.lexsort((answers, keys))
+    keys, answers = keys[order], answers[order]
+    if len(keys) > 0:
+        keep = np.ones(len(keys), dtype=bool)
+        keep[1:] = (np.diff(keys) != 0) | (np.diff(answers) != 0)
+        keys, answers = keys[keep], answers[keep]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    offsets = np.append(starts, len(keys)).astype(np.int64)
+    return torch.from_numpy(unique_keys), torch.from_numpy(offsets), torch.from_numpy(answers)
+
+
+class AnswerIndex:
+    """
+    Answer sets of one split (e.g. train, dev or all facts).
+
+    Attributes:
+        num_entities (int): Number of entities of the graph.
+        num_relations (int): Number of relations of the graph.
+        object_keys (torch.Tensor): Sorted unique e1 * num_relations + r keys. Shape: [num_object_queries]
+        object_offsets (torch.Tensor): The objects of object_keys[i] are objects[object_offsets[i]:object_offsets[i + 1]].
+        objects (torch.Tensor): Sorted objects of every (e1, r) query. Shape: [num_facts]
+        subject_keys (torch.Tensor): Sorted unique r * num_entities + e2 keys. Shape: [num_subject_queries]
+        subject_offsets (torch.Tensor): Offsets of the subjects of every (r, e2) query.
+        subjects (torch.Tensor): Sorted subjects of every (r, e2) query. Shape: [num_facts]
+        object_triple_keys (torch.Tensor): Sorted (e1 * num_relations + r) * num_entities + e2 keys. Shape: [num_facts]
+        subject_triple_keys (torch.Tensor): Sorted (r * num_entities + e2) * num_entities + e1 keys. Shape: [num_facts]
+
+    The tensors follow the queries: they are moved to the device of the first queries made on another device.
+    """
+
+    def __init__(
+        self, e1: np.ndarray, r: np.ndarray, e2: np.ndarray, num_entities: int, num_relations: int
+    ):
+        e1 = np.asarray(e1, dtype=np.int64)
+        r = np.asarray(r, dtype=np.int64)
+        e2 = np.asarray(e2, dtype=np.int64)
+        self.num_entities = num_entities
+        self.num_relations = num_relations
+        self.object_keys, self.object_offsets, self.objects = _build_view(e1 * num_relations + r, e2)
+        self.subject_keys, self.subject_offsets, self.subjects = _build_view(r * num_entities + e2, e1)
+        self.object_triple_keys = (
+            self.object_keys.repeat_interleave(self.object_offsets.diff()) * num_entities + self.objects
+        )
+        self.subject_triple_keys = (
+            self.subject_keys.repeat_interleave(self.subject_offsets.diff()) * num_entities + self.subjects
+        )
+
+    @property
+    def device(self) -> torch.device:
+        return self.objects.device
+
+    def to(self, device: torch.device) -> "AnswerIndex":
+        """Moves the tensors to `device` (in place) and returns the index."""
+        for name in (
+            "object_keys", "object_offsets", "objects", "object_triple_keys",
+            "subject_keys", "subject_offsets", "subjects", "subject_triple_keys",
+        ):
+            setattr(self, name, getattr(self, name).to(device))
+        return self
+
+    def _follow(self, queries: torch.Tensor) -> None:
+        if queries.device != self.device:
+            self.to(queries.device)
+
+    def _contains(self, triple_keys: torch.Tensor, query_keys: torch.Tensor, candidates: torch.Tensor) -> torch.Tensor:
+        if len(triple_keys) == 0:
+            return torch.zeros_like(candidates, dtype=torch.bool)
+        keys = query_keys.unsqueeze(1) * self.num_entities + candidates  # [batch_size, num_candidates]
+        position = torch.searchsorted(triple_keys, keys).clamp(max=len(triple_keys) - 1)
+        return triple_keys[position] == keys
+
+    def object_mask(self, e1: torch.Tensor, r: torch.Tensor, e2_space: torch.Tensor) -> torch.Tensor:
+        """
+        Tests which candidate objects answer their (e1, r) query.
+
+        Args:
+            e1 (torch.Tensor): Subjects. Shape: [batch_size]
+            r (torch.Tensor): Relations. Shape: [batch_size]
+            e2_space (torch.Tensor): Candidate objects of every query. Shape: [batch_size, num_candidates]
+
+        Returns:
+            torch.Tensor: True where (e1, r, e2_space) is a fact of the split. Shape: [batch_size, num_candidates]
+        """
+        self._follow(e2_space)
+        return self._contains(self.object_triple_keys, e1.view(-1) * self.num_relations + r.view(-1), e2_space)
+
+    def subject_mask(self, e2: torch.Tensor, r: torch.Tensor, e1_space: torch.Tensor) -> torch.Tensor:
+        """
+        Tests which candidate subjects answer their (r, e2) query, see `object_mask`.
+        """
+        self._follow(e1_space)
+        return self._contains(self.subject_triple_keys, r.view(-1) * self.num_entities + e2.view(-1), e1_space)
+
+    def _gather(
+        self, keys: torch.Tensor, offsets: torch.Tensor, answers: torch.Tensor, queries: torch.Tensor, padding_value: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        position = torch.searchsorted(keys, queries).clamp(max=max(len(keys) - 1, 0))
+        found = keys[position] == queries if len(keys) > 0 else torch.zeros_like(queries, dtype=torch.bool)
+        starts = torch.where(found, offsets[position], torch.zeros_like(position))
+        counts = torch.where(found, offsets[position + 1] - offsets[position], torch.zeros_like(position))
+
+        max_count = int(counts.max()) if counts.numel() > 0 else 0
+        columns = torch.arange(max_count, device=keys.device)
+        mask = columns < counts.unsqueeze(-1)
+        gathered = answers[(starts.unsqueeze(-1) + columns).clamp(max=max(len(answers) - 1, 0))]
+        return torch.where(mask, gathered, torch.full_like(gathered, padding_value)), mask
+
+    def batch_objects(
+        self, e1: torch.Tensor, r: torch.Tensor, padding_value: int = 0
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Gathers the objects of a batch of (e1, r) queries.
+
+        Args:
+            e1 (torch.Tensor): Subjects. Shape: [batch_size]
+            r (torch.Tensor): Relations. Shape: [batch_size]
+            padding_value (int): Fills the answers beyond each query's answer count.
+
+        Returns:
+            answers (torch.Tensor): Padded objects. Shape: [batch_size, max_num_answers]
+            mask (torch.Tensor): True for real answers. Shape: [batch_size, max_num_answers]
+        """
+        self._follow(e1)
+        return self._gather(
+            self.object_keys, self.object_offsets, self.objects, e1 * self.num_relations + r, padding_value
+        )
+
+    def batch_subjects(
+        self, e2: torch.Tensor, r: torch.Tensor, padding_value: int = 0
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Gathers the subjects of a batch of (r, e2) queries, see `batch_objects`.
+        """
+        self._follow(e2)
+        return self._gather(
+            self.subject_keys, self.subject_offsets, self.subjects, r * self.num_entities + e2, padding_value
+        )
+
+    def object_sets(self) -> Dict[int, Dict[int, Set[int]]]:
+        """Nested `d[e1][r] = {e2, ...}` dictionaries, as built by the former `load_all_answers`."""
+        return self._to_nested_sets(self.object_keys, self.object_offsets, self.objects, self.num_relations)
+
+    def subject_sets(self) -> Dict[int, Dict[int, Set[int]]]:
+        """Nested `d[e2][r] = {e1, ...}` dictionaries, as built by the former `load_all_answers`."""
+        nested_by_r = self._to_nested_sets(self.subject_keys, self.subject_offsets, self.subjects, self.num_entities)
+        nested: Dict[int, Dict[int, Set[int]]] = {}
+        for r, by_e2 in nested_by_r.items():
+            for e2, e1s in by_e2.items():
+                nested.setdefault(e2, {})[r] = e1s
+        return nested
+
+    @staticmethod
+    def _to_nested_sets(
+        keys: torch.Tensor, offsets: torch.Tensor, answers: torch.Tensor, base: int
+    ) -> Dict[int, Dict[int, Set[int]]]:
+        nested: Dict[int, Dict[int, Set[int]]] = {}
+        answers_list = answers.tolist()
+        offsets_list = offsets.tolist()
+        for i, key in enumerate(keys.tolist()):
+            outer, inner = divmod(key, base)
+            nested.setdefault(outer, {})[inner] = set(answers_list[offsets_list[i] : offsets_list[i + 1]])
+        return nested
@@ -12,10 +12,8 @@ from functools import cmp_to_key
 import json
 import os
 import pdb
-import pickle
 from datetime import datetime
 from typing import Any, Dict, Optional, Sequence, List, Tuple, Union
-import re
 import ast
 import logging
 
@@ -27,7 +25,10 @@ from transformers import PreTrainedTokenizer, AutoTokenizer
 from sklearn.model_selection import train_test_split
 
 from multihopkg.utils.setup import get_git_root
+from multihopkg.graph_csr import GRAPH_STORE_DIRNAME, GraphCSR
+from multihopkg.graph_csr import ensure_graph_store, load_graph_store, save_graph_store
 from multihopkg.itl_typing import Triple
+from multihopkg.triple_io import read_vocabulary
 from multihopkg.itl_typing import DFSplit
 from multihopkg.utils.metacode import stale_code
 
@@ -103,16 +104,15 @@ def get_train_path(data_dir: str, test: bool, model: str):
     return train_path
 
 
-def load_seen_entities(adj_list_path, entity_index_path):
+def load_seen_entities(graph_store_dir, entity_index_path):
+    """
+    Entities with at least one edge in the graph store at `graph_store_dir` (`<data_dir>/graph_store`), which is
+    (re)converted from the legacy pickles of its data directory when they are newer.
+    """
     _, id2entity = load_index(entity_index_path)
-    with open(adj_list_path, "rb") as f:
-        adj_list = pickle.load(f)
-    seen_entities = set()
-    for e1 in adj_list:
-        seen_entities.add(id2entity[e1])
-        for r in adj_list[e1]:
-            for e2 in adj_list[e1][r]:
-                seen_entities.add(id2entity[e2])
+    graph, _ = load_graph_store(ensure_graph_store(os.path.dirname(graph_store_dir), graph_store_dir))
+    seen_ids = np.union1d(np.flatnonzero(graph.out_degrees), graph.targets)
+    seen_entities = set(id2entity[int(e)] for e in seen_ids)
     print("{} seen entities loaded...".format(len(seen_entities)))
     return seen_entities
 
@@ -247,12 +247,8 @@ def load_index(input_path):
     This specific implementation takes row number as int-index
     Use `load_index_column_wise` for one with int-index as the second column
     """
-    index, rev_index = {}, {}
-    with open(input_path) as f:
-        for i, line in enumerate(f.readlines()):
-            v, _ = line.strip().split()
-            index[v] = i
-            rev_index[i] = v
+    index = read_vocabulary(input_path)
+    rev_index = dict(zip(index.values(), index.keys()))
     return index, rev_index
 
 def prepare_triple_dicts(
@@ -440,12 +436,12 @@ def prepare_kb_envrioment(
                 num_facts += 1
 
     print("{} facts processed".format(num_facts))
-    # Save adjacency list
-    adj_list_path = os.path.join(data_dir, "adj_list.pkl")
-    with open(adj_list_path, "wb") as o_f:
-        pickle.dump(dict(adj_list), o_f)
-    with open(os.path.join(data_dir, "entity2typeid.pkl"), "wb") as o_f:
-        pickle.dump(entity2typeid, o_f)
+    # Save the adjacency list (and entity types) as a binary graph store, see `multihopkg.graph_csr`
+    save_graph_store(
+        os.path.join(data_dir, GRAPH_STORE_DIRNAME),
+        GraphCSR.from_adj_list(adj_list, len(entity2id)),
+        entity2typeid,
+    )
 
 
 def get_seen_queries(data_dir, entity_index_path, relation_index_path):
@@ -809,14 +805,9 @@ def process_freebaseqa_data(
         pdb.set_trace()
 
 def load_index_column_wise(path: str) -> Tuple[Dict[int, str], Dict[str, int]]:
-    id2entity = {}
-    entity2id = {}
-    with open(path) as f:
-        # File is a two column tsv file
-        for line in f:
-            id, idx = re.split(r'\s+', line.strip())
-            id2entity[int(idx)] = id
-            entity2id[id] = int(idx)  # Yeah I know how this looks.
+    # File is a two column tsv file
+    entity2id = read_vocabulary(path, id_column=1)
+    id2entity = dict(zip(entity2id.values(), entity2id.keys()))
 
     return id2entity, entity2id
 
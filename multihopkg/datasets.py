@@ -6,113 +6,213 @@ import torch
 import numpy as np
 from torch.utils.data import Dataset
 
+from multihopkg.answer_index import AnswerIndex
+
 class TestDataset(Dataset):
+    """
+    Filtered link prediction queries: every test triple is scored against all the entities, and the other known
+    answers of the query are filtered out of the scores.
+
+    The known heads of every (r, t) and tails of every (h, r) are precomputed once as an `AnswerIndex` (CSR arrays
+    over the query keys). `collate_fn` looks up the known answers of a whole batch at once and returns their
+    (row, entity) coordinates, which `filter_scores` sets to -inf in the score matrix on the scores' device.
+    """
     __test__ = False # To avoid pytest confusion
 
-    def __init__(self, triples, all_true_triples, nentity, nrelation, mode):
+    def __init__(
+        self, triples, all_true_triples, nentity, nrelation, mode, filter_index=None, with_negative_sample=False
+    ):
+        """
+        :param filter_index: `AnswerIndex` of all_true_triples, shared between the head-batch and tail-batch datasets
+            when given (see `build_filter_index`).
+        :param with_negative_sample: Also return every entity as an explicit (batch, nentity) candidate tensor, for
+            models scored through `forward` (e.g. `LegacyKGEModel`). `KGEModel.test_step` streams the entities with
+            `score_all_heads`/`score_all_tails` and leaves it off.
+        """
+        if mode not in ('head-batch', 'tail-batch'):
+            raise ValueError('negative batch mode %s not supported' % mode)
         self.len = len(triples)
-        self.triple_set = set(all_true_triples)
         self.triples = triples
         self.nentity = nentity
         self.nrelation = nrelation
         self.mode = mode
+        self.with_negative_sample = with_negative_sample
+        if filter_index is None:
+            filter_index = TestDataset.build_filter_index(all_true_triples, nentity, nrelation)
+        self.filter_index = filter_index
+
+    @staticmethod
+    def build_filter_index(all_true_triples, nentity, nrelation):
+        triples = np.asarray(all_true_triples, dtype=np.int64).reshape(-1, 3)
+        return AnswerIndex(triples[:, 0], triples[:, 1], triples[:, 2], nentity, nrelation)
 
     def __len__(self):
         return self.len
     
     def __getitem__(self, idx):
         head, relation, tail = self.triples[idx]
+        positive_sample = torch.LongTensor((head, relation, tail))
+        return positive_sample, self.mode
 
+    def collate_fn(self, data):
+        """
+        :return positive_sample: (batch, 3) test triples.
+        :return negative_sample: (batch, nentity) candidate entities, all of them in id order, or None without
+            with_negative_sample.
+        :return filter_indices: (2, num_filtered) (row, entity) of the known answers other than the test triple's.
+        :return mode: head-batch or tail-batch.
+        """
+        positive_sample = torch.stack([_[0] for _ in data], dim=0)
+        head, relation, tail = positive_sample[:, 0], positive_sample[:, 1], positive_sample[:, 2]
         if self.mode == 'head-batch':
-            tmp = [(0, candidate_head) if (candidate_head, relation, tail) not in self.triple_set
-                   else (-1, head) for candidate_head in range(self.nentity)]
-            tmp[head] = (0, head)
-        elif self.mode == 'tail-batch':
-            tmp = [(0, candidate_tail) if (head, relation, candidate_tail) not in self.triple_set
-                   else (-1, tail) for candidate_tail in range(self.nentity)]
-            tmp[tail] = (0, tail)
+            answers, mask = self.filter_index.batch_subjects(tail, relation)
+            target = head
         else:
-            raise ValueError('negative batch mode %s not supported' % self.mode)
-            
-        tmp = torch.LongTensor(tmp)            
-        filter_bias = tmp[:, 0].float()
-        negative_sample = tmp[:, 1]
+            answers, mask = self.filter_index.batch_objects(head, relation)
+            target = tail
+        mask &= answers != target.unsqueeze(1)
+        rows = mask.nonzero()[:, 0]
+        filter_indices = torch.stack([rows, answers[mask]], dim=0)
+
+        negative_sample = None
+        if self.with_negative_sample:
+            negative_sample = torch.arange(self.nentity).repeat(len(data), 1)
+        return positive_sample, negative_sample, filter_indices, self.mode
 
-        positive_sample = torch.LongTensor((head, relation, tail))
-            
-        return positive_sample, negative_sample, filter_bias, self.mode
-    
     @staticmethod
-    def collate_fn(data):
-        positive_sample = torch.stack([_[0] for _ in data], dim=0)
-        negative_sample = torch.stack([_[1] for _ in data], dim=0)
-        filter_bias = torch.stack([_[2] for _ in data], dim=0)
-        mode = data[0][3]
-        return positive_sample, negative_sample, filter_bias, mode
+    def filter_scores(score, filter_indices):
+        """
+        Sets the scores of the known answers to -inf (in place), so that only the test triple's answer is ranked.
+        """
+        score[filter_indices[0], filter_indices[1]] = float('-inf')
+        return score
 
 class TrainDataset(Dataset):
-    def __init__(self, triples, nentity, nrelation, negative_sample_size, mode):
+    """
+    Training triples with filtered negative samples.
+
+    Negatives are drawn for a whole batch at once (`__getitems__`, which the DataLoader calls with the indices of a
+    batch): candidates are drawn as one [batch, 2 * negative_sample_size] array, true triples are rejected with a
+    `searchsorted` against the sorted keys of all the training triples, and rows short of negatives draw again.
+    The subsampling weight of every triple is precomputed in `__init__`.
+
+    With `negative_sampling='shared'` the batch shares one pool of negative_sample_size uniformly drawn entities, and
+    with 'in-batch' the pool is the heads (head-batch) or tails (tail-batch) of the batch itself. Both are returned as
+    a 1D pool with the 'head-shared'/'tail-shared' mode, scored with one matmul per batch by `KGEModel.forward`.
+    Pool entries are not filtered against the true triples, except for the row's own answer in `KGEModel.train_step`.
+    """
+    NEGATIVE_SAMPLING_MODES = ('per-sample', 'shared', 'in-batch')
+
+    def __init__(self, triples, nentity, nrelation, negative_sample_size, mode, negative_sampling='per-sample'):
+        if mode not in ('head-batch', 'tail-batch'):
+            raise ValueError('Training batch mode %s not supported' % mode)
+        if negative_sampling not in TrainDataset.NEGATIVE_SAMPLING_MODES:
+            raise ValueError('Negative sampling %s not supported' % negative_sampling)
+        self.negative_sampling = negative_sampling
         self.len = len(triples)
         self.triples = triples
-        self.triple_set = set(triples)
         self.nentity = nentity
         self.nrelation = nrelation
         self.negative_sample_size = negative_sample_size
         self.mode = mode
-        self.count = self.count_frequency(triples)
-        self.true_head, self.true_tail = self.get_true_head_and_tail(self.triples)
-        
+        self.triple_array = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+        self.subsampling_weights = self.compute_subsampling_weights(self.triple_array)
+        # Sorted (query, answer) keys of the true triples, the query being (r, t) for head-batch and (h, r) otherwise
+        self.true_keys = np.unique(self.query_keys(self.triple_array) * nentity + self.answers(self.triple_array))
+
+    def query_keys(self, positive_sample):
+        head, relation, tail = positive_sample[:, 0], positive_sample[:, 1], positive_sample[:, 2]
+        if self.mode == 'head-batch':
+            return relation * self.nentity + tail
+        return head * self.nrelation + relation
+
+    def answers(self, positive_sample):
+        return positive_sample[:, 0] if self.mode == 'head-batch' else positive_sample[:, 2]
+
     def __len__(self):
         return self.len
     
     def __getitem__(self, idx):
-        positive_sample = self.triples[idx]
+        if self.negative_sampling != 'per-sample':
+            raise ValueError('%s negatives are drawn per batch, see __getitems__' % self.negative_sampling)
+        positive_sample, negative_sample, subsampling_weight, mode = self.__getitems__([idx])
+        return positive_sample[0], negative_sample[0], subsampling_weight, mode
 
-        head, relation, tail = positive_sample
-
-        subsampling_weight = self.count[(head, relation)] + self.count[(tail, -relation-1)]
-        subsampling_weight = torch.sqrt(1 / torch.Tensor([subsampling_weight]))
-        
-        negative_sample_list = []
-        negative_sample_size = 0
-
-        while negative_sample_size < self.negative_sample_size:
-            negative_sample = np.random.randint(self.nentity, size=self.negative_sample_size*2)
-            if self.mode == 'head-batch':
-                mask = np.in1d(
-                    negative_sample, 
-                    self.true_head[(relation, tail)], 
-                    assume_unique=True, 
-                    invert=True
-                )
-            elif self.mode == 'tail-batch':
-                mask = np.in1d(
-                    negative_sample, 
-                    self.true_tail[(head, relation)], 
-                    assume_unique=True, 
-                    invert=True
-                )
+    def __getitems__(self, indices):
+        """
+        Builds a whole batch, already collated (see `collate_fn`).
+        """
+        positive_sample = self.triple_array[np.asarray(indices, dtype=np.int64)]
+        subsampling_weight = self.subsampling_weights[indices]
+        mode = self.mode
+        if self.negative_sampling == 'per-sample':
+            negative_sample = self.sample_negatives(positive_sample)
+        else:
+            mode = 'head-shared' if self.mode == 'head-batch' else 'tail-shared'
+            if self.negative_sampling == 'shared':
+                negative_sample = np.random.randint(self.nentity, size=self.negative_sample_size)
             else:
-                raise ValueError('Training batch mode %s not supported' % self.mode)
-            negative_sample = negative_sample[mask]
-            negative_sample_list.append(negative_sample)
-            negative_sample_size += negative_sample.size
-        
-        negative_sample = np.concatenate(negative_sample_list)[:self.negative_sample_size]
+                negative_sample = self.answers(positive_sample).copy()
+        return (
+            torch.from_numpy(positive_sample),
+            torch.from_numpy(negative_sample),
+            torch.from_numpy(subsampling_weight),
+            mode,
+        )
 
-        negative_sample = torch.LongTensor(negative_sample)
+    def sample_negatives(self, positive_sample):
+        """
+        Draws negative_sample_size entities per triple that do not form a true triple with its query.
+        :return: (batch, negative_sample_size) negative entities.
+        """
+        batch_size = len(positive_sample)
+        query_keys = self.query_keys(positive_sample) * self.nentity
+        negative_sample = np.empty((batch_size, self.negative_sample_size), dtype=np.int64)
+        num_sampled = np.zeros(batch_size, dtype=np.int64)
+        pending = np.arange(batch_size)
+        while len(pending) > 0:
+            candidates = np.random.randint(self.nentity, size=(len(pending), self.negative_sample_size * 2))
+            is_negative = self.is_negative(query_keys[pending, None] + candidates)
+            # Column of every accepted candidate in its row of negative_sample
+            columns = np.cumsum(is_negative, axis=1) - 1 + num_sampled[pending, None]
+            keep = is_negative & (columns < self.negative_sample_size)
+            rows = np.broadcast_to(pending[:, None], keep.shape)[keep]
+            negative_sample[rows, columns[keep]] = candidates[keep]
+            num_sampled[pending] += keep.sum(axis=1)
+            pending = pending[num_sampled[pending] < self.negative_sample_size]
+        return negative_sample
+
+    def is_negative(self, keys):
+        if len(self.true_keys) == 0:
+            return np.ones(keys.shape, dtype=bool)
+        position = np.searchsorted(self.true_keys, keys).clip(max=len(self.true_keys) - 1)
+        return self.true_keys[position] != keys
 
-        positive_sample = torch.LongTensor(positive_sample)
-            
-        return positive_sample, negative_sample, subsampling_weight, self.mode
-    
     @staticmethod
     def collate_fn(data):
+        if isinstance(data, tuple):
+            # Batch built by __getitems__
+            return data
         positive_sample = torch.stack([_[0] for _ in data], dim=0)
         negative_sample = torch.stack([_[1] for _ in data], dim=0)
         subsample_weight = torch.cat([_[2] for _ in data], dim=0)
         mode = data[0][3]
         return positive_sample, negative_sample, subsample_weight, mode
+
+    @staticmethod
+    def compute_subsampling_weights(triple_array, start=4):
+        """
+        sqrt(1 / (count(head, relation) + count(tail, -relation-1))) of every triple, with the counts of
+        `count_frequency`, as a float32 array.
+        """
+        def counts(keys):
+            _, inverse, occurrences = np.unique(keys, return_inverse=True, return_counts=True)
+            return occurrences[inverse] + start - 1
+
+        head, relation, tail = triple_array[:, 0], triple_array[:, 1], triple_array[:, 2]
+        num_relations = int(relation.max()) + 1 if len(relation) > 0 else 1
+        frequency = counts(head * num_relations + relation) + counts(tail * num_relations + relation)
+        return np.sqrt(1 / frequency).astype(np.float32)
     
     @staticmethod
     def count_frequency(triples, start=4):
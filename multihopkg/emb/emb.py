@@ -70,37 +70,19 @@ class EmbeddingBasedMethod(LFramework):
     def get_subject_mask(self, e1_space, e2, q):
         kg = self.kg
         if kg.args.mask_test_false_negatives:
-            answer_vectors = kg.all_subject_vectors
+            answers = kg.all_answers
         else:
-            answer_vectors = kg.train_subject_vectors
-        subject_masks = []
-        for i in range(len(e1_space)):
-            _e2, _q = int(e2[i]), int(q[i])
-            if not _e2 in answer_vectors or not _q in answer_vectors[_e2]:
-                answer_vector = var_cuda(torch.LongTensor([[kg.num_entities]]))
-            else:
-                answer_vector = answer_vectors[_e2][_q]
-            subject_mask = torch.sum(e1_space[i].unsqueeze(0) == answer_vector, dim=0)
-            subject_masks.append(subject_mask)
-        subject_mask = torch.cat(subject_masks).view(len(e1_space), -1)
+            answers = kg.train_answers
+        subject_mask = answers.subject_mask(e2, q, e1_space).long()
         return subject_mask
 
     def get_object_mask(self, e2_space, e1, q):
         kg = self.kg
         if kg.args.mask_test_false_negatives:
-            answer_vectors = kg.all_object_vectors
+            answers = kg.all_answers
         else:
-            answer_vectors = kg.train_object_vectors
-        object_masks = []
-        for i in range(len(e2_space)):
-            _e1, _q = int(e1[i]), int(q[i])
-            if not e1 in answer_vectors or not q in answer_vectors[_e1]:
-                answer_vector = var_cuda(torch.LongTensor([[kg.num_entities]]))
-            else:
-                answer_vector = answer_vectors[_e1][_q]
-            object_mask = torch.sum(e2_space[i].unsqueeze(0) == answer_vector, dim=0)
-            object_masks.append(object_mask)
-        object_mask = torch.cat(object_masks).view(len(e2_space), -1)
+            answers = kg.train_answers
+        object_mask = answers.object_mask(e1, q, e2_space).long()
         return object_mask
 
     def export_reward_shaping_parameters(self):
@@ -6,7 +6,7 @@ from __future__ import print_function
 
 import logging
 from collections.abc import Mapping
-from typing import Any, Union
+from typing import Any, Optional, Tuple, Union
 
 import numpy as np
 
@@ -22,6 +22,7 @@ from multihopkg.utils.convenience import sample_random_entity
 from multihopkg.emb.operations import normalize_angle_smooth, normalize_angle, angular_difference
 
 from multihopkg.datasets import TestDataset
+from multihopkg.ranking import FilteredRanking
 
 class KGEModel(nn.Module):
 
@@ -103,6 +104,15 @@ class KGEModel(nn.Module):
             'RotatE': self.RotatE,
             'pRotatE': self.pRotatE
         }
+
+        # Scoring functions against a pool of candidate entities shared by the batch ('head-shared'/'tail-shared')
+        self.pool_func = {
+            'TransE': self.TransE_Pool,
+            'DistMult': self.DistMult_Pool,
+            'ComplEx': self.ComplEx_Pool,
+            'RotatE': self.RotatE_Pool,
+            'pRotatE': self.pRotatE_Pool
+        }
         
         # Initialize the flexible forward function dictionary once
         self.flexible_func = {
@@ -235,7 +245,11 @@ class KGEModel(nn.Module):
         And the second part is the entities in the negative samples.
         Because negative samples and positive samples usually share two elements 
         in their triple ((head, relation) or (relation, tail)).
+        In the 'head-shared' or 'tail-shared' mode, the second part is one 1D pool
+        of entities scored against every positive sample, giving a
+        [batch_size, pool_size] score without repeating the pool per sample.
         '''
+        pool = None
 
         if mode == 'single':
             batch_size, negative_sample_size = sample.size(0), 1
@@ -301,6 +315,22 @@ class KGEModel(nn.Module):
                 dim=0, 
                 index=tail_part.view(-1)
             ).view(batch_size, negative_sample_size, -1)
+
+        elif mode in ('head-shared', 'tail-shared'):
+            positive_part, pool_part = sample
+
+            head, relation, tail = (
+                torch.index_select(embedding, dim=0, index=positive_part[:, column]).unsqueeze(1)
+                for embedding, column in (
+                    (self.entity_embedding, 0), (self.relation_embedding, 1), (self.entity_embedding, 2)
+                )
+            )
+
+            pool = torch.index_select(
+                self.entity_embedding,
+                dim=0,
+                index=pool_part
+            )
             
         else:
             raise ValueError('mode %s not supported' % mode)
@@ -318,19 +348,20 @@ class KGEModel(nn.Module):
             # MSE LOSS (aka, reconstruction loss)
             mse_loss = F.mse_loss(relation_reconstructed, relation) 
 
-            if self.model_name in self.model_func:
-                score = self.model_func[self.model_name](head, relation_reconstructed, tail, mode)
-            else:
-                raise ValueError('model %s not supported' % self.model_name)
+            score = self._score(head, relation_reconstructed, tail, pool, mode)
 
             return score, mse_loss
         else:
-            if self.model_name in self.model_func:
-                score = self.model_func[self.model_name](head, relation, tail, mode)
-            else:
-                raise ValueError('model %s not supported' % self.model_name)
+            score = self._score(head, relation, tail, pool, mode)
             
             return score, torch.tensor([0.0], device=score.device) # No MSE loss in this case
+
+    def _score(self, head, relation, tail, pool, mode):
+        if self.model_name not in self.model_func:
+            raise ValueError('model %s not supported' % self.model_name)
+        if pool is None:
+            return self.model_func[self.model_name](head, relation, tail, mode)
+        return self.pool_func[self.model_name](head.squeeze(1), relation.squeeze(1), tail.squeeze(1), pool, mode)
         
     #-----------------------------------------------------------------------
     'Scoring Functions'
@@ -417,6 +448,161 @@ class KGEModel(nn.Module):
 
         score = self.gamma.item() - score.sum(dim = 2) * self.modulus
         return score
+
+    #-----------------------------------------------------------------------
+    'Pool Scoring Functions'
+
+    # Number of pool entities broadcast against the batch at once by the models without a matmul form
+    pool_chunk_size = 4096
+
+    def TransE_Pool(self, head, relation, tail, pool, mode):
+        """
+        Scores every (head, relation, tail) query against every entity of the pool, the pool replacing the heads in
+        'head-shared' mode and the tails otherwise (the replaced part is ignored and may be None).
+        Shapes: head/relation/tail [batch_size, dim], pool [pool_size, dim], score [batch_size, pool_size]
+        """
+        # |h + r - t| = |(h + r) - t| = |h - (t - r)|
+        if mode == 'head-shared':
+            query = tail - relation
+        else:
+            query = head + relation
+
+        return self.gamma.item() - torch.cdist(query, pool, p=1)
+
+    def DistMult_Pool(self, head, relation, tail, pool, mode):
+        if mode == 'head-shared':
+            query = relation * tail
+        else:
+            query = head * relation
+
+        return query @ pool.t()
+
+    def ComplEx_Pool(self, head, relation, tail, pool, mode):
+        re_relation, im_relation = torch.chunk(relation, 2, dim=1)
+
+        if mode == 'head-shared':
+            re_tail, im_tail = torch.chunk(tail, 2, dim=1)
+            re_query = re_relation * re_tail + im_relation * im_tail
+            im_query = re_relation * im_tail - im_relation * re_tail
+        else:
+            re_head, im_head = torch.chunk(head, 2, dim=1)
+            re_query = re_head * re_relation - im_head * im_relation
+            im_query = re_head * im_relation + im_head * re_relation
+
+        return torch.cat([re_query, im_query], dim=1) @ pool.t()
+
+    def RotatE_Pool(self, head, relation, tail, pool, mode):
+        phase_relation = relation/(self.embedding_range.item()/torch.pi)
+
+        re_relation = torch.cos(phase_relation)
+        im_relation = torch.sin(phase_relation)
+
+        if mode == 'head-shared':
+            re_tail, im_tail = torch.chunk(tail, 2, dim=1)
+            re_query = re_relation * re_tail + im_relation * im_tail
+            im_query = re_relation * im_tail - im_relation * re_tail
+        else:
+            re_head, im_head = torch.chunk(head, 2, dim=1)
+            re_query = re_head * re_relation - im_head * im_relation
+            im_query = re_head * im_relation + im_head * re_relation
+
+        re_query, im_query = re_query.unsqueeze(1), im_query.unsqueeze(1)
+        distances = []
+        for pool_chunk in torch.split(pool, self.pool_chunk_size):
+            re_pool, im_pool = torch.chunk(pool_chunk.unsqueeze(0), 2, dim=2)
+            score = torch.stack([re_query - re_pool, im_query - im_pool], dim = 0)
+            distances.append(score.norm(dim = 0).sum(dim = 2))
+
+        return self.gamma.item() - torch.cat(distances, dim=1)
+
+    def pRotatE_Pool(self, head, relation, tail, pool, mode):
+        phase_relation = relation/(self.embedding_range.item()/torch.pi)
+
+        # |sin(h + r - t)| = |sin((h + r) - t)| = |sin((t - r) - h)|
+        if mode == 'head-shared':
+            phase_query = tail/(self.embedding_range.item()/torch.pi) - phase_relation
+        else:
+            phase_query = head/(self.embedding_range.item()/torch.pi) + phase_relation
+
+        phase_query = phase_query.unsqueeze(1)
+        distances = []
+        for pool_chunk in torch.split(pool, self.pool_chunk_size):
+            phase_pool = pool_chunk.unsqueeze(0)/(self.embedding_range.item()/torch.pi)
+            distances.append(torch.abs(torch.sin(phase_query - phase_pool)).sum(dim = 2))
+
+        return self.gamma.item() - torch.cat(distances, dim=1) * self.modulus
+
+    #-----------------------------------------------------------------------
+    'All-Entity Scoring'
+
+    def score_all_tails(
+        self,
+        head_ids: torch.Tensor,
+        relation_ids: torch.Tensor,
+        chunk_size: Optional[int] = None,
+        k: Optional[int] = None,
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Scores (head, relation, ?) against every entity, streaming the entity embeddings by chunks through the pool
+        scoring functions (matmul for DistMult/ComplEx, no [batch_size, nentity, dim] intermediate).
+
+        Args:
+            head_ids (torch.Tensor): Head of every query. Shape: [batch_size]
+            relation_ids (torch.Tensor): Relation of every query. Shape: [batch_size]
+            chunk_size (Optional[int]): Number of entities scored at once, pool_chunk_size by default.
+            k (Optional[int]): Only keep the k best entities of every query.
+
+        Returns:
+            The score of every entity, Shape: [batch_size, nentity]
+            or, with k, the (scores, entity ids) of the k best entities in decreasing order, Shape: [batch_size, k]
+        """
+        head = torch.index_select(self.entity_embedding, dim=0, index=head_ids)
+        return self._score_all_entities(head, relation_ids, None, 'tail-shared', chunk_size, k)
+
+    def score_all_heads(
+        self,
+        relation_ids: torch.Tensor,
+        tail_ids: torch.Tensor,
+        chunk_size: Optional[int] = None,
+        k: Optional[int] = None,
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Scores (?, relation, tail) against every entity, see `score_all_tails`.
+        """
+        tail = torch.index_select(self.entity_embedding, dim=0, index=tail_ids)
+        return self._score_all_entities(None, relation_ids, tail, 'head-shared', chunk_size, k)
+
+    def _score_all_entities(self, head, relation_ids, tail, mode, chunk_size, k):
+        if self.model_name not in self.pool_func:
+            raise ValueError('model %s not supported' % self.model_name)
+        if k is not None and not 0 < k <= self.nentity:
+            raise ValueError('k should be in [1, %d], got %d' % (self.nentity, k))
+
+        relation = torch.index_select(self.relation_embedding, dim=0, index=relation_ids)
+        if self.autoencoder_flag:
+            relation = self.relation_decoder(self.relation_encoder(relation))
+
+        score_func = self.pool_func[self.model_name]
+        chunk_size = chunk_size or self.pool_chunk_size
+        scores, top_scores, top_ids = [], None, None
+        for start in range(0, self.nentity, chunk_size):
+            pool = self.entity_embedding[start:start + chunk_size]
+            score = score_func(head, relation, tail, pool, mode)
+            if k is None:
+                scores.append(score)
+                continue
+
+            # Running top-k: merge the best entities so far with the chunk
+            chunk_ids = torch.arange(start, start + len(pool), device=score.device).expand_as(score)
+            if top_scores is not None:
+                score = torch.cat([top_scores, score], dim=1)
+                chunk_ids = torch.cat([top_ids, chunk_ids], dim=1)
+            top_scores, top_args = score.topk(min(k, score.size(1)), dim=1)
+            top_ids = chunk_ids.gather(1, top_args)
+
+        if k is None:
+            return torch.cat(scores, dim=1)
+        return top_scores, top_ids
     
     #-----------------------------------------------------------------------
     'Training and Evaluation'
@@ -440,10 +626,27 @@ class KGEModel(nn.Module):
 
         negative_score, negative_mse = model((positive_sample, negative_sample), mode=mode)
 
+        if mode in ('head-shared', 'tail-shared'):
+            # The shared pool is not filtered, drop the entries equal to the answer of the row
+            answer = positive_sample[:, 0] if mode == 'head-shared' else positive_sample[:, 2]
+            negative_mask = negative_sample.unsqueeze(0) != answer.unsqueeze(1)
+        else:
+            negative_mask = None
+
         if args.negative_adversarial_sampling:
             #In self-adversarial sampling, we do not apply back-propagation on the sampling weight
-            negative_score = (F.softmax(negative_score * args.adversarial_temperature, dim = 1).detach() 
-                              * F.logsigmoid(-negative_score)).sum(dim = 1)
+            adversarial_score = negative_score * args.adversarial_temperature
+            if negative_mask is not None:
+                # Rows without any negative get zero weights instead of NaN
+                adversarial_score = adversarial_score.masked_fill(~negative_mask, float('-inf'))
+                adversarial_weight = F.softmax(adversarial_score, dim = 1).nan_to_num(0.0)
+            else:
+                adversarial_weight = F.softmax(adversarial_score, dim = 1)
+            negative_score = (adversarial_weight.detach() * F.logsigmoid(-negative_score)).sum(dim = 1)
+        elif negative_mask is not None:
+            negative_mask = negative_mask.float()
+            negative_score = (F.logsigmoid(-negative_score) * negative_mask).sum(dim = 1) \
+                / negative_mask.sum(dim = 1).clamp(min = 1)
         else:
             negative_score = F.logsigmoid(-negative_score).mean(dim = 1)
 
@@ -502,9 +705,10 @@ class KGEModel(nn.Module):
 
     
     @staticmethod
-    def test_step(model, test_triples, all_true_triples, args):
+    def test_step(model, test_triples, all_true_triples, args, return_ranks=False):
         '''
         Evaluate the model on test or valid datasets
+        With return_ranks, also return the filtered rank of every (head-batch, then tail-batch) query
         '''
         
         model.eval()
@@ -537,86 +741,76 @@ class KGEModel(nn.Module):
         else:
             #Otherwise use standard (filtered) MRR, MR, HITS@1, HITS@3, and HITS@10 metrics
             #Prepare dataloader for evaluation
+            filter_index = TestDataset.build_filter_index(all_true_triples, args.nentity, args.nrelation)
+            test_dataset_head = TestDataset(
+                test_triples, 
+                all_true_triples, 
+                args.nentity, 
+                args.nrelation, 
+                'head-batch',
+                filter_index,
+            )
             test_dataloader_head = DataLoader(
-                TestDataset(
-                    test_triples, 
-                    all_true_triples, 
-                    args.nentity, 
-                    args.nrelation, 
-                    'head-batch'
-                ), 
+                test_dataset_head, 
                 batch_size=args.test_batch_size,
                 num_workers=max(1, args.cpu_num//2), 
-                collate_fn=TestDataset.collate_fn
+                collate_fn=test_dataset_head.collate_fn
             )
 
+            test_dataset_tail = TestDataset(
+                test_triples, 
+                all_true_triples, 
+                args.nentity, 
+                args.nrelation, 
+                'tail-batch',
+                filter_index,
+            )
             test_dataloader_tail = DataLoader(
-                TestDataset(
-                    test_triples, 
-                    all_true_triples, 
-                    args.nentity, 
-                    args.nrelation, 
-                    'tail-batch'
-                ), 
+                test_dataset_tail, 
                 batch_size=args.test_batch_size,
                 num_workers=max(1, args.cpu_num//2), 
-                collate_fn=TestDataset.collate_fn
+                collate_fn=test_dataset_tail.collate_fn
             )
             
             test_dataset_list = [test_dataloader_head, test_dataloader_tail]
             
-            logs = []
+            ranking = FilteredRanking()
 
             step = 0
             total_steps = sum([len(dataset) for dataset in test_dataset_list])
 
             with torch.no_grad():
                 for test_dataset in test_dataset_list:
-                    for positive_sample, negative_sample, filter_bias, mode in test_dataset:
+                    for positive_sample, negative_sample, filter_indices, mode in test_dataset:
                         if args.cuda:
                             positive_sample = positive_sample.cuda()
-                            negative_sample = negative_sample.cuda()
-                            filter_bias = filter_bias.cuda()
+                            filter_indices = filter_indices.cuda()
 
                         batch_size = positive_sample.size(0)
 
-                        # during test we don't need to calculate the mse loss
-                        score, _ = model((positive_sample, negative_sample), mode)
-                        score += filter_bias
-
-                        #Explicitly sort all the entities to ensure that there is no test exposure bias
-                        argsort = torch.argsort(score, dim = 1, descending=True)
-
+                        # Every entity is a candidate: stream the entity embeddings instead of
+                        # scoring the [batch_size, nentity] negative_sample through forward
                         if mode == 'head-batch':
+                            score = model.score_all_heads(positive_sample[:, 1], positive_sample[:, 2])
                             positive_arg = positive_sample[:, 0]
                         elif mode == 'tail-batch':
+                            score = model.score_all_tails(positive_sample[:, 0], positive_sample[:, 1])
                             positive_arg = positive_sample[:, 2]
                         else:
                             raise ValueError('mode %s not supported' % mode)
+                        TestDataset.filter_scores(score, filter_indices)
 
-                        for i in range(batch_size):
-                            #Notice that argsort is not ranking
-                            ranking = (argsort[i, :] == positive_arg[i]).nonzero()
-                            assert ranking.size(0) == 1
-
-                            #ranking + 1 is the true ranking used in evaluation metrics
-                            ranking = 1 + ranking.item()
-                            logs.append({
-                                'MRR': 1.0/ranking,
-                                'MR': float(ranking),
-                                'HITS@1': 1.0 if ranking <= 1 else 0.0,
-                                'HITS@3': 1.0 if ranking <= 3 else 0.0,
-                                'HITS@10': 1.0 if ranking <= 10 else 0.0,
-                            })
+                        #Filtered ranks are counted on-device, no sort over all the entities
+                        ranking.update(score, positive_arg)
 
                         if step % args.test_log_steps == 0:
                             logging.info('Evaluating the model... (%d/%d)' % (step, total_steps))
 
                         step += 1
 
-            metrics = {}
-            for metric in logs[0].keys():
-                metrics[metric] = sum([log[metric] for log in logs])/len(logs)
+            metrics = ranking.metrics()
+            if return_ranks:
+                return metrics, ranking.ranks()
 
         return metrics
 
@@ -1280,63 +1474,68 @@ class LegacyKGEModel(nn.Module):
 
     @staticmethod
     def test_step(model, test_triples, all_true_triples, 
-                  nentity, nrelation, test_batch_size, cpu_num = 1, cuda = False):
+                  nentity, nrelation, test_batch_size, cpu_num = 1, cuda = False, return_ranks = False):
         """
         Evaluate the model on test or valid datasets
+        With return_ranks, also return the filtered rank of every (head-batch, then tail-batch) query
         """
         if cuda: model.cuda()
         model.eval()
             
         #Otherwise use standard (filtered) MRR, MR, HITS@1, HITS@3, and HITS@10 metrics
         #Prepare dataloader for evaluation
+        filter_index = TestDataset.build_filter_index(all_true_triples, nentity, nrelation)
+        test_dataset_head = TestDataset(
+            test_triples, 
+            all_true_triples, 
+            nentity, 
+            nrelation, 
+            'head-batch',
+            filter_index,
+            with_negative_sample=True,
+        )
         test_dataloader_head = DataLoader(
-            TestDataset(
-                test_triples, 
-                all_true_triples, 
-                nentity, 
-                nrelation, 
-                'head-batch'
-            ), 
+            test_dataset_head, 
             batch_size=test_batch_size,
             num_workers=max(1, cpu_num//2), 
-            collate_fn=TestDataset.collate_fn
+            collate_fn=test_dataset_head.collate_fn
         )
 
+        test_dataset_tail = TestDataset(
+            test_triples, 
+            all_true_triples, 
+            nentity, 
+            nrelation, 
+            'tail-batch',
+            filter_index,
+            with_negative_sample=True,
+        )
         test_dataloader_tail = DataLoader(
-            TestDataset(
-                test_triples, 
-                all_true_triples, 
-                nentity, 
-                nrelation, 
-                'tail-batch'
-            ), 
+            test_dataset_tail, 
             batch_size=test_batch_size,
             num_workers=max(1, cpu_num//2), 
-            collate_fn=TestDataset.collate_fn
+            collate_fn=test_dataset_tail.collate_fn
         )
         
         test_dataset_list = [test_dataloader_head, test_dataloader_tail]
         
-        logs = []
+        ranking = FilteredRanking()
 
         step = 0
         total_steps = sum([len(dataset) for dataset in test_dataset_list])
 
         with torch.no_grad():
             for test_dataset in test_dataset_list:
-                for positive_sample, negative_sample, filter_bias, mode in test_dataset:
+                for positive_sample, negative_sample, filter_indices, mode in test_dataset:
                     if cuda:
                         positive_sample = positive_sample.cuda()
                         negative_sample = negative_sample.cuda()
-                        filter_bias = filter_bias.cuda()
+                        filter_indices = filter_indices.cuda()
 
                     batch_size = positive_sample.size(0)
 
                     score, _, _, _ = model((positive_sample, negative_sample), mode)
-                    score += filter_bias
-
-                    #Explicitly sort all the entities to ensure that there is no test exposure bias
-                    argsort = torch.argsort(score, dim = 1, descending=True)
+                    TestDataset.filter_scores(score, filter_indices)
 
                     if mode == 'head-batch':
                         positive_arg = positive_sample[:, 0]
@@ -1345,26 +1544,14 @@ class LegacyKGEModel(nn.Module):
                     else:
                         raise ValueError('mode %s not supported' % mode)
 
-                    for i in range(batch_size):
-                        #Notice that argsort is not ranking
-                        ranking = (argsort[i, :] == positive_arg[i]).nonzero()
-                        assert ranking.size(0) == 1
-
-                        #ranking + 1 is the true ranking used in evaluation metrics
-                        ranking = 1 + ranking.item()
-                        logs.append({
-                            'MRR': 1.0/ranking,
-                            'MR': float(ranking),
-                            'HITS@1': 1.0 if ranking <= 1 else 0.0,
-                            'HITS@3': 1.0 if ranking <= 3 else 0.0,
-                            'HITS@10': 1.0 if ranking <= 10 else 0.0,
-                        })
+                    #Filtered ranks are counted on-device, no sort over all the entities
+                    ranking.update(score, positive_arg)
 
                     step += 1
                     print(f"Step: {step}/{total_steps}")
 
-        metrics = {}
-        for metric in logs[0].keys():
-            metrics[metric] = sum([log[metric] for log in logs])/len(logs)
+        metrics = ranking.metrics()
 
+        if return_ranks:
+            return metrics, ranking.ranks()
         return metrics
@@ -24,6 +24,7 @@ import multihopkg.data_utils as data_utils
 import multihopkg.eval
 from multihopkg.hyperparameter_range import hp_range
 from multihopkg.knowledge_graph import KnowledgeGraph
+from multihopkg.graph_csr import GRAPH_STORE_DIRNAME
 from multihopkg.emb.fact_network import ComplEx, ConvE, DistMult
 from multihopkg.emb.fact_network import get_conve_kg_state_dict, get_complex_kg_state_dict, get_distmult_kg_state_dict
 from multihopkg.emb.emb import EmbeddingBasedMethod
@@ -229,8 +230,8 @@ def train(lf):
         add_reverse_relations=args.add_reversed_training_edges)
     # NELL is a dataset
     if 'NELL' in args.data_dir:
-        adj_list_path = os.path.join(args.data_dir, 'adj_list.pkl')
-        seen_entities = data_utils.load_seen_entities(adj_list_path, entity_index_path)
+        graph_store_dir = os.path.join(args.data_dir, GRAPH_STORE_DIRNAME)
+        seen_entities = data_utils.load_seen_entities(graph_store_dir, entity_index_path)
     else:
         seen_entities = set()
     dev_data = data_utils.load_triples(dev_path, entity_index_path, relation_index_path, seen_entities=seen_entities)
@@ -258,8 +259,8 @@ def inference(lf):
     entity_index_path = os.path.join(args.data_dir, 'entity2id.txt')
     relation_index_path = os.path.join(args.data_dir, 'relation2id.txt')
     if 'NELL' in args.data_dir:
-        adj_list_path = os.path.join(args.data_dir, 'adj_list.pkl')
-        seen_entities = data_utils.load_seen_entities(adj_list_path, entity_index_path)
+        graph_store_dir = os.path.join(args.data_dir, GRAPH_STORE_DIRNAME)
+        seen_entities = data_utils.load_seen_entities(graph_store_dir, entity_index_path)
     else:
         seen_entities = set()
 
@@ -364,8 +365,8 @@ def run_ablation_studies(args):
     entity_index_path = os.path.join(args.data_dir, 'entity2id.txt')
     relation_index_path = os.path.join(args.data_dir, 'relation2id.txt')
     if 'NELL' in args.data_dir:
-        adj_list_path = os.path.join(args.data_dir, 'adj_list.pkl')
-        seen_entities = data_utils.load_seen_entities(adj_list_path, entity_index_path)
+        graph_store_dir = os.path.join(args.data_dir, GRAPH_STORE_DIRNAME)
+        seen_entities = data_utils.load_seen_entities(graph_store_dir, entity_index_path)
     else:
         seen_entities = set()
     dataset = os.path.basename(args.data_dir)
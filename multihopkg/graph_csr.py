@@ -0,0 +1,429 @@
+"""
+Compressed sparse row (CSR) representation of the discrete knowledge graph.
+
+The adjacency list (`adj_list[e1][r] = {e2, ...}`) is flattened once into three arrays:
+- `indptr`: [num_entities + 1] offsets, the outgoing edges of entity e1 are the slice indptr[e1]:indptr[e1 + 1]
+- `relations`: [num_facts] relation id of every edge
+- `targets`: [num_facts] target entity id of every edge
+
+Edges are sorted by (e1, r, e2). Every later step (PageRank bandwidth pruning, padded, bucketed or packed action spaces)
+works on whole arrays with NumPy instead of visiting the graph one scalar at a time.
+
+The arrays are also the on-disk graph store (`save_graph_store` / `load_graph_store`): one `.npy` file per array plus a
+small JSON header, memory-mapped on load. `convert_pickled_graph` migrates the `adj_list.pkl`/`entity2typeid.pkl`
+files written by older versions of `data_utils.prepare_kb_envrioment`, and `ensure_graph_store` converts them again
+whenever they are newer than the store (the header records the modification time of its sources).
+"""
+
+import json
+import logging
+import os
+import pickle
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GRAPH_STORE_DIRNAME = "graph_store"
+GRAPH_STORE_VERSION = 1
+# Legacy pickles a graph store can be converted from, see `convert_pickled_graph`
+PICKLED_GRAPH_FILES = ("adj_list.pkl", "entity2typeid.pkl")
+
+AdjList = Dict[int, Dict[int, Set[int]]]
+
+
+@dataclass
+class GraphCSR:
+    indptr: np.ndarray  # [num_entities + 1]
+    relations: np.ndarray  # [num_facts]
+    targets: np.ndarray  # [num_facts]
+
+    @property
+    def num_entities(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def num_facts(self) -> int:
+        return len(self.targets)
+
+    @property
+    def out_degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    @property
+    def sources(self) -> np.ndarray:
+        """Source entity of every edge. Shape: [num_facts]"""
+        return np.repeat(np.arange(self.num_entities, dtype=np.int64), self.out_degrees)
+
+    @classmethod
+    def from_triples(
+        cls, sources: np.ndarray, relations: np.ndarray, targets: np.ndarray, num_entities: int
+    ) -> "GraphCSR":
+        """
+        Builds the CSR arrays from parallel arrays of (e1, r, e2) ids. Duplicated triples are kept once.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        relations = np.asarray(relations, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+
+        order = np.lexsort((targets, relations, sources))
+        sources, relations, targets = sources[order], relations[order], targets[order]
+        if len(sources) > 0:
+            keep = np.ones(len(sources), dtype=bool)
+            keep[1:] = (np.diff(sources) != 0) | (np.diff(relations) != 0) | (np.diff(targets) != 0)
+            sources, relations, targets = sources[keep], relations[keep], targets[keep]
+
+        indptr = np.zeros(num_entities + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_entities), out=indptr[1:])
+        return cls(indptr=indptr, relations=relations, targets=targets)
+
+    @classmethod
+    def from_adj_list(cls, adj_list: AdjList, num_entities: int) -> "GraphCSR":
+        """
+        Flattens the (pickled) adjacency list used by `KnowledgeGraph`.
+        """
+        sources, relations, targets = [], [], []
+        for e1, r_targets in adj_list.items():
+            for r, e2s in r_targets.items():
+                sources.append(np.full(len(e2s), e1, dtype=np.int64))
+                relations.append(np.full(len(e2s), r, dtype=np.int64))
+                targets.append(np.fromiter(e2s, dtype=np.int64, count=len(e2s)))
+        if not sources:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls.from_triples(empty, empty, empty, num_entities)
+        return cls.from_triples(
+            np.concatenate(sources), np.concatenate(relations), np.concatenate(targets), num_entities
+        )
+
+    def to_adj_list(self) -> AdjList:
+        """
+        Rebuilds the nested adjacency list, for the code paths that still mutate it (e.g. fuzzy facts).
+        """
+        adj_list: AdjList = {}
+        sources = self.sources
+        for e1, r, e2 in zip(sources.tolist(), self.relations.tolist(), self.targets.tolist()):
+            adj_list.setdefault(e1, {}).setdefault(r, set()).add(e2)
+        return adj_list
+
+    def edge_ranks(self) -> np.ndarray:
+        """Position of every edge within the action space of its source entity. Shape: [num_facts]"""
+        return np.arange(self.num_facts, dtype=np.int64) - np.repeat(self.indptr[:-1], self.out_degrees)
+
+
+def prune_by_page_rank(graph: GraphCSR, page_rank_scores: np.ndarray, bandwidth: int) -> GraphCSR:
+    """
+    Base graph pruning of the action spaces. Entities whose action space (with the NO_OP action) reaches
+    `bandwidth` have their edges sorted by the PageRank of the target, in decreasing order, and keep the first
+    `bandwidth` of them. Smaller action spaces are left as they are.
+
+    Args:
+        graph (GraphCSR): The full graph.
+        page_rank_scores (np.ndarray): PageRank score of every entity. Shape: [num_entities]
+        bandwidth (int): Maximum number of (non NO_OP) actions per entity.
+
+    Returns:
+        GraphCSR: The pruned graph.
+    """
+    degrees = graph.out_degrees
+    sources = graph.sources
+    pruned_edges = (degrees + 1 >= bandwidth)[sources]
+    # Sort by source, then (for pruned entities) by decreasing PageRank, ties broken by the (e1, r, e2) order
+    sort_scores = np.where(pruned_edges, -page_rank_scores[graph.targets], 0.0)
+    order = np.lexsort((np.arange(graph.num_facts), sort_scores, sources))
+
+    sorted_graph = GraphCSR(graph.indptr, graph.relations[order], graph.targets[order])
+    keep = sorted_graph.edge_ranks() < bandwidth
+
+    indptr = np.zeros_like(graph.indptr)
+    np.cumsum(np.minimum(degrees, bandwidth), out=indptr[1:])
+    return GraphCSR(indptr=indptr, relations=sorted_graph.relations[keep], targets=sorted_graph.targets[keep])
+
+
+def padded_action_space(
+    graph: GraphCSR,
+    self_relation: int,
+    dummy_relation: int,
+    dummy_entity: int,
+    entities: Optional[np.ndarray] = None,
+    action_space_size: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Builds the padded action space tensors of `entities` in bulk. The first action of every entity is the
+    (self_relation, e1) self-loop, followed by its edges, followed by (dummy_relation, dummy_entity) padding.
+
+    Args:
+        graph (GraphCSR): The (pruned) graph.
+        self_relation (int): Relation id of the NO_OP self-loop.
+        dummy_relation (int): Relation id used for padding.
+        dummy_entity (int): Entity id used for padding.
+        entities (Optional[np.ndarray]): Entities to build the action space of (all of them by default), in row order.
+        action_space_size (Optional[int]): Width of the tensors, defaults to the largest action space.
+
+    Returns:
+        r_space (np.ndarray): Relations of the actions. Shape: [len(entities), action_space_size]
+        e_space (np.ndarray): Target entities of the actions. Shape: [len(entities), action_space_size]
+        action_mask (np.ndarray): 1.0 for real actions, 0.0 for padding. Shape: [len(entities), action_space_size]
+    """
+    if entities is None:
+        entities = np.arange(graph.num_entities, dtype=np.int64)
+    degrees = graph.out_degrees[entities]
+    if action_space_size is None:
+        action_space_size = int(degrees.max(initial=0)) + 1
+
+    num_rows = len(entities)
+    r_space = np.full((num_rows, action_space_size), dummy_relation, dtype=np.int64)
+    e_space = np.full((num_rows, action_space_size), dummy_entity, dtype=np.int64)
+    action_mask = np.zeros((num_rows, action_space_size), dtype=np.float32)
+    r_space[:, 0] = self_relation
+    e_space[:, 0] = entities
+    action_mask[:, 0] = 1
+
+    # Gather the CSR segments of the requested entities into one flat edge list
+    rows = np.repeat(np.arange(num_rows, dtype=np.int64), degrees)
+    offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(degrees, out=offsets[1:])
+    cols = np.arange(len(rows), dtype=np.int64) - offsets[rows]
+    edges = graph.indptr[entities][rows] + cols
+
+    r_space[rows, cols + 1] = graph.relations[edges]
+    e_space[rows, cols + 1] = graph.targets[edges]
+    action_mask[rows, cols + 1] = 1
+    return r_space, e_space, action_mask
+
+
+def bucket_action_space(
+    graph: GraphCSR,
+    bucket_interval: int,
+    self_relation: int,
+    dummy_relation: int,
+    dummy_entity: int,
+) -> Tuple[Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]], np.ndarray]:
+    """
+    Groups the entities by action space size: entities with n actions (NO_OP included) go to bucket
+    key = n // bucket_interval + 1, whose tensors are `key * bucket_interval` wide.
+
+    Returns:
+        buckets (Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]]): (r_space, e_space, action_mask) of each bucket,
+            see `padded_action_space`.
+        entity2bucketid (np.ndarray): (bucket key, row within the bucket) of every entity. Shape: [num_entities, 2]
+    """
+    keys = (graph.out_degrees + 1) // bucket_interval + 1
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    bucket_keys, bucket_starts = np.unique(sorted_keys, return_index=True)
+
+    entity2bucketid = np.zeros((graph.num_entities, 2), dtype=np.int64)
+    entity2bucketid[:, 0] = keys
+    entity2bucketid[order, 1] = np.arange(graph.num_entities) - np.repeat(
+        bucket_starts, np.diff(np.append(bucket_starts, graph.num_entities))
+    )
+
+    buckets = {}
+    for key, start, end in zip(bucket_keys, bucket_starts, np.append(bucket_starts[1:], graph.num_entities)):
+        buckets[int(key)] = padded_action_space(
+            graph,
+            self_relation,
+            dummy_relation,
+            dummy_entity,
+            entities=order[start:end],
+            action_space_size=int(key) * bucket_interval,
+        )
+    return buckets, entity2bucketid
+
+
+def packed_action_space(graph: GraphCSR, self_relation: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Builds the ragged action space of every entity without padding: the actions of entity e1 are the slice
+    offsets[e1]:offsets[e1 + 1] of the flat arrays, the (self_relation, e1) self-loop first, followed by its edges
+    in the same order as `padded_action_space`.
+
+    Returns:
+        offsets (np.ndarray): Start of the actions of every entity. Shape: [num_entities + 1]
+        r_space (np.ndarray): Relations of the actions. Shape: [num_facts + num_entities]
+        e_space (np.ndarray): Target entities of the actions. Shape: [num_facts + num_entities]
+    """
+    num_entities = graph.num_entities
+    offsets = np.asarray(graph.indptr, dtype=np.int64) + np.arange(num_entities + 1, dtype=np.int64)
+    is_self_loop = np.zeros(offsets[-1], dtype=bool)
+    is_self_loop[offsets[:-1]] = True
+
+    r_space = np.empty(offsets[-1], dtype=np.int64)
+    e_space = np.empty(offsets[-1], dtype=np.int64)
+    r_space[is_self_loop] = self_relation
+    e_space[is_self_loop] = np.arange(num_entities, dtype=np.int64)
+    r_space[~is_self_loop] = graph.relations
+    e_space[~is_self_loop] = graph.targets
+    return offsets, r_space, e_space
+
+
+def unique_relation_space(graph: GraphCSR) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Distinct outgoing relations of every entity, in the CSR layout of the graph: the relations of entity e1 are
+    relations[offsets[e1]:offsets[e1 + 1]], sorted. Edges are sorted by (e1, r, e2), so this is a single pass over
+    the relation changes.
+
+    Returns:
+        offsets (np.ndarray): Start of the relations of every entity. Shape: [num_entities + 1]
+        relations (np.ndarray): Sorted distinct relations of every entity. Shape: [num_entity_relation_pairs]
+    """
+    sources = graph.sources
+    relations = np.asarray(graph.relations, dtype=np.int64)
+    keep = np.ones(len(relations), dtype=bool)
+    keep[1:] = (np.diff(sources) != 0) | (np.diff(relations) != 0)
+
+    offsets = np.zeros(graph.num_entities + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources[keep], minlength=graph.num_entities), out=offsets[1:])
+    return offsets, relations[keep]
+
+
+def graph_store_exists(store_dir: str) -> bool:
+    return os.path.exists(os.path.join(store_dir, "header.json"))
+
+
+def graph_store_is_stale(store_dir: str, data_dir: str) -> bool:
+    """
+    Whether the store is missing, has another format version, or is older than one of the legacy pickles of
+    `data_dir` (compared with the `source_mtime` of its header).
+    """
+    if not graph_store_exists(store_dir):
+        return True
+    with open(os.path.join(store_dir, "header.json")) as f:
+        header = json.load(f)
+    if header.get("format_version") != GRAPH_STORE_VERSION:
+        return True
+    source_mtime = header.get("source_mtime", os.path.getmtime(os.path.join(store_dir, "header.json")))
+    return any(
+        os.path.getmtime(path) > source_mtime
+        for path in (os.path.join(data_dir, name) for name in PICKLED_GRAPH_FILES)
+        if os.path.exists(path)
+    )
+
+
+def ensure_graph_store(data_dir: str, store_dir: Optional[str] = None) -> str:
+    """
+    Returns the graph store of `data_dir`, (re)converting it from the legacy pickles when it is missing or stale.
+    """
+    store_dir = store_dir or os.path.join(data_dir, GRAPH_STORE_DIRNAME)
+    if graph_store_is_stale(store_dir, data_dir):
+        if graph_store_exists(store_dir):
+            logger.info(f"Graph store at {store_dir} is older than the pickles of {data_dir}, converting them again")
+        convert_pickled_graph(data_dir, store_dir)
+    return store_dir
+
+
+def save_graph_store(
+    store_dir: str,
+    graph: GraphCSR,
+    entity2typeid: Optional[Union[Sequence[int], np.ndarray]] = None,
+    source_paths: Sequence[str] = (),
+) -> None:
+    """
+    Writes the graph as `indptr.npy`, `relations.npy`, `targets.npy` (and `entity2typeid.npy`) plus `header.json`.
+    Relation and entity ids are stored as int32 when they fit.
+
+    Args:
+        store_dir (str): Directory of the store, created if needed.
+        graph (GraphCSR): The graph to save.
+        entity2typeid (Optional[Union[Sequence[int], np.ndarray]]): Type id of every entity.
+        source_paths (Sequence[str]): Files the graph was read from. The header records their latest modification
+            time (the current time if there are none), see `graph_store_is_stale`.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    id_dtype = np.int32 if max(graph.num_entities, int(graph.relations.max(initial=0)) + 1) < 2**31 else np.int64
+    arrays = {
+        "indptr": graph.indptr.astype(np.int64),
+        "relations": graph.relations.astype(id_dtype),
+        "targets": graph.targets.astype(id_dtype),
+    }
+    if entity2typeid is not None:
+        arrays["entity2typeid"] = np.asarray(entity2typeid, dtype=id_dtype)
+    for name, array in arrays.items():
+        np.save(os.path.join(store_dir, f"{name}.npy"), array)
+
+    header = {
+        "format_version": GRAPH_STORE_VERSION,
+        "num_entities": graph.num_entities,
+        "num_facts": graph.num_facts,
+        "source_mtime": max((os.path.getmtime(path) for path in source_paths), default=time.time()),
+        "arrays": {name: {"dtype": str(array.dtype), "shape": list(array.shape)} for name, array in arrays.items()},
+    }
+    # The header is written last, so a store is only picked up once all its arrays exist
+    with open(os.path.join(store_dir, "header.json"), "w") as f:
+        json.dump(header, f, indent=2)
+    logger.info(f"Saved graph store with {graph.num_facts} facts at {store_dir}")
+
+
+def load_graph_store(store_dir: str, mmap: bool = True) -> Tuple[GraphCSR, Optional[np.ndarray]]:
+    """
+    Loads a graph store written by `save_graph_store`.
+
+    Args:
+        store_dir (str): Directory of the store.
+        mmap (bool): If True, the arrays are memory-mapped (read-only) instead of read into memory.
+
+    Returns:
+        graph (GraphCSR): The graph.
+        entity2typeid (Optional[np.ndarray]): Type id of every entity, if it was stored.
+    """
+    with open(os.path.join(store_dir, "header.json")) as f:
+        header = json.load(f)
+    if header["format_version"] != GRAPH_STORE_VERSION:
+        raise ValueError(
+            f"Graph store at {store_dir} has format version {header['format_version']}, expected {GRAPH_STORE_VERSION}."
+        )
+
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in header["arrays"]
+    }
+    graph = GraphCSR(indptr=arrays["indptr"], relations=arrays["relations"], targets=arrays["targets"])
+    assert graph.num_entities == header["num_entities"] and graph.num_facts == header["num_facts"], (
+        f"Graph store at {store_dir} does not match its header"
+    )
+    return graph, arrays.get("entity2typeid")
+
+
+def convert_pickled_graph(data_dir: str, store_dir: Optional[str] = None, num_entities: Optional[int] = None) -> str:
+    """
+    Converts the `adj_list.pkl` (and `entity2typeid.pkl`, if present) of `data_dir` into a graph store.
+
+    Args:
+        data_dir (str): Directory holding the pickles (and `entity2id.txt`).
+        store_dir (Optional[str]): Output directory, defaults to `<data_dir>/graph_store`.
+        num_entities (Optional[int]): Number of entities, defaults to the number of lines of `entity2id.txt`.
+
+    Returns:
+        str: The directory of the graph store.
+    """
+    store_dir = store_dir or os.path.join(data_dir, GRAPH_STORE_DIRNAME)
+    if num_entities is None:
+        with open(os.path.join(data_dir, "entity2id.txt")) as f:
+            num_entities = sum(1 for _ in f)
+
+    adj_list_path = os.path.join(data_dir, "adj_list.pkl")
+    with open(adj_list_path, "rb") as f:
+        adj_list = pickle.load(f)
+    source_paths = [adj_list_path]
+    entity2typeid = None
+    entity2typeid_path = os.path.join(data_dir, "entity2typeid.pkl")
+    if os.path.exists(entity2typeid_path):
+        with open(entity2typeid_path, "rb") as f:
+            entity2typeid = pickle.load(f)
+        source_paths.append(entity2typeid_path)
+
+    save_graph_store(store_dir, GraphCSR.from_adj_list(adj_list, num_entities), entity2typeid, source_paths)
+    return store_dir
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert adj_list.pkl/entity2typeid.pkl into a binary graph store.")
+    parser.add_argument("data_dir", type=str, help="Directory holding adj_list.pkl and entity2id.txt")
+    parser.add_argument("--store_dir", type=str, default=None, help="Output directory (default: <data_dir>/graph_store)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print("Graph store written to {}".format(convert_pickled_graph(args.data_dir, args.store_dir)))
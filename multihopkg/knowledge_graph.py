@@ -19,6 +19,13 @@ from multihopkg.data_utils import load_index
 from multihopkg.data_utils import NO_OP_ENTITY_ID, NO_OP_RELATION_ID
 from multihopkg.data_utils import DUMMY_ENTITY_ID, DUMMY_RELATION_ID
 from multihopkg.data_utils import START_RELATION_ID
+from multihopkg.answer_index import AnswerIndex
+from multihopkg.graph_csr import GraphCSR
+from multihopkg.graph_csr import ensure_graph_store, load_graph_store
+from multihopkg.graph_csr import bucket_action_space, packed_action_space, padded_action_space, prune_by_page_rank
+from multihopkg.graph_csr import unique_relation_space
+from multihopkg.relation_adjacency import RelationAdjacency
+from multihopkg.triple_io import load_triple_ids
 from multihopkg.logging import setup_logger
 from multihopkg.exogenous.sun_models import KGEModel
 from multihopkg.utils.metacode import stale_code
@@ -31,9 +38,26 @@ import numpy as np
 
 import sys
 
+
+def answers_to_var(d_l):
+    """
+    Turns nested answer sets into nested [num_answers, 1] tensors.
+    """
+    d_v = collections.defaultdict(collections.defaultdict)
+    for x in d_l:
+        for y in d_l[x]:
+            v = torch.LongTensor(list(d_l[x][y])).unsqueeze(1)
+            d_v[x][y] = int_var_cuda(v)
+    return d_v
+
+
 class KnowledgeGraph(nn.Module):
     """
     The discrete knowledge graph is stored with an adjacency list.
+
+    `use_action_space_packing` is a constructor option only (there is no command line flag, the entry points do
+    not build KnowledgeGraph from their arguments): pass `use_action_space_packing=True` to store the action spaces
+    as flat ragged arrays instead of padded or bucketed ones.
     """
 
     def __init__(
@@ -49,6 +73,7 @@ class KnowledgeGraph(nn.Module):
         bucket_interval: int,
         test: bool,
         relation_only: bool,
+        use_action_space_packing: bool = False,
     ):
         super(KnowledgeGraph, self).__init__()
         self.entity2id, self.id2entity = {}, {}
@@ -56,34 +81,33 @@ class KnowledgeGraph(nn.Module):
         self.type2id, self.id2type = {}, {}
         self.entity2typeid = {}
         self.adj_list = None
+        self.csr_graph = None
         self.bandwidth = bandwidth
 
         self.action_space = None
         self.action_space_buckets = None
-        self.unique_r_space = None
+        self.packed_action_space = None
+        self.use_action_space_packing = use_action_space_packing
+        self._unique_r_space = None
+        self._unique_r_keys = None
+        self._relation_adjacency = None
         self.relation_only = relation_only
 
-        self.train_subjects = None
-        self.train_objects = None
-        self.dev_subjects = None
-        self.dev_objects = None
-        self.all_subjects = None
-        self.all_objects = None
-        self.train_subject_vectors = None
-        self.train_object_vectors = None
-        self.dev_subject_vectors = None
-        self.dev_object_vectors = None
-        self.all_subject_vectors = None
-        self.all_object_vectors = None
+        # Answer sets of every split (see `load_all_answers`)
+        self.train_answers = None
+        self.dev_answers = None
+        self.all_answers = None
+        self._legacy_answer_views = {}
 
-        print("** Create {} knowledge graph **".format(model))
-        self.load_graph_data(data_dir)
-        self.load_all_answers(data_dir)
+        self.model = model
         self.data_dir = data_dir
         self.use_action_space_bucketing = use_action_space_bucketing
         self.bucket_interval = bucket_interval
         self.test = test
-        self.relation_only = relation_only
+
+        print("** Create {} knowledge graph **".format(model))
+        self.load_graph_data(data_dir)
+        self.load_all_answers(data_dir)
 
         # Define NN Modules
         self.entity_dim = entity_dim
@@ -109,8 +133,9 @@ class KnowledgeGraph(nn.Module):
         print("Sanity check: {} entities loaded".format(len(self.entity2id)))
         self.type2id, self.id2type = load_index(os.path.join(data_dir, "type2id.txt"))
         print("Sanity check: {} types loaded".format(len(self.type2id)))
-        with open(os.path.join(data_dir, "entity2typeid.pkl"), "rb") as f:
-            self.entity2typeid = pickle.load(f)
+        # Binary graph store (memory-mapped CSR arrays), converted from the legacy pickles when they are newer
+        # Base graph structure used for training and test
+        self.csr_graph, self.entity2typeid = load_graph_store(ensure_graph_store(data_dir))
         self.relation2id, self.id2relation = load_index(
             os.path.join(data_dir, "relation2id.txt")
         )
@@ -118,215 +143,218 @@ class KnowledgeGraph(nn.Module):
 
         # Load graph structures
         if self.model.startswith("point"):
-            # Base graph structure used for training and test
-            adj_list_path = os.path.join(data_dir, "adj_list.pkl")
-            with open(adj_list_path, "rb") as f:
-                self.adj_list = pickle.load(f)
             self.vectorize_action_space(data_dir)
 
     def vectorize_action_space(self, data_dir):
         """
         Pre-process and numericalize the knowledge graph structure.
+        The adjacency list is flattened into CSR arrays (see `multihopkg.graph_csr`), pruned by PageRank and
+        turned into padded, bucketed or packed action space tensors in bulk.
         """
 
         def load_page_rank_scores(input_path):
-            pgrk_scores = collections.defaultdict(float)
+            pgrk_scores = np.zeros(self.num_entities, dtype=np.float64)
             with open(input_path) as f:
                 for line in f:
                     e, score = line.strip().split(":")
                     e_id = self.entity2id[e.strip()]
-                    score = float(score)
-                    pgrk_scores[e_id] = score
+                    pgrk_scores[e_id] = float(score)
             return pgrk_scores
 
+        def to_action_space_tensors(r_space, e_space, action_mask):
+            return (
+                (int_var_cuda(torch.from_numpy(r_space)), int_var_cuda(torch.from_numpy(e_space))),
+                var_cuda(torch.from_numpy(action_mask)),
+            )
+
+        if self.adj_list is not None:
+            # The adjacency list was extended in memory (e.g. fuzzy facts), rebuild the CSR arrays from it
+            self.csr_graph = GraphCSR.from_adj_list(self.adj_list, self.num_entities)
+            self._unique_r_space = None
+            self._unique_r_keys = None
+            self._relation_adjacency = None
+
         # Sanity check
-        num_facts = 0
-        out_degrees = collections.defaultdict(int)
-        for e1 in self.adj_list:
-            for r in self.adj_list[e1]:
-                num_facts += len(self.adj_list[e1][r])
-                out_degrees[e1] += len(self.adj_list[e1][r])
-        print("Sanity check: maximum out degree: {}".format(max(out_degrees.values())))
-        print("Sanity check: {} facts in knowledge graph".format(num_facts))
+        print("Sanity check: maximum out degree: {}".format(self.csr_graph.out_degrees.max()))
+        print("Sanity check: {} facts in knowledge graph".format(self.csr_graph.num_facts))
 
         # load page rank scores
         page_rank_scores = load_page_rank_scores(os.path.join(data_dir, "raw.pgrk"))
+        pruned_graph = prune_by_page_rank(self.csr_graph, page_rank_scores, self.bandwidth)
 
-        def get_action_space(e1):
-            action_space = []
-            if e1 in self.adj_list:
-                for r in self.adj_list[e1]:
-                    targets = self.adj_list[e1][r]
-                    for e2 in targets:
-                        action_space.append((r, e2))
-                if len(action_space) + 1 >= self.bandwidth:
-                    # Base graph pruning
-                    sorted_action_space = sorted(
-                        action_space, key=lambda x: page_rank_scores[x[1]], reverse=True
-                    )
-                    action_space = sorted_action_space[: self.bandwidth]
-            action_space.insert(0, (NO_OP_RELATION_ID, e1))
-            return action_space
-
-        def get_unique_r_space(e1):
-            if e1 in self.adj_list:
-                return list(self.adj_list[e1].keys())
-            else:
-                return []
-
-        def vectorize_action_space(action_space_list, action_space_size):
-            bucket_size = len(action_space_list)
-            r_space = torch.zeros(bucket_size, action_space_size) + self.dummy_r
-            e_space = torch.zeros(bucket_size, action_space_size) + self.dummy_e
-            action_mask = torch.zeros(bucket_size, action_space_size)
-            for i, action_space in enumerate(action_space_list):
-                for j, (r, e) in enumerate(action_space):
-                    r_space[i, j] = r
-                    e_space[i, j] = e
-                    action_mask[i, j] = 1
-            return (int_var_cuda(r_space), int_var_cuda(e_space)), var_cuda(action_mask)
-
-        def vectorize_unique_r_space(
-            unique_r_space_list, unique_r_space_size, volatile
-        ):
-            bucket_size = len(unique_r_space_list)
-            unique_r_space = (
-                torch.zeros(bucket_size, unique_r_space_size) + self.dummy_r
+        if self.use_action_space_packing:
+            """
+            Store action spaces as flat ragged arrays, ((r_space, e_space), offsets).
+            """
+            offsets, r_space, e_space = packed_action_space(pruned_graph, self.self_edge)
+            print("Sanity check: {} actions saved in packed action table".format(len(r_space)))
+            self.packed_action_space = (
+                (int_var_cuda(torch.from_numpy(r_space)), int_var_cuda(torch.from_numpy(e_space))),
+                int_var_cuda(torch.from_numpy(offsets)),
             )
-            for i, u_r_s in enumerate(unique_r_space_list):
-                for j, r in enumerate(u_r_s):
-                    unique_r_space[i, j] = r
-            return int_var_cuda(unique_r_space)
-
-        if self.use_action_space_bucketing:
+        elif self.use_action_space_bucketing:
             """
             Store action spaces in buckets.
             """
-            self.action_space_buckets = {}
-            action_space_buckets_discrete = collections.defaultdict(list)
-            self.entity2bucketid = torch.zeros(self.num_entities, 2).long()
-            num_facts_saved_in_action_table = 0
-            for e1 in range(self.num_entities):
-                action_space = get_action_space(e1)
-                key = int(len(action_space) / self.bucket_interval) + 1
-                self.entity2bucketid[e1, 0] = key
-                self.entity2bucketid[e1, 1] = len(action_space_buckets_discrete[key])
-                action_space_buckets_discrete[key].append(action_space)
-                num_facts_saved_in_action_table += len(action_space)
+            buckets, entity2bucketid = bucket_action_space(
+                pruned_graph, self.bucket_interval, self.self_edge, self.dummy_r, self.dummy_e
+            )
+            self.entity2bucketid = int_var_cuda(torch.from_numpy(entity2bucketid))
             print(
-                "Sanity check: {} facts saved in action table".format(
-                    num_facts_saved_in_action_table - self.num_entities
-                )
+                "Sanity check: {} facts saved in action table".format(pruned_graph.num_facts)
             )
-            for key in action_space_buckets_discrete:
+            self.action_space_buckets = {}
+            for key in buckets:
                 print("Vectorizing action spaces bucket {}...".format(key))
-                self.action_space_buckets[key] = vectorize_action_space(
-                    action_space_buckets_discrete[key], key * self.bucket_interval
-                )
+                self.action_space_buckets[key] = to_action_space_tensors(*buckets[key])
         else:
-            action_space_list = []
-            max_num_actions = 0
-            for e1 in range(self.num_entities):
-                action_space = get_action_space(e1)
-                action_space_list.append(action_space)
-                if len(action_space) > max_num_actions:
-                    max_num_actions = len(action_space)
             print("Vectorizing action spaces...")
-            self.action_space = vectorize_action_space(
-                action_space_list, max_num_actions
+            self.action_space = to_action_space_tensors(
+                *padded_action_space(pruned_graph, self.self_edge, self.dummy_r, self.dummy_e)
             )
 
-            if self.model.startswith("rule"):
-                unique_r_space_list = []
-                max_num_unique_rs = 0
-                for e1 in sorted(self.adj_list.keys()):
-                    unique_r_space = get_unique_r_space(e1)
-                    unique_r_space_list.append(unique_r_space)
-                    if len(unique_r_space) > max_num_unique_rs:
-                        max_num_unique_rs = len(unique_r_space)
-                self.unique_r_space = vectorize_unique_r_space(
-                    unique_r_space_list, max_num_unique_rs
-                )
+    @property
+    def unique_r_space(self):
+        """
+        Distinct outgoing relations of every entity as CSR tensors, (relations, offsets): the relations of e1 are
+        relations[offsets[e1]:offsets[e1 + 1]]. Built from the (unpruned) graph on first access and memoized, so
+        models that never use the relation-only action space (e.g. rule models) don't pay for it.
+        """
+        if self._unique_r_space is None:
+            offsets, relations = unique_relation_space(self.csr_graph)
+            self._unique_r_space = (int_var_cuda(torch.from_numpy(relations)), int_var_cuda(torch.from_numpy(offsets)))
+        return self._unique_r_space
+
+    def get_unique_r_space(self, e):
+        """
+        Distinct outgoing relations of a batch of entities, padded with dummy_r. Shape: [batch_size, max_num_relations]
+        """
+        relations, offsets = self.unique_r_space
+        positions, segment_ids, batch_offsets = ops.gather_segments(offsets, e)
+        return ops.unpack_segments(relations[positions], segment_ids, batch_offsets, self.dummy_r)
+
+    def has_relation(self, e, r):
+        """
+        Whether entity e[i] has at least one outgoing edge labeled r[i] in the (unpruned) graph, looked up in the
+        unique relation space flattened to sorted e1 * num_relations + r keys (memoized).
+        """
+        if self._unique_r_keys is None:
+            relations, offsets = self.unique_r_space
+            sources = torch.repeat_interleave(torch.arange(len(offsets) - 1, device=offsets.device), offsets.diff())
+            self._unique_r_keys = sources * self.num_relations + relations
+        keys = e * self.num_relations + r
+        if len(self._unique_r_keys) == 0:
+            return torch.zeros_like(keys, dtype=torch.bool)
+        positions = torch.searchsorted(self._unique_r_keys, keys).clamp(max=len(self._unique_r_keys) - 1)
+        return self._unique_r_keys[positions] == keys
+
+    @property
+    def relation_adjacency(self):
+        """
+        Per-relation sparse adjacency of the (unpruned) graph, see `RelationAdjacency`, e.g.
+        `kg.relation_adjacency.reachable(e_s, [r1, r2])`. Built on first access and memoized.
+        """
+        if self._relation_adjacency is None:
+            self._relation_adjacency = RelationAdjacency(self.csr_graph, self.num_relations).to(
+                self.relation_embeddings.weight.device
+            )
+        return self._relation_adjacency
 
     def load_all_answers(self, data_dir, add_reversed_edges=False):
-        def add_subject(e1, e2, r, d):
-            if not e2 in d:
-                d[e2] = {}
-            if not r in d[e2]:
-                d[e2][r] = set()
-            d[e2][r].add(e1)
-
-        def add_object(e1, e2, r, d):
-            if not e1 in d:
-                d[e1] = {}
-            if not r in d[e1]:
-                d[e1][r] = set()
-            d[e1][r].add(e2)
-
-        # store subjects for all (rel, object) queries and
-        # objects for all (subject, rel) queries
-        train_subjects, train_objects = {}, {}
-        dev_subjects, dev_objects = {}, {}
-        all_subjects, all_objects = {}, {}
+        """
+        Store subjects for all (rel, object) queries and objects for all (subject, rel) queries as one sorted
+        `AnswerIndex` per split: train (raw.kb + train), dev (+ dev) and all (+ test).
+        """
+        split_triples = {"train": [], "dev": [], "all": []}
         # include dummy examples
-        add_subject(self.dummy_e, self.dummy_e, self.dummy_r, train_subjects)
-        add_subject(self.dummy_e, self.dummy_e, self.dummy_r, dev_subjects)
-        add_subject(self.dummy_e, self.dummy_e, self.dummy_r, all_subjects)
-        add_object(self.dummy_e, self.dummy_e, self.dummy_r, train_objects)
-        add_object(self.dummy_e, self.dummy_e, self.dummy_r, dev_objects)
-        add_object(self.dummy_e, self.dummy_e, self.dummy_r, all_objects)
+        for split in split_triples:
+            split_triples[split].append(np.array([[self.dummy_e, self.dummy_r, self.dummy_e]], dtype=np.int64))
         for file_name in ["raw.kb", "train.triples", "dev.triples", "test.triples"]:
             if "NELL" in self.data_dir and self.test and file_name == "train.triples":
                 continue
-            with open(os.path.join(data_dir, file_name)) as f:
-                for line in f:
-                    e1, e2, r = line.strip().split()
-                    e1, e2, r = self.triple2ids((e1, e2, r))
-                    if file_name in ["raw.kb", "train.triples"]:
-                        add_subject(e1, e2, r, train_subjects)
-                        add_object(e1, e2, r, train_objects)
-                        if add_reversed_edges:
-                            add_subject(
-                                e2, e1, self.get_inv_relation_id(r), train_subjects
-                            )
-                            add_object(
-                                e2, e1, self.get_inv_relation_id(r), train_objects
-                            )
-                    if file_name in ["raw.kb", "train.triples", "dev.triples"]:
-                        add_subject(e1, e2, r, dev_subjects)
-                        add_object(e1, e2, r, dev_objects)
-                        if add_reversed_edges:
-                            add_subject(
-                                e2, e1, self.get_inv_relation_id(r), dev_subjects
-                            )
-                            add_object(e2, e1, self.get_inv_relation_id(r), dev_objects)
-                    add_subject(e1, e2, r, all_subjects)
-                    add_object(e1, e2, r, all_objects)
-                    if add_reversed_edges:
-                        add_subject(e2, e1, self.get_inv_relation_id(r), all_subjects)
-                        add_object(e2, e1, self.get_inv_relation_id(r), all_objects)
-        self.train_subjects = train_subjects
-        self.train_objects = train_objects
-        self.dev_subjects = dev_subjects
-        self.dev_objects = dev_objects
-        self.all_subjects = all_subjects
-        self.all_objects = all_objects
-
-        # change the answer set into a variable
-        def answers_to_var(d_l):
-            d_v = collections.defaultdict(collections.defaultdict)
-            for x in d_l:
-                for y in d_l[x]:
-                    v = torch.LongTensor(list(d_l[x][y])).unsqueeze(1)
-                    d_v[x][y] = int_var_cuda(v)
-            return d_v
-
-        self.train_subject_vectors = answers_to_var(train_subjects)
-        self.train_object_vectors = answers_to_var(train_objects)
-        self.dev_subject_vectors = answers_to_var(dev_subjects)
-        self.dev_object_vectors = answers_to_var(dev_objects)
-        self.all_subject_vectors = answers_to_var(all_subjects)
-        self.all_object_vectors = answers_to_var(all_objects)
+            # Files hold (e1, e2, r) lines
+            triples = load_triple_ids(
+                os.path.join(data_dir, file_name), (self.entity2id, self.entity2id, self.relation2id)
+            )
+            triples = triples[:, [0, 2, 1]].astype(np.int64)
+            if add_reversed_edges:
+                reversed_triples = np.stack(
+                    [triples[:, 2], self.get_inv_relation_id(triples[:, 1]), triples[:, 0]], axis=1
+                )
+                triples = np.concatenate([triples, reversed_triples], axis=0)
+            if file_name in ["raw.kb", "train.triples"]:
+                split_triples["train"].append(triples)
+            if file_name in ["raw.kb", "train.triples", "dev.triples"]:
+                split_triples["dev"].append(triples)
+            split_triples["all"].append(triples)
+
+        for split, triples in split_triples.items():
+            triples = np.concatenate(triples, axis=0)
+            answers = AnswerIndex(
+                triples[:, 0], triples[:, 1], triples[:, 2], self.num_entities, self.num_relations
+            )
+            setattr(self, "{}_answers".format(split), answers)
+        self._legacy_answer_views = {}
+
+    def _legacy_answer_view(self, split, kind, as_vectors):
+        """
+        Nested dictionaries (of sets, or of [num_answers, 1] tensors) of the former `load_all_answers`,
+        built on first access from the split's `AnswerIndex`.
+        """
+        key = (split, kind, as_vectors)
+        if key not in self._legacy_answer_views:
+            answers = getattr(self, "{}_answers".format(split))
+            answer_sets = answers.object_sets() if kind == "objects" else answers.subject_sets()
+            self._legacy_answer_views[key] = answers_to_var(answer_sets) if as_vectors else answer_sets
+        return self._legacy_answer_views[key]
+
+    @property
+    def train_subjects(self):
+        return self._legacy_answer_view("train", "subjects", False)
+
+    @property
+    def train_objects(self):
+        return self._legacy_answer_view("train", "objects", False)
+
+    @property
+    def dev_subjects(self):
+        return self._legacy_answer_view("dev", "subjects", False)
+
+    @property
+    def dev_objects(self):
+        return self._legacy_answer_view("dev", "objects", False)
+
+    @property
+    def all_subjects(self):
+        return self._legacy_answer_view("all", "subjects", False)
+
+    @property
+    def all_objects(self):
+        return self._legacy_answer_view("all", "objects", False)
+
+    @property
+    def train_subject_vectors(self):
+        return self._legacy_answer_view("train", "subjects", True)
+
+    @property
+    def train_object_vectors(self):
+        return self._legacy_answer_view("train", "objects", True)
+
+    @property
+    def dev_subject_vectors(self):
+        return self._legacy_answer_view("dev", "subjects", True)
+
+    @property
+    def dev_object_vectors(self):
+        return self._legacy_answer_view("dev", "objects", True)
+
+    @property
+    def all_subject_vectors(self):
+        return self._legacy_answer_view("all", "subjects", True)
+
+    @property
+    def all_object_vectors(self):
+        return self._legacy_answer_view("all", "objects", True)
 
     def load_fuzzy_facts(self):
         # extend current adjacency list with fuzzy facts
@@ -338,6 +366,8 @@ class KnowledgeGraph(nn.Module):
             test_triples = [l.strip() for l in f.readlines()]
         removed_triples = set(dev_triples + test_triples)
         theta = 0.5
+        if self.adj_list is None:
+            self.adj_list = self.csr_graph.to_adj_list()
         fuzzy_fact_path = os.path.join(self.data_dir, "train.fuzzy.triples")
         count = 0
         with open(fuzzy_fact_path) as f:
@@ -386,24 +416,43 @@ class KnowledgeGraph(nn.Module):
     def get_relation_img_embeddings(self, r):
         return self.RDropout(self.relation_img_embeddings(r))
 
-    def virtual_step(self, e_set, r):
+    def virtual_step(self, e_set, r, as_mask=False):
         """
         Given a set of entities (e_set), find the set of entities (e_set_out) which has at least one incoming edge
         labeled r and the source entity is in e_set.
+
+        The whole batch is handled at once: entities without an outgoing r edge are dropped up front with the unique
+        relation space (see `has_relation`), and the matching actions of the remaining ones are deduplicated with a
+        single sort of (row, entity) keys (see `ops.segment_unique`).
+        :param e_set: (Variable:batch, set_size) entity sets, padded with dummy_e.
+        :param r: (Variable:batch) relation of every row.
+        :param as_mask: If set, return a (batch, num_entities) multi-hot mask instead of the padded entity sets.
+        :return e_set_out: (Variable:batch, max_set_size) sorted entity sets, padded with dummy_e.
         """
         batch_size = len(e_set)
-        e_set_1D = e_set.view(-1)
-        r_space = self.action_space[0][0][e_set_1D]
-        e_space = self.action_space[0][1][e_set_1D]
-        e_space = (
-            r_space.view(batch_size, -1) == r.unsqueeze(1)
-        ).long() * e_space.view(batch_size, -1)
-        e_set_out = []
-        for i in range(len(e_space)):
-            e_set_out_b = var_cuda(unique(e_space[i].data))
-            e_set_out.append(e_set_out_b.unsqueeze(0))
-        e_set_out = ops.pad_and_cat(e_set_out, padding_value=self.dummy_e)
-        return e_set_out
+        e_set_1D = e_set.reshape(-1)
+        set_rows = torch.arange(batch_size, device=e_set.device).repeat_interleave(e_set_1D.numel() // max(batch_size, 1))
+        # The action space also holds the NO_OP self-loops, which are not part of the graph
+        active = self.has_relation(e_set_1D, r[set_rows]) | (r[set_rows] == self.self_edge)
+        e_set_1D, set_rows = e_set_1D[active], set_rows[active]
+        if self.packed_action_space is not None:
+            (r_all, e_all), offsets = self.packed_action_space
+            positions, sources, _ = ops.gather_segments(offsets, e_set_1D)
+            r_space, e_space = r_all[positions], e_all[positions]
+            rows = set_rows[sources]
+        else:
+            r_space = self.action_space[0][0][e_set_1D]
+            e_space = self.action_space[0][1][e_set_1D]
+            rows = set_rows.unsqueeze(1).expand_as(r_space)
+        match = r_space == r[rows]
+        rows, e_space = rows[match], e_space[match]
+
+        if as_mask:
+            e_set_mask = torch.zeros(batch_size, self.num_entities, dtype=torch.bool, device=e_space.device)
+            e_set_mask[rows, e_space] = True
+            return e_set_mask
+        e_set_out, rows, batch_offsets = ops.segment_unique(e_space, rows, batch_size)
+        return ops.unpack_segments(e_set_out, rows, batch_offsets, self.dummy_e)
 
     def id2triples(self, triple):
         e1, e2, r = triple
@@ -0,0 +1,82 @@
+"""
+Filtered link prediction ranking (MRR, MR, HITS@k) over full entity score matrices.
+
+The rank of the true entity of a query is 1 + the number of candidates scoring strictly higher than it, counted
+on-device with one comparison against the [batch_size, num_entities] score matrix. This replaces sorting all the
+entities of every query and searching the true entity in the sorted list. Ties are resolved in favour of the true
+entity (sorting resolved them arbitrarily).
+
+Filtered candidates (known true answers other than the target) must already be pushed below the target score, e.g.
+with `TestDataset.filter_scores`.
+"""
+
+from typing import Dict, List, Sequence
+
+import numpy as np
+import torch
+
+
+class FilteredRanking:
+    """
+    Running ranking metrics of evaluation batches. The sums stay on the device of the scores until `metrics()`.
+
+    Attributes:
+        hits_at (Sequence[int]): The k values of the HITS@k metrics.
+        count (int): Number of ranked queries.
+    """
+
+    def __init__(self, hits_at: Sequence[int] = (1, 3, 10)):
+        self.hits_at = tuple(hits_at)
+        self.count = 0
+        self._reciprocal_rank_sum = None
+        self._rank_sum = None
+        self._hits_sum = None
+        self._ranks: List[torch.Tensor] = []
+
+    def update(self, score: torch.Tensor, positive_arg: torch.Tensor) -> torch.Tensor:
+        """
+        Ranks the true entity of every query of a batch and adds the ranks to the running sums.
+
+        Args:
+            score (torch.Tensor): Score of every candidate entity, filtered. Shape: [batch_size, num_entities]
+            positive_arg (torch.Tensor): True entity (column of `score`) of every query. Shape: [batch_size]
+
+        Returns:
+            torch.Tensor: 1-based rank of the true entity of every query. Shape: [batch_size]
+        """
+        target_score = score.gather(1, positive_arg.view(-1, 1))
+        ranks = 1 + (score > target_score).sum(dim=1)
+
+        hits_at = torch.tensor(self.hits_at, device=ranks.device)
+        batch_sums = (
+            (1.0 / ranks).sum(),
+            ranks.sum(),
+            (ranks.unsqueeze(1) <= hits_at).sum(dim=0),
+        )
+        if self._rank_sum is None:
+            self._reciprocal_rank_sum, self._rank_sum, self._hits_sum = batch_sums
+        else:
+            self._reciprocal_rank_sum = self._reciprocal_rank_sum + batch_sums[0]
+            self._rank_sum = self._rank_sum + batch_sums[1]
+            self._hits_sum = self._hits_sum + batch_sums[2]
+        self.count += len(ranks)
+        self._ranks.append(ranks)
+        return ranks
+
+    def metrics(self) -> Dict[str, float]:
+        """{"MRR": ..., "MR": ..., "HITS@k": ...} averaged over all the ranked queries."""
+        if self.count == 0:
+            raise ValueError("No query was ranked")
+        metrics = {
+            "MRR": float(self._reciprocal_rank_sum) / self.count,
+            "MR": float(self._rank_sum) / self.count,
+        }
+        for k, hits in zip(self.hits_at, self._hits_sum.tolist()):
+            metrics["HITS@{}".format(k)] = hits / self.count
+        return metrics
+
+    def ranks(self) -> np.ndarray:
+        """1-based rank of every ranked query, in update order. Shape: [count]"""
+        if not self._ranks:
+            return np.zeros(0, dtype=np.int64)
+        return torch.cat(self._ranks).cpu().numpy()
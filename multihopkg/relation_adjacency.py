@@ -0,0 +1,146 @@
+"""
+Per-relation sparse adjacency matrices of a knowledge graph, for multi-hop reachability queries.
+
+Every relation r has a sparse matrix stored transposed, A_r^T[e2, e1] = 1 for every (e1, r, e2) fact, so that
+following r from a batch of entity distributions x [batch_size, num_entities] is one sparse-dense matmul
+(A_r^T @ x^T)^T. Following a relation path r1 -> r2 -> r3 chains these products, rows with different relations at
+a hop being grouped by relation.
+
+All the facts are kept in a single (e2, e1) index array sorted by (r, e2, e1), A_r^T being the slice
+[relation_offsets[r], relation_offsets[r + 1]) wrapped in a coalesced COO tensor when it is followed. The memory is
+O(num_facts + num_relations), unlike per-relation CSR matrices whose row pointers alone take O(num_relations * num_entities).
+
+With `normalize=True` every edge weighs 1 / (number of r-edges leaving e1): a distribution then flows like a
+uniform random walk restricted to the path (mass on entities without an r-edge is dropped). Without it the result
+counts the paths reaching every entity.
+"""
+
+from typing import Sequence, Union
+
+import numpy as np
+import torch
+
+from multihopkg.graph_csr import GraphCSR
+import multihopkg.utils.ops as ops
+
+
+class RelationAdjacency:
+    """
+    Attributes:
+        num_entities (int): Number of entities of the graph.
+        num_relations (int): Number of relations of the graph.
+        indices (torch.Tensor): (e2, e1) of every fact, sorted by (r, e2, e1). Shape: [2, num_facts]
+        weights (torch.Tensor): 1 / (number of r-edges leaving e1) of every fact, in the same order. Shape: [num_facts]
+        relation_offsets (np.ndarray): Facts of relation r are [relation_offsets[r], relation_offsets[r + 1]).
+            Shape: [num_relations + 1]
+        edge_keys (torch.Tensor): Sorted (r * num_entities + e1) * num_entities + e2 keys of every fact.
+            Shape: [num_facts]
+    """
+
+    def __init__(self, graph: GraphCSR, num_relations: int):
+        self.num_entities = num_entities = graph.num_entities
+        self.num_relations = num_relations
+        sources = graph.sources
+        relations = np.asarray(graph.relations, dtype=np.int64)
+        targets = np.asarray(graph.targets, dtype=np.int64)
+
+        # Number of r-edges leaving e1, for every edge (edges are sorted by (e1, r, e2))
+        query_keys = sources * num_relations + relations
+        _, query_ids, query_sizes = np.unique(query_keys, return_inverse=True, return_counts=True)
+        weights = 1.0 / query_sizes[query_ids]
+
+        # Transposed matrices: sort by (r, e2, e1)
+        order = np.lexsort((sources, targets, relations))
+        sources, relations, targets, weights = sources[order], relations[order], targets[order], weights[order]
+        self.relation_offsets = np.searchsorted(relations, np.arange(num_relations + 1))
+        self.indices = torch.from_numpy(np.stack([targets, sources]))
+        self.weights = torch.from_numpy(weights).float()
+
+        self.edge_keys = torch.from_numpy(np.sort((relations * num_entities + sources) * num_entities + targets))
+
+    @property
+    def device(self) -> torch.device:
+        return self.edge_keys.device
+
+    def to(self, device: torch.device) -> "RelationAdjacency":
+        """Moves the matrices to `device` (in place) and returns the adjacency."""
+        self.indices = self.indices.to(device)
+        self.weights = self.weights.to(device)
+        self.edge_keys = self.edge_keys.to(device)
+        return self
+
+    def transposed(self, r: int, normalize: bool = False) -> torch.Tensor:
+        """
+        Sparse A_r^T of relation r, with unit values or with 1 / out-degree values if `normalize`.
+        Shape: [num_entities, num_entities]
+        """
+        start, end = int(self.relation_offsets[r]), int(self.relation_offsets[r + 1])
+        values = self.weights[start:end] if normalize else torch.ones(end - start, device=self.device)
+        # The slice is sorted by (e2, e1) and in range, no need to check or coalesce it again
+        return torch.sparse_coo_tensor(
+            self.indices[:, start:end],
+            values,
+            size=(self.num_entities, self.num_entities),
+            check_invariants=False,
+            is_coalesced=True,
+        )
+
+    def _matmul(self, x: torch.Tensor, r: int, normalize: bool) -> torch.Tensor:
+        return torch.sparse.mm(self.transposed(r, normalize), x.t()).t()
+
+    def step(self, x: torch.Tensor, r: Union[int, torch.Tensor], normalize: bool = True) -> torch.Tensor:
+        """
+        Follows one relation from a batch of entity distributions.
+
+        Args:
+            x (torch.Tensor): Mass on every entity. Shape: [batch_size, num_entities]
+            r (Union[int, torch.Tensor]): Relation followed by every row, or by each row. Shape: [batch_size]
+            normalize (bool): Split the mass of every entity evenly among its r-edges (else count paths).
+
+        Returns:
+            torch.Tensor: Mass on every entity after the hop. Shape: [batch_size, num_entities]
+        """
+        if isinstance(r, int):
+            return self._matmul(x, r, normalize)
+        out = torch.zeros_like(x)
+        relation_ids, batch_refs = ops.group_by_key(r)
+        for relation_id, rows in zip(relation_ids, batch_refs):
+            out[rows] = self._matmul(x[rows], relation_id, normalize)
+        return out
+
+    def propagate(
+        self, x: torch.Tensor, relation_path: Union[Sequence[int], torch.Tensor], normalize: bool = True
+    ) -> torch.Tensor:
+        """
+        Follows a relation path r1 -> r2 -> ... from a batch of entity distributions, see `step`.
+
+        Args:
+            x (torch.Tensor): Mass on every entity. Shape: [batch_size, num_entities]
+            relation_path (Union[Sequence[int], torch.Tensor]): Path shared by the batch, or one path per row.
+                Shape: [path_length] or [batch_size, path_length]
+        """
+        if isinstance(relation_path, torch.Tensor) and relation_path.dim() == 2:
+            hops = relation_path.t()
+        else:
+            hops = [int(r) for r in relation_path]
+        for r in hops:
+            x = self.step(x, r, normalize)
+        return x
+
+    def reachable(self, e: torch.Tensor, relation_path: Union[Sequence[int], torch.Tensor]) -> torch.Tensor:
+        """
+        Entities reachable from every entity of `e` along the relation path. Shape: [batch_size, num_entities]
+        """
+        x = torch.zeros(len(e), self.num_entities, device=e.device)
+        x[torch.arange(len(e), device=e.device), e] = 1
+        return self.propagate(x, relation_path, normalize=False) > 0
+
+    def edge_mask(self, e1: torch.Tensor, r: torch.Tensor, e2: torch.Tensor) -> torch.Tensor:
+        """
+        Tests which (e1, r, e2) triples are edges of the graph, e.g. the hops of agent trajectories. Same shape as e1.
+        """
+        keys = (r * self.num_entities + e1) * self.num_entities + e2
+        if len(self.edge_keys) == 0:
+            return torch.zeros_like(keys, dtype=torch.bool)
+        position = torch.searchsorted(self.edge_keys, keys.reshape(-1)).clamp(max=len(self.edge_keys) - 1)
+        return (self.edge_keys[position] == keys.reshape(-1)).view_as(keys)
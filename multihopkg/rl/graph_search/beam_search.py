@@ -111,10 +111,10 @@ def beam_search(pn, e_s, q, e_t, kg, num_steps, beam_size, return_path_component
             top_unique_batch_offset = i * last_k
             top_unique_action_offset = top_unique_batch_offset + top_unique_beam_offset
             action_offset_list.append(top_unique_action_offset.unsqueeze(0))
-        next_r = ops.pad_and_cat(next_r_list, padding_value=kg.dummy_r).view(-1)
-        next_e = ops.pad_and_cat(next_e_list, padding_value=kg.dummy_e).view(-1)
-        log_action_prob = ops.pad_and_cat(log_action_prob_list, padding_value=-ops.HUGE_INT)
-        action_offset = ops.pad_and_cat(action_offset_list, padding_value=-1)
+        next_r = ops.pad_and_cat(next_r_list, padding_value=kg.dummy_r)[0].view(-1)
+        next_e = ops.pad_and_cat(next_e_list, padding_value=kg.dummy_e)[0].view(-1)
+        log_action_prob = ops.pad_and_cat(log_action_prob_list, padding_value=-ops.HUGE_INT)[0]
+        action_offset = ops.pad_and_cat(action_offset_list, padding_value=-1)[0]
         return (next_r, next_e), log_action_prob.view(-1), action_offset.view(-1)
     
     def adjust_search_trace(search_trace, action_offset):
@@ -153,7 +153,8 @@ def beam_search(pn, e_s, q, e_t, kg, num_steps, beam_size, return_path_component
         obs = [e_s, q, e_t, t==(num_steps-1), last_r, seen_nodes]
         # one step forward in search
         db_outcomes, _, _ = pn.transit(
-            e, obs, kg, use_action_space_bucketing=True, merge_aspace_batching_outcome=True)
+            e, obs, kg, use_action_space_bucketing=True, merge_aspace_batching_outcome=True,
+            use_action_space_packing=kg.use_action_space_packing)
         action_space, action_dist = db_outcomes[0]
         # => [batch_size*k, action_space_size]
         log_action_dist = log_action_prob.view(-1, 1) + ops.safe_log(action_dist)
@@ -210,7 +210,11 @@ class PolicyGradient(LFramework):
             last_r, e = path_trace[-1]
             obs = [e_s, q, e_t, t == (num_steps - 1), last_r, seen_nodes]
             db_outcomes, inv_offset, policy_entropy = pn.transit(
-                e, obs, kg, use_action_space_bucketing=self.use_action_space_bucketing
+                e,
+                obs,
+                kg,
+                use_action_space_bucketing=self.use_action_space_bucketing,
+                use_action_space_packing=kg.use_action_space_packing,
             )
             sample_outcome = self.sample_action(db_outcomes, inv_offset)
             action = sample_outcome["action_sample"]
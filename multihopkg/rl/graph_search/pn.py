@@ -16,7 +16,7 @@ import torch.nn.functional as F
 
 from multihopkg.exogenous.sun_models import KGEModel
 import multihopkg.utils.ops as ops
-from multihopkg.utils.ops import var_cuda, zeros_var_cuda
+from multihopkg.utils.ops import zeros_var_cuda
 from multihopkg.vector_search import ANN_IndexMan
 from multihopkg.environments import Environment, Observation
 from typing import Tuple, List, Dict, Optional
@@ -99,6 +99,7 @@ class GraphSearchPolicy(nn.Module):
         kg,
         use_action_space_bucketing=True,
         merge_aspace_batching_outcome=False,
+        use_action_space_packing=False,
     ):
         """
         Compute the next action distribution based onsample_action
@@ -117,6 +118,8 @@ class GraphSearchPolicy(nn.Module):
             into buckets by their sizes.
         :param merge_aspace_batch_outcome: If set, merge the transition probability distribution
             generated of different action space bucket into a single batch.
+        :param use_action_space_packing: If set, score the packed (unpadded) action spaces of the batch
+            with a segment softmax. Takes precedence over bucketing; only the outcome is padded.
         :return
             With aspace batching and without merging the outcomes:
                 db_outcomes: (Dynamic Batch) (action_space, action_dist)
@@ -167,13 +170,31 @@ class GraphSearchPolicy(nn.Module):
                 db_r_space.append(r_space)
                 db_e_space.append(e_space)
                 db_action_mask.append(action_mask)
-            r_space = ops.pad_and_cat(db_r_space, padding_value=kg.dummy_r)[inv_offset]
-            e_space = ops.pad_and_cat(db_e_space, padding_value=kg.dummy_e)[inv_offset]
-            action_mask = ops.pad_and_cat(db_action_mask, padding_value=0)[inv_offset]
+            r_space = ops.pad_and_cat(db_r_space, padding_value=kg.dummy_r)[0][inv_offset]
+            e_space = ops.pad_and_cat(db_e_space, padding_value=kg.dummy_e)[0][inv_offset]
+            action_mask = ops.pad_and_cat(db_action_mask, padding_value=0)[0][inv_offset]
             action_space = ((r_space, e_space), action_mask)
             return action_space
 
-        if use_action_space_bucketing:
+        if use_action_space_packing:
+            action_space, segment_ids, batch_offsets = self.get_packed_action_space(e, obs, kg)
+            (r_space, e_space), action_mask = action_space
+            # [num_actions, action_dim]: one row per real action of the batch, no padding
+            A = self.get_action_embedding((r_space, e_space), kg)
+            scores = (A * X2[segment_ids]).sum(dim=-1) - (1 - action_mask) * ops.HUGE_INT
+            action_dist = ops.segment_softmax(scores, segment_ids, len(e))
+            entropy = ops.segment_sum(-action_dist * ops.safe_log(action_dist), segment_ids, len(e))
+
+            def unpack(x, padding_value):
+                return ops.unpack_segments(x, segment_ids, batch_offsets, padding_value)
+
+            action_space = (
+                (unpack(r_space, kg.dummy_r), unpack(e_space, kg.dummy_e)),
+                unpack(action_mask, 0),
+            )
+            db_outcomes = [(action_space, unpack(action_dist, 0))]
+            inv_offset = None
+        elif use_action_space_bucketing:
             """ """
             db_outcomes = []
             entropy_list = []
@@ -184,19 +205,17 @@ class GraphSearchPolicy(nn.Module):
             for action_space_b, reference_b in zip(db_action_spaces, db_references):
                 X2_b = X2[reference_b, :]
                 action_dist_b, entropy_b = policy_nn_fun(X2_b, action_space_b)
-                references.extend(reference_b)
+                references.append(reference_b)
                 db_outcomes.append((action_space_b, action_dist_b))
                 entropy_list.append(entropy_b)
-            inv_offset = [
-                i for i, _ in sorted(enumerate(references), key=lambda x: x[1])
-            ]
+            inv_offset = ops.inverse_permutation(torch.cat(references))
             entropy = torch.cat(entropy_list, dim=0)[inv_offset]
             if merge_aspace_batching_outcome:
                 db_action_dist = []
                 for _, action_dist in db_outcomes:
                     db_action_dist.append(action_dist)
                 action_space = pad_and_cat_action_space(db_action_spaces, inv_offset)
-                action_dist = ops.pad_and_cat(db_action_dist, padding_value=0)[
+                action_dist = ops.pad_and_cat(db_action_dist, padding_value=0)[0][
                     inv_offset
                 ]
                 db_outcomes = [(action_space, action_dist)]
@@ -288,8 +307,8 @@ class GraphSearchPolicy(nn.Module):
 
         :return db_references:
             [l_batch_refs0, l_batch_refs1, ..., l_batch_refsn]
-            l_batch_refsi stores the indices of the examples in bucket i in the current batch,
-            which is used later to restore the output results to the original order.
+            l_batch_refsi (LongTensor) stores the indices of the examples in bucket i in the current
+            batch, which is used later to restore the output results to the original order.
         """
         e_s, q, e_t, last_step, last_r, seen_nodes = obs
         assert len(e) == len(last_r)
@@ -301,21 +320,16 @@ class GraphSearchPolicy(nn.Module):
         if collapse_entities:
             raise NotImplementedError
         else:
-            entity2bucketid = kg.entity2bucketid[e.tolist()]
+            entity2bucketid = kg.entity2bucketid[e]
             key1 = entity2bucketid[:, 0]
             key2 = entity2bucketid[:, 1]
-            batch_ref = {}
-            for i in range(len(e)):
-                key = int(key1[i])
-                if not key in batch_ref:
-                    batch_ref[key] = []
-                batch_ref[key].append(i)
-            for key in batch_ref:
+            # One stable sort groups the batch by bucket, each group keeping the batch order
+            bucket_keys, batch_refs = ops.group_by_key(key1)
+            for key, l_batch_refs in zip(bucket_keys, batch_refs):
                 action_space = kg.action_space_buckets[key]
                 # l_batch_refs: ids of the examples in the current batch of examples
                 # g_bucket_ids: ids of the examples in the corresponding KG action space bucket
-                l_batch_refs = batch_ref[key]
-                g_bucket_ids = key2[l_batch_refs].tolist()
+                g_bucket_ids = key2[l_batch_refs]
                 r_space_b = action_space[0][0][g_bucket_ids]
                 e_space_b = action_space[0][1][g_bucket_ids]
                 action_mask_b = action_space[1][g_bucket_ids]
@@ -333,6 +347,33 @@ class GraphSearchPolicy(nn.Module):
 
         return db_action_spaces, db_references
 
+    def get_packed_action_space(self, e, obs, kg):
+        """
+        Gathers the ragged action spaces of the batch from `kg.packed_action_space` into flat tensors, each
+        action carrying the id of the example it belongs to. Unlike the padded and bucketed action spaces,
+        a hub entity only costs its own actions.
+
+        :return action_space: ((r_space, e_space), action_mask), flat tensors of shape [num_actions].
+        :return segment_ids: (Variable:num_actions) example of every action.
+        :return batch_offsets: (Variable:batch+1) the actions of example i are batch_offsets[i]:batch_offsets[i + 1].
+        """
+        (r_all, e_all), offsets = kg.packed_action_space
+        positions, segment_ids, batch_offsets = ops.gather_segments(offsets, e)
+        r_space = r_all[positions].unsqueeze(1)
+        e_space = e_all[positions].unsqueeze(1)
+        action_mask = torch.ones_like(r_space, dtype=torch.float)
+
+        # Every action is a one-column row, so the padded masking code applies as is
+        e_s, q, e_t, last_step, last_r, seen_nodes = obs
+        obs_a = [
+            e_s[segment_ids], q[segment_ids], e_t[segment_ids], last_step, last_r[segment_ids], seen_nodes[segment_ids]
+        ]
+        (r_space, e_space), action_mask = self.apply_action_masks(
+            ((r_space, e_space), action_mask), e[segment_ids], obs_a, kg
+        )
+        action_space = ((r_space.squeeze(1), e_space.squeeze(1)), action_mask.squeeze(1))
+        return action_space, segment_ids, batch_offsets
+
     def get_action_space(self, e, obs, kg):
         r_space, e_space = kg.action_space[0][0][e], kg.action_space[0][1][e]
         action_mask = kg.action_space[1][e]
@@ -386,21 +427,11 @@ class GraphSearchPolicy(nn.Module):
 
     def get_answer_mask(self, e_space, e_s, q, kg):
         if kg.args.mask_test_false_negatives:
-            answer_vectors = kg.all_object_vectors
+            answers = kg.all_answers
         else:
-            answer_vectors = kg.train_object_vectors
-        answer_masks = []
-        for i in range(len(e_space)):
-            _e_s, _q = int(e_s[i]), int(q[i])
-            if not _e_s in answer_vectors or not _q in answer_vectors[_e_s]:
-                answer_vector = var_cuda(torch.LongTensor([[kg.num_entities]]))
-            else:
-                answer_vector = answer_vectors[_e_s][_q]
-            answer_mask = torch.sum(
-                e_space[i].unsqueeze(0) == answer_vector, dim=0
-            ).long()
-            answer_masks.append(answer_mask)
-        answer_mask = torch.cat(answer_masks).view(len(e_space), -1)
+            answers = kg.train_answers
+        # Batched membership test of every (e_s, q, e) action against the sorted answer keys
+        answer_mask = answers.object_mask(e_s, q, e_space).long()
         return answer_mask
 
     def get_false_negative_mask(self, e_space, e_s, q, e_t, kg):
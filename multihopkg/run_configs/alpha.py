@@ -80,6 +80,12 @@ def get_args() -> argparse.Namespace:
     ap.add_argument('--question_embedding_module_trainable', type=bool, default=True, help="Whether the question embedding model is trainable or not (default: True)")
     ap.add_argument('--exact_nn',  action="store_true", help="Whether to use exact nearest neighbor search or not (default: False)")
     ap.add_argument('--num_cluster_for_ivf', type=int, default=100, help="Number of clusters for the IVF index if exact_computation is False (default: 100)")
+    ap.add_argument('--ann_index_factory', type=str, default=None, help="FAISS index factory string for the entity index of non-rotational models, e.g. 'IVF1024,PQ32', 'HNSW32' or 'IVF1024,SQ8' (default: None, exact search)")
+    ap.add_argument('--ann_search_params', type=str, default=None, help="Runtime FAISS search parameters for --ann_index_factory or --ann_rotational_index, e.g. 'nprobe=16' or 'efSearch=64' (default: None)")
+    ap.add_argument('--ann_storage', type=str, default="float32", choices=["float32", "float16", "int8"], help="Storage of the in-memory entity index: the FAISS index of non-rotational models or the phase table of pRotatE. The quantized options re-rank a shortlist with exact float32 distances, which makes the pRotatE search approximate (default: float32)")
+    ap.add_argument('--ann_rotational_index', type=str, default="exact", choices=["exact", "flat", "ivf", "hnsw"], help="Entity index of pRotatE: 'exact' scans the phase table with a wrapped angular distance, 'flat', 'ivf' and 'hnsw' are approximate FAISS indexes over the unit-circle representation of the phases, tuned with --ann_search_params (default: exact)")
+    ap.add_argument('--ann_device', type=str, default=None, help="If set (e.g. 'cuda:0'), the vector searchers keep the embedding tables on this device and search there without a device->host copy. Without a FAISS GPU build this is an exact matmul search, which rejects --ann_index_factory, --ann_search_params and a quantized non-rotational --ann_storage (default: None, FAISS search on the host)")
+    ap.add_argument('--ann_num_shards', type=int, default=0, help="If above 1, the entity index is searched shard by shard from the memory-mapped entity_embedding.npy instead of being held in RAM (default: 0, disabled)")
     ap.add_argument('--further_train_hunchs_llm',  action="store_true", help="Whether to further pretrain the language model or not (default: False)")
     ap.add_argument('--pretrained_llm_for_hunch', type=str, default="facebook/bart-base", help="The pretrained language model to use (default: bert-base-uncased)")
     ap.add_argument('--pretrained_llm_transformer_ckpnt_path', type=str, default="models/itl/pretrained_transformer_e1_s9176.ckpt", help="The path to the pretrained language model transformer weights (default: models/itl/pretrained_transformer_e1_s9176.ckpt)")
@@ -0,0 +1,149 @@
+"""
+Bulk loading of vocabulary (entity2id/relation2id) and triple text files.
+
+Files are parsed with the pandas C reader in one call, and the string columns of triple files are mapped to ids with
+a vectorized categorical lookup against the vocabulary instead of one dictionary lookup per token. The id arrays of
+triple files are cached as int32 `.npy` files next to the source file, keyed by the mtime of the source and by a
+fingerprint of the vocabularies, so later runs skip parsing altogether:
+
+    <file>.ids-<key>.npy
+"""
+
+import csv
+import glob
+import hashlib
+import logging
+import os
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX = ".npy"
+
+
+def read_columns(path: str, sep: Optional[str] = None) -> pd.DataFrame:
+    """
+    Reads a text table as strings, without quoting nor NA conversion (entity names such as "null" stay as they are).
+
+    Args:
+        path (str): File to read.
+        sep (Optional[str]): Column separator, any whitespace by default.
+    """
+    try:
+        return pd.read_csv(
+            path,
+            sep=r"\s+" if sep is None else sep,
+            header=None,
+            dtype=str,
+            quoting=csv.QUOTE_NONE,
+            keep_default_na=False,
+            na_filter=False,
+            engine="c",
+        )
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+def read_vocabulary(path: str, id_column: Optional[int] = None) -> Dict[str, int]:
+    """
+    Reads a `name<whitespace>value` vocabulary file.
+
+    Args:
+        path (str): Vocabulary file.
+        id_column (Optional[int]): Column holding the id of every name, the row number is the id if None.
+
+    Returns:
+        Dict[str, int]: Id of every name.
+    """
+    table = read_columns(path)
+    names = table[0].tolist()
+    ids = range(len(names)) if id_column is None else table[id_column].astype(np.int64).tolist()
+    return dict(zip(names, ids))
+
+
+def _vocabulary_arrays(vocabulary: Dict[str, int]):
+    names = pd.Index(list(vocabulary.keys()), dtype=object)
+    ids = np.fromiter(vocabulary.values(), dtype=np.int64, count=len(vocabulary))
+    return names, ids
+
+
+def _fingerprint(path: str, vocabulary_arrays) -> str:
+    digest = hashlib.sha1(str(os.stat(path).st_mtime_ns).encode())
+    for names, ids in vocabulary_arrays:
+        digest.update(pd.util.hash_pandas_object(names, index=False).values.tobytes())
+        digest.update(ids.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _cache_file(path: str, key: str) -> str:
+    return "{}.ids-{}{}".format(path, key, CACHE_SUFFIX)
+
+
+def map_column(values: pd.Series, names: pd.Index, ids: np.ndarray, path: str) -> np.ndarray:
+    """
+    Maps a column of strings to ids through a categorical lookup (the category code of every string is its position
+    in the vocabulary names), raising KeyError on unknown strings.
+    """
+    codes = names.get_indexer(values)
+    if (codes < 0).any():
+        unknown = values[codes < 0].iloc[0]
+        raise KeyError("{} (in {})".format(unknown, path))
+    return ids[codes]
+
+
+def load_triple_ids(
+    path: str, vocabularies: Sequence[Dict[str, int]], sep: Optional[str] = None, cache: bool = True
+) -> np.ndarray:
+    """
+    Loads a triple file as ids, in the column order of the file.
+
+    Args:
+        path (str): Triple file, one fact per line.
+        vocabularies (Sequence[Dict[str, int]]): Vocabulary of every column, e.g. (entity2id, relation2id, entity2id)
+            for `head relation tail` files.
+        sep (Optional[str]): Column separator, any whitespace by default.
+        cache (bool): Read/write the int32 `.npy` cache next to `path`.
+
+    Returns:
+        np.ndarray: Ids of every fact. Shape: [num_facts, len(vocabularies)], dtype int32
+    """
+    # The same dictionary is typically used for the head and tail columns, map it once
+    arrays_by_id = {}
+    for vocabulary in vocabularies:
+        if id(vocabulary) not in arrays_by_id:
+            arrays_by_id[id(vocabulary)] = _vocabulary_arrays(vocabulary)
+    column_arrays = [arrays_by_id[id(vocabulary)] for vocabulary in vocabularies]
+
+    cache_file = None
+    if cache:
+        cache_file = _cache_file(path, _fingerprint(path, column_arrays))
+        if os.path.exists(cache_file):
+            return np.load(cache_file)
+
+    table = read_columns(path, sep)
+    if len(table) > 0 and table.shape[1] != len(vocabularies):
+        raise ValueError("{} has {} columns, expected {}".format(path, table.shape[1], len(vocabularies)))
+    triple_ids = np.empty((len(table), len(vocabularies)), dtype=np.int32)
+    for column, (names, ids) in enumerate(column_arrays):
+        if len(table) > 0:
+            triple_ids[:, column] = map_column(table[column], names, ids, path)
+
+    if cache_file is not None:
+        _write_cache(path, cache_file, triple_ids)
+    return triple_ids
+
+
+def _write_cache(path: str, cache_file: str, triple_ids: np.ndarray) -> None:
+    """Replaces the cached arrays of `path` (stale mtime or vocabulary) with `triple_ids`."""
+    try:
+        for stale_file in glob.glob(glob.escape(path) + ".ids-*" + CACHE_SUFFIX):
+            os.remove(stale_file)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, triple_ids)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logger.warning("Could not cache the ids of {}: {}".format(path, e))
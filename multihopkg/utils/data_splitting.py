@@ -9,6 +9,8 @@ import os
 import sys
 from sklearn.model_selection import train_test_split
 
+from multihopkg.triple_io import load_triple_ids
+
 TripleIds = list[tuple[int, int, int]] 
 
 def split_dataset(file_path, train_size, test_size, val_size):
@@ -42,12 +44,8 @@ def read_triple(file_path: str, entity2id: dict[int, str], relation2id: dict[int
     '''
     Read triples and map them into ids.
     '''
-    triples = []
-    with open(file_path) as fin:
-        for line in fin:
-            h, r, t = line.strip().split('\t')
-            triples.append((entity2id[h], relation2id[r], entity2id[t]))
-    return triples
+    triple_ids = load_triple_ids(file_path, (entity2id, relation2id, entity2id), sep='\t')
+    return list(zip(*triple_ids.T.tolist()))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
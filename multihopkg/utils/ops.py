@@ -102,23 +102,28 @@ def format_rule(rule, kg):
     return rule_str
 
 
+# The *_var_cuda helpers place tensors on the GPU when there is one (CPU otherwise, e.g. for tests)
+def var_device():
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
 def ones_var_cuda(s, requires_grad=False):
-    return torch.ones(s, requires_grad=requires_grad, device='cuda')
+    return torch.ones(s, requires_grad=requires_grad, device=var_device())
 
 def zeros_var_cuda(s, requires_grad=False):
-    return torch.zeros(s, requires_grad=requires_grad, device='cuda')
+    return torch.zeros(s, requires_grad=requires_grad, device=var_device())
 
-def int_fill_var_cuda(s, value, requires_grad=False):
-    raise NotImplementedError("LG: Look mate this should be good but just warning you in case you use it: It might not be")
-    return torch.full(s, value, dtype=torch.long, requires_grad=requires_grad, device='cuda')
+def int_fill_var_cuda(s, value):
+    return torch.full(s, value, dtype=torch.long, device=var_device())
 
 
-def int_var_cuda(x, requires_grad=False):
-    return x.to(device='cuda', dtype=torch.long, requires_grad=requires_grad)
+def int_var_cuda(x):
+    # Integer tensors cannot require gradients
+    return x.to(device=var_device(), dtype=torch.long)
 
 
 def var_cuda(x, requires_grad=False):
-    return x.to(device='cuda', requires_grad=requires_grad)
+    x = x.to(device=var_device())
+    return x.requires_grad_() if requires_grad else x
 
 
 def var_to_numpy(x):
@@ -154,6 +159,92 @@ def pad_and_cat(
     return torch.cat(padded_a, dim=0), torch.stack(attention_mask)
 
 
+def group_by_key(keys: torch.Tensor) -> Tuple[List[int], List[torch.Tensor]]:
+    """
+    Groups the positions of a 1D tensor by value with one stable sort instead of a python loop.
+    :return: the distinct keys (ascending) and, for each key, the positions holding it (in their original order).
+    """
+    order = torch.argsort(keys, stable=True)
+    unique_keys, counts = torch.unique_consecutive(keys[order], return_counts=True)
+    return unique_keys.tolist(), list(torch.split(order, counts.tolist()))
+
+
+def inverse_permutation(perm: torch.Tensor) -> torch.Tensor:
+    """
+    inverse_permutation(perm)[perm[i]] = i, i.e. indexing a tensor laid out in `perm` order with the result
+    restores the original order.
+    """
+    inv = torch.empty_like(perm)
+    inv[perm] = torch.arange(len(perm), device=perm.device, dtype=perm.dtype)
+    return inv
+
+
+def segment_sum(values: torch.Tensor, segment_ids: torch.Tensor, num_segments: int) -> torch.Tensor:
+    """
+    Sums the rows of `values` sharing a segment id. Shape: [num_segments, *values.shape[1:]]
+    """
+    out = values.new_zeros((num_segments,) + tuple(values.shape[1:]))
+    return out.index_add(0, segment_ids, values)
+
+
+def segment_softmax(scores: torch.Tensor, segment_ids: torch.Tensor, num_segments: int) -> torch.Tensor:
+    """
+    Softmax over the entries of a flat 1D tensor sharing a segment id, the ragged counterpart of softmax(dim=-1).
+    """
+    segment_max = scores.new_full((num_segments,), -float("inf")).scatter_reduce(
+        0, segment_ids, scores.detach(), reduce="amax"
+    )
+    exp = torch.exp(scores - segment_max[segment_ids])
+    return exp / segment_sum(exp, segment_ids, num_segments)[segment_ids]
+
+
+def gather_segments(offsets: torch.Tensor, rows: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Concatenates the segments offsets[rows[i]]:offsets[rows[i] + 1] of a flat ragged table, in row order.
+    :return positions: indices of the gathered entries in the flat table.
+    :return segment_ids: i for every entry gathered from the segment of rows[i].
+    :return batch_offsets: [len(rows) + 1] offsets of the gathered segments.
+    """
+    starts = offsets[rows]
+    counts = offsets[rows + 1] - starts
+    batch_offsets = torch.zeros(len(rows) + 1, dtype=torch.long, device=rows.device)
+    torch.cumsum(counts, dim=0, out=batch_offsets[1:])
+    segment_ids = torch.repeat_interleave(torch.arange(len(rows), device=rows.device), counts)
+    positions = starts[segment_ids] + torch.arange(len(segment_ids), device=rows.device) - batch_offsets[segment_ids]
+    return positions, segment_ids, batch_offsets
+
+
+def unpack_segments(
+    values: torch.Tensor, segment_ids: torch.Tensor, batch_offsets: torch.Tensor, padding_value
+) -> torch.Tensor:
+    """
+    Scatters the gathered segments of a flat tensor into a padded [num_segments, max_segment_size] tensor.
+    """
+    counts = batch_offsets[1:] - batch_offsets[:-1]
+    max_count = int(counts.max()) if len(counts) > 0 else 0
+    padded = values.new_full((len(counts), max_count), padding_value)
+    columns = torch.arange(len(values), device=values.device) - batch_offsets[segment_ids]
+    return padded.index_put((segment_ids, columns), values)
+
+
+def segment_unique(
+    values: torch.Tensor, segment_ids: torch.Tensor, num_segments: int
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Distinct (non-negative) values within every segment of a flat tensor, with one sort of (segment, value) keys
+    instead of one `unique` per segment.
+    :return values: distinct values, sorted by segment then value.
+    :return segment_ids: segment of every distinct value.
+    :return batch_offsets: [num_segments + 1] offsets of the segments, see `unpack_segments`.
+    """
+    base = int(values.max()) + 1 if len(values) > 0 else 1
+    keys = torch.unique(segment_ids * base + values)
+    segment_ids, values = keys // base, keys % base
+    batch_offsets = torch.zeros(num_segments + 1, dtype=torch.long, device=values.device)
+    torch.cumsum(torch.bincount(segment_ids, minlength=num_segments), dim=0, out=batch_offsets[1:])
+    return values, segment_ids, batch_offsets
+
+
 def rearrange_vector_list(l, offset):
     for i, v in enumerate(l):
         l[i] = v[offset]
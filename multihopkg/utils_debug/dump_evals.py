@@ -8,17 +8,25 @@ import wandb
 import logging
 import sys
 
-from multihopkg.vector_search import ANN_IndexMan, ANN_IndexMan_pRotatE
+from multihopkg.vector_search import ANN_IndexMan, ANN_IndexMan_pRotatE, ANN_IndexMan_Sharded
+from multihopkg.vector_search import _as_numpy, build_lookup_table, index2data
 
-from typing import Dict, Any, Union, Callable
+from typing import Dict, Any, Optional, Union, Callable
 
 # TODO: Move to a different file once ready
 
+def _title_table(id2token: Dict[int, str], token2title: Optional[Dict[str, str]]) -> Optional[np.ndarray]:
+    """Lookup table from ids to titles (the token itself when it has no title), None without titles."""
+    if not token2title:
+        return None
+    return build_lookup_table({i: token2title.get(token, token) for i, token in id2token.items()})
+
+
 def dump_evaluation_metrics(
     path_to_log: str,
     evaluation_metrics_dictionary: Dict[str, Any],
-	vector_entity_searcher: Union[ANN_IndexMan, ANN_IndexMan_pRotatE],						  
-    vector_rel_searcher: Union[ANN_IndexMan, ANN_IndexMan_pRotatE],  
+	vector_entity_searcher: Union[ANN_IndexMan, ANN_IndexMan_pRotatE, ANN_IndexMan_Sharded],
+    vector_rel_searcher: Union[ANN_IndexMan, ANN_IndexMan_pRotatE],
     question_tokenizer: PreTrainedTokenizer,
     answer_tokenizer: PreTrainedTokenizer,
     answer_kge_tensor:torch.Tensor,
@@ -90,6 +98,29 @@ def dump_evaluation_metrics(
     wandb_positions = []
     distance_between_position_avg = []
     distance_to_answer_avg = []
+
+    # Match the relations and entities that are closest to the positions we visit, for the whole batch at once
+    # The start position (kge_prev_pos of the first step) is searched along with the current positions
+    _, all_relation_indices = vector_rel_searcher.batch_search(evaluation_metrics_dictionary["kge_action"], 1)
+    all_entity_emb, all_pos_ids = vector_entity_searcher.batch_search(
+        torch.cat((evaluation_metrics_dictionary["kge_prev_pos"][:1], evaluation_metrics_dictionary["kge_cur_pos"]), dim=0), 1
+    )
+    all_relation_indices = _as_numpy(all_relation_indices)[..., 0] # [steps, batch_size]
+    all_pos_ids = _as_numpy(all_pos_ids)[..., 0] # [steps + 1, batch_size]
+    all_entity_emb = torch.as_tensor(all_entity_emb[1:, :, 0]).to(evaluation_metrics_dictionary["kge_cur_pos"].device) # [steps, batch_size, dim]
+
+    # Ids are mapped to tokens and titles with array-wide lookups instead of one dictionary access per id
+    entity_table = build_lookup_table(id2entity)
+    relation_table = build_lookup_table(id2relations)
+    entity_title_table = _title_table(id2entity, entity2title)
+    relation_title_table = _title_table(id2relations, relation2title)
+    all_relation_tokens = index2data(all_relation_indices, relation_table) # [steps, batch_size]
+    all_entity_tokens = index2data(all_pos_ids, entity_table) # [steps + 1, batch_size]
+    if relation_title_table is not None:
+        all_relation_names = index2data(all_relation_indices, relation_title_table)
+    if entity_title_table is not None:
+        all_entity_names = index2data(all_pos_ids, entity_title_table)
+
     with open(path_to_log) as f:
         for element_id in range(batch_size):
 
@@ -135,38 +166,34 @@ def dump_evaluation_metrics(
             #--------------------------------
             'KGE'
 
-            # Match the relation that are closest to positions we visit
-            _, relation_indices = vector_rel_searcher.search(kge_action, 1)
-            entity_emb, entity_indices = vector_entity_searcher.search(kge_cur_pos, 1)
-            prev_emb, start_index = vector_entity_searcher.search(kge_prev_pos, 1)
-            # answer_emb, answer_indices = vector_entity_searcher.search(answer_tensor.squeeze(1).cpu().numpy(), 1)
-
-            # combine index of start_index with the rest of entity_indices into pos_ids
-            pos_ids = np.concatenate((start_index[0][:, None], entity_indices), axis=0)
+            # Closest relations and entities (start position followed by the visited ones), searched before the loop
+            entity_emb = all_entity_emb[:, element_id]
+            relevant_entities = np.asarray(relevant_entities, dtype=np.int64)
+            relevant_rels = np.asarray(relevant_rels, dtype=np.int64)
 
             # -----------------------------------
             'KGE Context Tokens'
             log_file.write(f"#KGE Evaluation Data ------------\n")
             log_file.write(f"Answer ID: {answer_id}\n")
-            answer_token = id2entity[answer_id]
+            answer_token = entity_table[answer_id]
             log_file.write(f"Answer Entity Token: {answer_token}\n") # This must match with the answer above
-            if entity2title:
-                answer_name = entity2title[answer_token]
+            if entity_title_table is not None:
+                answer_name = entity_title_table[answer_id]
                 log_file.write(f"Answer Entity Name: {answer_name}\n")
 
-            relevant_entities_tokens = [id2entity[index] for index in relevant_entities]
+            relevant_entities_tokens = index2data(relevant_entities, entity_table).tolist()
             log_file.write(f"Relevant Entity Tokens: \n{relevant_entities_tokens}\n")
 
-            if entity2title:
-                entities_names = [entity2title[index] for index in relevant_entities_tokens]
+            if entity_title_table is not None:
+                entities_names = index2data(relevant_entities, entity_title_table).tolist()
                 log_file.write(f"Relevant Entity Names: \n{entities_names}\n")
                 wandb_steps.append(" , ".join(entities_names))
 
-            relevant_relations_tokens = [id2relations[int(index)] for index in relevant_rels]
+            relevant_relations_tokens = index2data(relevant_rels, relation_table).tolist()
             log_file.write(f"Relevant Relations Tokens: \n{relevant_relations_tokens}\n")
 
-            if relation2title: 
-                relations_names = [relation2title[index] for index in relevant_relations_tokens]
+            if relation_title_table is not None:
+                relations_names = index2data(relevant_rels, relation_title_table).tolist()
                 log_file.write(f"Relevant Relations Names: \n{relations_names}\n")
                 wandb_steps.append(" -- ".join(relations_names))
 
@@ -174,19 +201,19 @@ def dump_evaluation_metrics(
             'KGE Navigation Agent Tokens'
 
             log_file.write(f"#NAV Agent Inference ------------\n")
-            relations_tokens = [id2relations[int(index)] for index in relation_indices.squeeze()]
+            relations_tokens = all_relation_tokens[:, element_id].tolist()
             log_file.write(f"Closest Relations Tokens: \n{relations_tokens}\n")
 
-            if relation2title: 
-                relations_names = [relation2title[index] for index in relations_tokens]
+            if relation_title_table is not None:
+                relations_names = all_relation_names[:, element_id].tolist()
                 log_file.write(f"Closest Relations Names: \n{relations_names}\n")
                 wandb_steps.append(" -- ".join(relations_names))
 
-            entities_tokens = [id2entity[index] for index in pos_ids.squeeze()]
+            entities_tokens = all_entity_tokens[:, element_id].tolist()
             log_file.write(f"Closest Entity Tokens: \n{entities_tokens}\n")
 
-            if entity2title: 
-                entities_names = [entity2title[index] for index in entities_tokens]
+            if entity_title_table is not None:
+                entities_names = all_entity_names[:, element_id].tolist()
                 log_file.write(f"Closest Entity Names: \n{entities_names}\n")
                 wandb_steps.append(" --> ".join(entities_names))
 
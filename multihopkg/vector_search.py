@@ -17,23 +17,248 @@ Core functionalities:
   
 - **search**: Takes a set of target embeddings and retrieves the top-K nearest neighbors from the index, returning distances and indices.
 
-- **index2data**: Maps a 2D array of search result indices to property values in a specified DataFrame column, with options to limit the 
-  number of mapped results per query.
+- **index2data**: Maps a 2D array of search result indices to their data (e.g. tokens or titles) through a lookup table built
+  with `build_lookup_table`, with options to limit the number of mapped results per query.
 
 - **calculate_hits_at_n**: Calculates the hit@N score, a metric that measures the fraction of queries where the correct index is found 
-  within the top-N nearest neighbors.
+  within the top-N nearest neighbors. `calculate_ranking_metrics` reports HITS@{1,3,10} and MRR in one pass.
+
+- **set_search_params / benchmark_recall**: Tune runtime parameters (`nprobe`, `efSearch`) of factory-built indexes (IVF, PQ, HNSW,
+  scalar quantization) and sweep them for recall@k vs. latency against the exact index.
+
+- **Device-resident search (`device=`)**: Keeps queries and the embedding table on the training device and returns torch
+  tensors, using a FAISS GPU index when available and an exact blocked matmul top-k (`blocked_l2_topk`) otherwise.
+
+- **refresh**: Re-indexes only the embeddings that moved beyond a tolerance after fine-tuning (`refresh_faiss_index`).
+
+The `ANN_IndexMan_pRotatE` class offers the same surface for phase (pRotatE) embeddings, where distances are wrapped angles;
+its search is exact by default (a unit-circle shortlist with a certified full-scan fallback). `ANN_IndexMan_Rotational`
+serves the same phase embeddings approximately through FAISS (flat, IVF or HNSW) by indexing their unit-circle
+representation. `ANN_IndexMan_Sharded` searches a memory-mapped `.npy` table shard by shard in a thread pool, for tables
+that do not fit in RAM next to their index.
 """
 
+import glob
+import hashlib
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 import torch
 import faiss
 import pdb
-from typing import Tuple
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 import sys
 
 from multihopkg.emb.operations import angular_difference
 
+logger = logging.getLogger(__name__)
+
+
+def _as_numpy(array: Union[np.ndarray, torch.Tensor]) -> np.ndarray:
+    if isinstance(array, torch.Tensor):
+        return array.detach().cpu().numpy()
+    return np.asarray(array)
+
+
+def calculate_hits_at_n(
+    ground_truth: Union[np.ndarray, torch.Tensor], indices: Union[np.ndarray, torch.Tensor], topk: int
+) -> float:
+    """
+    Calculates the hit@N score, which is the fraction of queries where the correct index is within the top N nearest neighbors.
+
+    Args:
+        ground_truth (np.ndarray): Array of ground truth indices for each query. Shape: [num_queries]
+        indices (np.ndarray): 2D array of indices returned from a nearest-neighbor search. Shape: [num_queries, topk]
+        topk (int): Number of top results to consider for a hit.
+
+    Returns:
+        float: The hit@N score.
+    """
+    indices = _as_numpy(indices)
+    assert (
+        topk <= indices.shape[1]
+    ), "Topk must be smaller or equal than the size of index length"
+    ground_truth = _as_numpy(ground_truth).reshape(-1, 1)
+    return float((indices[:, :topk] == ground_truth).any(axis=1).mean())
+
+
+def calculate_ranking_metrics(
+    ground_truth: Union[np.ndarray, torch.Tensor],
+    indices: Union[np.ndarray, torch.Tensor],
+    topks: Sequence[int] = (1, 3, 10),
+) -> Dict[str, float]:
+    """
+    Calculates HITS@k for all k values and the MRR in one pass over the [num_queries, topk] index array.
+    Queries whose ground truth is not retrieved at all count as a miss for every k and contribute 0 to the MRR.
+
+    Args:
+        ground_truth (np.ndarray): Array of ground truth indices for each query. Shape: [num_queries]
+        indices (np.ndarray): 2D array of indices returned from a nearest-neighbor search. Shape: [num_queries, topk]
+        topks (Sequence[int]): The k values to report HITS@k for.
+
+    Returns:
+        Dict[str, float]: {"HITS@k": ..., "MRR": ...}
+    """
+    indices = _as_numpy(indices)
+    assert (
+        max(topks) <= indices.shape[1]
+    ), "Topk must be smaller or equal than the size of index length"
+    matches = indices == _as_numpy(ground_truth).reshape(-1, 1)  # [num_queries, topk]
+    found = matches.any(axis=1)
+    ranks = np.where(found, matches.argmax(axis=1) + 1, np.inf)
+
+    metrics = {f"HITS@{topk}": float((ranks <= topk).mean()) for topk in topks}
+    metrics["MRR"] = float((1.0 / ranks).mean())
+    return metrics
+
+
+def build_lookup_table(id2data: Dict[int, str], size: Optional[int] = None) -> np.ndarray:
+    """
+    Turns an id->data dictionary (e.g. id2entity, or id2entity composed with entity2title) into an object array so
+    whole index arrays can be mapped with a single fancy-indexing operation (see `index2data`).
+
+    Args:
+        id2data (Dict[int, str]): Mapping from integer ids to their data.
+        size (Optional[int]): Length of the table. Defaults to max(id) + 1 (0 for an empty vocabulary). Missing ids map
+            to None.
+
+    Returns:
+        np.ndarray: Object array where table[i] = id2data[i].
+    """
+    if size is None:
+        size = max(id2data.keys()) + 1 if id2data else 0
+    table = np.empty(size, dtype=object)
+    ids = np.fromiter(id2data.keys(), dtype=np.int64, count=len(id2data))
+    values = np.empty(len(id2data), dtype=object)
+    values[:] = list(id2data.values())
+    table[ids] = values
+    return table
+
+
+def index2data(
+    indices: Union[np.ndarray, torch.Tensor], lookup_table: np.ndarray, max_results: Optional[int] = None
+) -> np.ndarray:
+    """
+    Maps an array of search result indices to their data (e.g. entity tokens or titles) in one vectorized lookup.
+
+    Args:
+        indices (np.ndarray): Search result indices of any shape, typically [num_queries, topk].
+        lookup_table (np.ndarray): Table built with `build_lookup_table`.
+        max_results (Optional[int]): If set, only the first `max_results` results of every query are mapped.
+
+    Returns:
+        np.ndarray: Object array with the same shape as `indices` (trimmed to `max_results` along the last axis).
+    """
+    indices = _as_numpy(indices)
+    if max_results is not None:
+        indices = indices[..., :max_results]
+    return lookup_table[indices]
+
+
+def index_cache_path(cache_dir: str, vectors: np.ndarray, index_signature: str, table_name: str = "embeddings") -> str:
+    """
+    Path of the serialized FAISS index for `vectors`, keyed by the name of the table, the index parameters and a content
+    hash of the vectors. Any change to the embeddings (e.g. a new checkpoint) or to the index parameters results in a
+    different file. Files that only differ in the content hash belong to older versions of the same table, see
+    `load_or_build_index`.
+
+    Args:
+        cache_dir (str): Directory the index is cached in (usually the `trained_model_path` of the embeddings).
+        vectors (np.ndarray): The vectors that are indexed.
+        index_signature (str): Short description of the index type and its parameters (e.g. "ivf-nlist100").
+        table_name (str): Name of the table within `cache_dir` (e.g. "entity" or "relation").
+
+    Returns:
+        str: Path to the serialized index.
+    """
+    content_hash = hashlib.sha1(np.ascontiguousarray(vectors).tobytes()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"ann_index_{table_name}_{index_signature}_{content_hash}.faiss")
+
+
+def load_or_build_index(cache_path: Optional[str], build_fn: Callable[[], faiss.Index]) -> faiss.Index:
+    """
+    Memory-maps the index stored at `cache_path` if it exists. Otherwise builds it with `build_fn` and serializes it there,
+    replacing the indexes cached for older versions of the same table (see `index_cache_path`).
+
+    Args:
+        cache_path (Optional[str]): Location of the cached index. If None, the index is always built and never cached.
+        build_fn (Callable[[], faiss.Index]): Builds (and trains, if needed) the index.
+
+    Returns:
+        faiss.Index: The loaded or freshly built index.
+    """
+    if cache_path is not None and os.path.exists(cache_path):
+        logger.info(f"Loading cached ANN index from {cache_path}")
+        return faiss.read_index(cache_path, faiss.IO_FLAG_MMAP)
+
+    index = build_fn()
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        try:
+            # Same table name and index parameters, any content hash
+            stale_prefix = cache_path.rsplit("_", 1)[0]
+            for stale_file in glob.glob(glob.escape(stale_prefix) + "_" + "[0-9a-f]" * 16 + ".faiss"):
+                os.remove(stale_file)
+        except OSError as e:
+            logger.warning(f"Could not remove the stale ANN indexes of {cache_path}: {e}")
+        faiss.write_index(index, cache_path)
+        logger.info(f"Cached ANN index at {cache_path}")
+    return index
+
+
+def index_search_params(index: faiss.Index) -> str:
+    """
+    Current values of the runtime search parameters of a FAISS index (`nprobe` of IVF indexes, `efSearch` of HNSW
+    indexes) as a parameter string accepted by `faiss.ParameterSpace`, empty if the index has neither.
+    """
+    params = []
+    try:
+        params.append(f"nprobe={faiss.extract_index_ivf(index).nprobe}")
+    except RuntimeError:
+        pass  # Not an IVF index
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        params.append(f"efSearch={hnsw.efSearch}")
+    return ",".join(params)
+
+
+def refresh_faiss_index(
+    index: faiss.Index,
+    changed_ids: np.ndarray,
+    changed_vectors: np.ndarray,
+    load_all_vectors: Callable[[], np.ndarray],
+) -> None:
+    """
+    Re-indexes the rows `changed_ids` without rebuilding (nor re-training) the index.
+
+    Flat indexes are overwritten in place and IVF indexes (any coarse quantizer/encoding) use `remove_ids` followed
+    by `add_with_ids`; both only read `changed_vectors`. Other indexes (HNSW, non-IVF scalar/product quantizers)
+    renumber their entries on removal, so they are reset and refilled with `load_all_vectors()` while keeping their
+    trained parameters.
+
+    Args:
+        index (faiss.Index): A writable (not memory-mapped) index holding the vectors under their row ids.
+        changed_ids (np.ndarray): Rows that changed.
+        changed_vectors (np.ndarray): The updated vectors of those rows. Shape: [len(changed_ids), dim]
+        load_all_vectors (Callable[[], np.ndarray]): Returns all the updated vectors. Shape: [num_vectors, dim]
+    """
+    changed_ids = changed_ids.astype(np.int64)
+    changed_vectors = np.ascontiguousarray(changed_vectors, dtype=np.float32)
+    if isinstance(index, faiss.IndexFlat):
+        stored = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+        stored[changed_ids] = changed_vectors
+    elif faiss.try_extract_index_ivf(index) is not None:
+        index.remove_ids(faiss.IDSelectorBatch(changed_ids))
+        index.add_with_ids(changed_vectors, changed_ids)  # type: ignore
+    else:
+        index.reset()
+        index.add(load_all_vectors())  # type: ignore
+
 class ANN_IndexMan:
     """
     A class for managing approximate nearest neighbor (ANN) search and exact nearest neighbor search for
@@ -43,9 +268,12 @@ class ANN_IndexMan:
 
     Attributes:
         data_df (pd.DataFrame): DataFrame loaded from the specified data path, containing the properties for each embedding.
-        embedding_vectors (np.ndarray): Array of embedding vectors loaded from the specified embedding path.
+        embedding_vectors (Optional[np.ndarray]): Array of embedding vectors loaded from the specified embedding path.
+            None in the device-resident mode, where `device_embeddings` is the only copy of the table.
         nlist (int): Number of clusters to use in the IVF index for approximate search.
-        index (faiss.Index): The FAISS index for performing similarity searches.
+        index_factory (Optional[str]): FAISS factory string the index was built from, if any.
+        index (Optional[faiss.Index]): The FAISS index for performing similarity searches. In the device-resident mode
+            it is only kept as the source of its FAISS GPU clone, and is None when no FAISS GPU build is available.
     """
 
     def __init__(
@@ -53,6 +281,14 @@ class ANN_IndexMan:
         embeddings_weigths: torch.Tensor,
         exact_computation: bool = True,
         nlist=100,
+        cache_dir: Optional[str] = None,
+        index_factory: Optional[str] = None,
+        search_params: Optional[str] = None,
+        device: Optional[Union[str, torch.device]] = None,
+        block_size: int = 16384,
+        storage: str = "float32",
+        rerank_factor: int = 4,
+        table_name: str = "embeddings",
     ):
         """
         Initializes the ANN_IndexMan class, loading data, creating embeddings, and setting up the FAISS index.
@@ -61,32 +297,123 @@ class ANN_IndexMan:
             embeddings_path (str): Path to the embedding CSV file, containing embedding vectors.
             exact_computation (bool): If True, initializes an exact L2 search index; if False, initializes an approximate IVF index.
             nlist (int): Number of clusters for the IVF index if exact_computation is False.
+            cache_dir (Optional[str]): If set, the (trained) index is serialized in this directory, keyed by the content of
+                the embeddings and the index parameters, and memory-mapped on later runs instead of being rebuilt.
+            index_factory (Optional[str]): FAISS index factory string (e.g. "IVF1024,PQ32", "HNSW32", "IVF1024,SQ8").
+                Overrides `exact_computation` and `nlist` when set.
+            search_params (Optional[str]): Runtime search parameters, see `set_search_params`.
+            device (Optional[Union[str, torch.device]]): If set, enables the device-resident search mode: queries and the
+                embedding table stay on `device` and `search` returns torch tensors. The index is cloned to the GPU when a
+                FAISS GPU build is available; otherwise an exact blocked matmul top-k is used (this also runs on CPU) and
+                no FAISS index is built (nor cached). No host copy of the embeddings is kept in this mode. Without FAISS
+                GPU, approximate options (`exact_computation=False`, `index_factory`, `search_params`, quantized
+                `storage`) cannot be honoured and raise a ValueError.
+            block_size (int): Number of embeddings scored per matmul block in the device-resident mode.
+            storage (str): 'float32' (default), 'float16' or 'int8'. The quantized options store the index with a FAISS
+                scalar quantizer (SQfp16 / per-dimension SQ8) and re-rank a shortlist of `rerank_factor * topk` candidates
+                with exact float32 distances. Cannot be combined with `index_factory`.
+            rerank_factor (int): Shortlist size multiplier for the quantized storage options.
+            table_name (str): Name of the table in `cache_dir`. Tables sharing a `cache_dir` need distinct names, a new
+                version of a table replaces the cached index of its previous version (see `load_or_build_index`).
         """
+        if storage not in ("float32", "float16", "int8"):
+            raise ValueError(f"Storage {storage} not supported, expected 'float32', 'float16' or 'int8'.")
+
+        # Device-resident search mode
+        self.device = torch.device(device) if device is not None else None
+        self.block_size = block_size
+        self.gpu_index = None
+        use_gpu_index = self.device is not None and self.device.type == "cuda" and faiss_gpu_available()
+        if self.device is not None and not use_gpu_index and (
+            not exact_computation or index_factory is not None or search_params or storage != "float32"
+        ):
+            raise ValueError(
+                f"The device-resident search on {self.device} without FAISS GPU is an exact blocked matmul, it cannot "
+                "serve `exact_computation=False`, `index_factory`, `search_params` or a quantized `storage`."
+            )
+
+        if storage != "float32":
+            if index_factory is not None:
+                raise ValueError("`storage` cannot be combined with `index_factory`, use an SQ factory string instead.")
+            index_factory = ("" if exact_computation else f"IVF{nlist},") + {"float16": "SQfp16", "int8": "SQ8"}[storage]
+
+        self.nlist = nlist
+        self.storage = storage
+        self.rerank_factor = rerank_factor
+
+        self.index_factory = index_factory
+
         # Ensure that vectors are in float32 for the sake of faise
-        self.embedding_vectors = embeddings_weigths.detach().cpu().numpy().astype(np.float32)
-        nlist = nlist
+        # (in the device-resident mode only while the index is built, the table then lives on the device)
+        vectors = None
+        if self.device is None or use_gpu_index:
+            vectors = embeddings_weigths.detach().cpu().numpy().astype(np.float32)
+        self.embedding_vectors = vectors if self.device is None else None
 
-        if exact_computation:
-            self.index = faiss.IndexFlatL2(
-                self.embedding_vectors.shape[1]
+        cache_path = None
+        if cache_dir is not None and vectors is not None:
+            if index_factory is not None:
+                index_signature = "factory-" + re.sub(r"[^A-Za-z0-9]+", "-", index_factory).strip("-")
+            else:
+                index_signature = "flat" if exact_computation else f"ivf-nlist{nlist}"
+            cache_path = index_cache_path(cache_dir, vectors, index_signature, table_name)
+
+        # Cached indexes are memory-mapped read-only, `refresh` loads a private copy before modifying them
+        self.index_cache_path = cache_path
+        self.index_is_mapped = cache_path is not None and os.path.exists(cache_path)
+        self.index = None
+        if vectors is not None:
+            self.index = load_or_build_index(
+                cache_path, lambda: self._build_index(vectors, exact_computation, nlist, index_factory)
+            )
+        if self.device is not None:
+            # A private copy: a view of the model parameters would follow fine-tuning and hide it from `refresh`
+            self.device_embeddings = embeddings_weigths.detach().to(self.device, torch.float32, copy=True)
+            self.device_sq_norms = (self.device_embeddings * self.device_embeddings).sum(dim=1)
+            if use_gpu_index:
+                # Queries cross to the GPU index as numpy arrays (see `_gpu_index_search`): importing
+                # faiss.contrib.torch_utils would patch every FAISS index of the process to return torch tensors
+                self.gpu_resources = faiss.StandardGpuResources()
+                self.gpu_index = faiss.index_cpu_to_gpu(
+                    self.gpu_resources, self.device.index or 0, self.index
+                )
+
+        self.search_params = None
+        if search_params:
+            self.set_search_params(search_params)
+
+    @staticmethod
+    def _build_index(
+        vectors: np.ndarray, exact_computation: bool, nlist: int, index_factory: Optional[str] = None
+    ) -> faiss.Index:
+        if index_factory is not None:
+            index = faiss.index_factory(vectors.shape[1], index_factory)
+            if not index.is_trained:
+                # IVF coarse quantizers, PQ codebooks and scalar quantizer ranges all need training
+                index.train(vectors)  # type: ignore
+            index.add(vectors)  # type: ignore
+        elif exact_computation:
+            index = faiss.IndexFlatL2(
+                vectors.shape[1]
             )  # L2 distance (Euclidean distance)
-            self.index.add(self.embedding_vectors)  # type: ignore
+            index.add(vectors)  # type: ignore
         else:
-            self.index = faiss.IndexIVFFlat(
-                faiss.IndexFlatL2(self.embedding_vectors.shape[1]),
-                self.embedding_vectors.shape[1],
+            index = faiss.IndexIVFFlat(
+                faiss.IndexFlatL2(vectors.shape[1]),
+                vectors.shape[1],
                 nlist,
             )
 
             # Train the index (necessary for IVF indices)
-            self.index.train(self.embedding_vectors)  # type: ignore
+            index.train(vectors)  # type: ignore
 
             # Add vectors to the index
-            self.index.add(self.embedding_vectors)  # type: ignore
+            index.add(vectors)  # type: ignore
+        return index
 
     def search(
         self, target_embeddings: torch.Tensor, topk
-    ) -> Tuple[np.ndarray, np.ndarray]:
+    ) -> Tuple[Union[np.ndarray, torch.Tensor], Union[np.ndarray, torch.Tensor]]:
         """
         Searches for the top-K nearest neighbors for a given set of target embeddings.
 
@@ -96,6 +423,8 @@ class ANN_IndexMan:
 
         Returns:
             resulting_embeddings (np.ndarray): entity embeddings retrieved using ANN
+            indices (np.ndarray): indices of the retrieved entities
+            (both are torch tensors on `self.device` in the device-resident mode)
         """
         # assert len(target_embeddings.shape) == 2, "Target embeddings must be a 2D array"
         if len(target_embeddings.shape) == 3:
@@ -104,13 +433,23 @@ class ANN_IndexMan:
             target_embeddings, torch.Tensor
         ), "Target embeddings must be a torch.Tensor"
 
-        # Check if tensors are on cuda, if so, move them to cpu
-        if target_embeddings.is_cuda:
-            target_embeddings = target_embeddings.cpu()
+        if self.device is not None:
+            return self._search_on_device(target_embeddings, topk)
 
+        # FAISS takes float32 numpy arrays (on cpu)
+        queries = np.ascontiguousarray(target_embeddings.detach().cpu().numpy().astype(np.float32))
 
         # TODO: Check that we are acutally passing the right shape of input
-        distances, indices = self.index.search(target_embeddings, topk)  # type: ignore
+        if self.storage != "float32":
+            # Shortlist from the quantized index, then re-rank it with the float32 embeddings
+            num_candidates = min(topk * self.rerank_factor, self.embedding_vectors.shape[0])
+            _, candidates = self.index.search(queries, num_candidates)  # type: ignore
+            distances, indices = exact_l2_rerank(
+                torch.from_numpy(queries), torch.from_numpy(self.embedding_vectors), torch.from_numpy(candidates), topk
+            )
+            distances, indices = distances.numpy(), indices.numpy()
+        else:
+            distances, indices = self.index.search(queries, topk)  # type: ignore
 
         # TODO: Add them back later the exact embedding extraction
         # Get the Actual Embeddings here
@@ -119,12 +458,177 @@ class ANN_IndexMan:
         return resulting_embeddings, indices
         # return indices
 
+    def _search_on_device(self, target_embeddings: torch.Tensor, topk: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        target_embeddings = target_embeddings.detach().to(self.device, torch.float32)
+        if self.gpu_index is not None and self.storage != "float32":
+            num_candidates = min(topk * self.rerank_factor, self.device_embeddings.shape[0])
+            candidates = self._gpu_index_search(target_embeddings, num_candidates)
+            _, indices = exact_l2_rerank(target_embeddings, self.device_embeddings, candidates, topk)
+        elif self.gpu_index is not None:
+            indices = self._gpu_index_search(target_embeddings, topk)
+        else:
+            _, indices = blocked_l2_topk(
+                target_embeddings, self.device_embeddings, topk, self.block_size, self.device_sq_norms
+            )
+        resulting_embeddings = self.device_embeddings[indices.squeeze(), :]
+        return resulting_embeddings, indices
+
+    def _gpu_index_search(self, target_embeddings: torch.Tensor, topk: int) -> torch.Tensor:
+        """Searches the GPU clone of the index, converting at the numpy boundary. Returns indices on `self.device`."""
+        _, indices = self.gpu_index.search(np.ascontiguousarray(_as_numpy(target_embeddings)), topk)  # type: ignore
+        return torch.from_numpy(indices).to(self.device)
+
+    def batch_search(
+        self, target_embeddings: torch.Tensor, topk: int
+    ) -> Tuple[Union[np.ndarray, torch.Tensor], Union[np.ndarray, torch.Tensor]]:
+        """
+        Searches whole trajectories in a single call.
+
+        Args:
+            target_embeddings (torch.Tensor): Embeddings to search for. Shape: [steps, batch_size, D] (any leading dims)
+            topk (int): Number of nearest neighbors to retrieve.
+
+        Returns:
+            resulting_embeddings: Retrieved embeddings. Shape: [steps, batch_size, topk, D]
+            indices: Indices of the retrieved entries. Shape: [steps, batch_size, topk]
+        """
+        leading_shape = target_embeddings.shape[:-1]
+        _, indices = self.search(target_embeddings.reshape(-1, target_embeddings.shape[-1]), topk)
+        indices = indices.reshape(*leading_shape, -1)
+        embedding_table = self.device_embeddings if self.device is not None else self.embedding_vectors
+        return embedding_table[indices], indices
+
+    def refresh(self, embeddings_weigths: torch.Tensor, tolerance: float = 1e-6) -> np.ndarray:
+        """
+        Re-indexes only the embeddings whose rows changed by more than `tolerance` (max. absolute difference), e.g.
+        after fine-tuning the KGE embeddings, instead of rebuilding the whole index (see `refresh_faiss_index`).
+
+        Args:
+            embeddings_weigths (torch.Tensor): The updated embeddings, same shape as the indexed ones.
+            tolerance (float): Rows whose entries all moved by at most `tolerance` are left untouched.
+
+        Returns:
+            np.ndarray: Ids of the re-indexed embeddings.
+        """
+        if self.device is not None:
+            return self._refresh_on_device(embeddings_weigths, tolerance)
+
+        new_vectors = embeddings_weigths.detach().cpu().numpy().astype(np.float32)
+        assert new_vectors.shape == self.embedding_vectors.shape, "Refresh cannot change the shape of the embeddings"
+        changed_ids = np.flatnonzero(np.abs(new_vectors - self.embedding_vectors).max(axis=1) > tolerance)
+        if changed_ids.size == 0:
+            return changed_ids
+
+        self.embedding_vectors[changed_ids] = new_vectors[changed_ids]
+        self._refresh_index(changed_ids, new_vectors[changed_ids], lambda: self.embedding_vectors)
+        if self.search_params:
+            self.set_search_params(self.search_params)
+        return changed_ids
+
+    def _refresh_on_device(self, embeddings_weigths: torch.Tensor, tolerance: float) -> np.ndarray:
+        new_vectors = embeddings_weigths.detach().to(self.device, torch.float32)
+        assert new_vectors.shape == self.device_embeddings.shape, "Refresh cannot change the shape of the embeddings"
+        rows = torch.nonzero((new_vectors - self.device_embeddings).abs().amax(dim=1) > tolerance).squeeze(1)
+        changed_ids = rows.cpu().numpy()
+        if changed_ids.size == 0:
+            return changed_ids
+
+        self.device_embeddings[rows] = new_vectors[rows]
+        self.device_sq_norms[rows] = (self.device_embeddings[rows] * self.device_embeddings[rows]).sum(dim=1)
+        if self.gpu_index is not None:
+            # The host index is the source of the GPU clone, it reads host copies of the vectors only while it is updated
+            self._refresh_index(
+                changed_ids, self.device_embeddings[rows].cpu().numpy(), lambda: self.device_embeddings.cpu().numpy()
+            )
+            self.gpu_index = faiss.index_cpu_to_gpu(self.gpu_resources, self.device.index or 0, self.index)
+            if self.search_params:
+                self.set_search_params(self.search_params)
+        return changed_ids
+
+    def _refresh_index(
+        self, changed_ids: np.ndarray, changed_vectors: np.ndarray, load_all_vectors: Callable[[], np.ndarray]
+    ) -> None:
+        if self.index_is_mapped:
+            self.index = faiss.read_index(self.index_cache_path)
+            self.index_is_mapped = False
+        refresh_faiss_index(self.index, changed_ids, changed_vectors, load_all_vectors)
+
+    def set_search_params(self, search_params: Union[str, Dict[str, Union[int, float]]]) -> None:
+        """
+        Tunes the runtime search parameters of the index without rebuilding it.
+
+        Args:
+            search_params (Union[str, Dict]): Either a FAISS parameter string (e.g. "nprobe=16" or "nprobe=16,efSearch=64")
+                or a dictionary (e.g. {"nprobe": 16}). Typical knobs are `nprobe` for IVF indexes and `efSearch` for HNSW.
+                The exact blocked matmul of the device-resident mode has no parameters and ignores them.
+        """
+        if isinstance(search_params, dict):
+            search_params = ",".join(f"{key}={value}" for key, value in search_params.items())
+        self.search_params = search_params
+        if self.index is None:
+            return
+        faiss.ParameterSpace().set_index_parameters(self.index, search_params)
+        if self.gpu_index is not None:
+            faiss.GpuParameterSpace().set_index_parameters(self.gpu_index, search_params)
+
+    def benchmark_recall(
+        self,
+        query_embeddings: torch.Tensor,
+        search_params_sweep: Sequence[str] = ("",),
+        topks: Sequence[int] = (1, 10),
+    ) -> List[Dict[str, Union[str, float]]]:
+        """
+        Sweeps runtime search parameters and reports recall against an exact (flat L2) index together with the latency.
+        Recall@k is the hit@k score (see `calculate_hits_at_n`) of the exact nearest neighbor of every query, i.e. the
+        usual 1-recall@k of ANN benchmarks. The search parameters of the index are restored afterwards.
+
+        Only the CPU FAISS index itself is benchmarked: the exact re-ranking of the quantized `storage` options and
+        the device-resident search mode are not part of the measured search.
+
+        Args:
+            query_embeddings (torch.Tensor): Queries to benchmark with. Shape: [num_queries, dim]
+            search_params_sweep (Sequence[str]): Operating points to evaluate (e.g. ["nprobe=1", "nprobe=8", "nprobe=64"]).
+            topks (Sequence[int]): The k values to report recall for.
+
+        Returns:
+            List[Dict]: One row per operating point with keys "search_params", "latency_ms" (per query) and "recall@k".
+        """
+        assert self.index is not None, "The device-resident mode has no FAISS index to benchmark without FAISS GPU"
+        queries = np.ascontiguousarray(query_embeddings.detach().cpu().numpy().astype(np.float32))
+
+        vectors = self.embedding_vectors if self.device is None else self.device_embeddings.cpu().numpy()
+        exact_index = faiss.IndexFlatL2(vectors.shape[1])
+        exact_index.add(vectors)  # type: ignore
+        _, ground_truth = exact_index.search(queries, 1)  # type: ignore
+
+        # The sweep changes the live index, remember its operating point to restore it
+        previous_search_params = self.search_params
+        previous_index_params = index_search_params(self.index)
+
+        results = []
+        try:
+            for search_params in search_params_sweep:
+                self.set_search_params(search_params)
+                start = time.perf_counter()
+                _, indices = self.index.search(queries, max(topks))  # type: ignore
+                elapsed = time.perf_counter() - start
+
+                row: Dict[str, Union[str, float]] = {
+                    "search_params": search_params,
+                    "latency_ms": 1000 * elapsed / len(queries),
+                }
+                for topk in topks:
+                    row[f"recall@{topk}"] = self.calculate_hits_at_n(ground_truth[:, 0], indices, topk)
+                results.append(row)
+                logger.info(f"ANN benchmark {row}")
+        finally:
+            self.set_search_params(previous_search_params or previous_index_params)
+            self.search_params = previous_search_params
+        return results
+
     def calculate_hits_at_n(
         self, ground_truth: np.ndarray, indices: np.ndarray, topk: int
     ) -> float:
-        assert (
-            topk <= indices.shape[1]
-        ), "Topk must be smaller or equal than the size of index length"
         """
         Calculates the hit@N score, which is the fraction of queries where the correct index is within the top N nearest neighbors.
 
@@ -136,72 +640,445 @@ class ANN_IndexMan:
         Returns:
             float: The hit@N score.
         """
-        hits_at_n = sum(
-            [1 for i, gt in enumerate(ground_truth) if gt in indices[i, :topk]]
+        return calculate_hits_at_n(ground_truth, indices, topk)
+
+    def calculate_ranking_metrics(
+        self, ground_truth: np.ndarray, indices: np.ndarray, topks: Sequence[int] = (1, 3, 10)
+    ) -> Dict[str, float]:
+        """
+        Calculates HITS@k for every k in `topks` and the MRR in a single pass, see `calculate_ranking_metrics`.
+        """
+        return calculate_ranking_metrics(ground_truth, indices, topks)
+
+def phase_to_unit_circle(phases: torch.Tensor) -> torch.Tensor:
+    """
+    Maps phase embeddings (in radians) to their unit-circle representation (cos θ, sin θ).
+
+    For two phase vectors a and b of dimension D, the squared chord distance between their unit-circle
+    representations is 2D - 2 * <u(a), u(b)>, so ranking by (wrapped) phase proximity becomes an inner product.
+
+    Args:
+        phases (torch.Tensor): Phases in radians. Shape: [..., D]
+
+    Returns:
+        torch.Tensor: Unit-circle representation. Shape: [..., 2D] (cosines first, sines second)
+    """
+    return torch.cat([torch.cos(phases), torch.sin(phases)], dim=-1)
+
+
+class QuantizedTable:
+    """
+    Row-major embedding table stored in float16, or as per-dimension 8-bit codes with a float32 scale/offset
+    (value ≈ offset + scale * code). Indexing returns dequantized float32 rows, so the table can stand in for a
+    float32 tensor in `chunked_phase_topk` and `blocked_l2_topk`.
+
+    Attributes:
+        storage (str): 'float16' or 'int8'.
+        codes (torch.Tensor): Stored codes (float16 or uint8). Shape: [num_embeddings, D]
+        scale (Optional[torch.Tensor]): Per-dimension step of the 8-bit codes. Shape: [D]
+        offset (Optional[torch.Tensor]): Per-dimension minimum of the 8-bit codes. Shape: [D]
+    """
+
+    def __init__(self, vectors: torch.Tensor, storage: str):
+        self.storage = storage
+        self.scale, self.offset = None, None
+        if storage == "int8":
+            self.offset = vectors.min(dim=0).values.float()
+            self.scale = ((vectors.max(dim=0).values - self.offset) / 255).clamp(min=1e-12).float()
+        elif storage != "float16":
+            raise ValueError(f"Storage {storage} not supported, expected 'float16' or 'int8'.")
+        self.codes = self.encode(vectors)
+
+    def encode(self, vectors: torch.Tensor) -> torch.Tensor:
+        """Quantizes `vectors` with the table's codec (values outside the int8 range are clipped)."""
+        if self.scale is None:
+            return vectors.to(torch.float16)
+        return torch.round((vectors - self.offset) / self.scale).clamp(0, 255).to(torch.uint8)
+
+    @property
+    def shape(self) -> torch.Size:
+        return self.codes.shape
+
+    @property
+    def device(self) -> torch.device:
+        return self.codes.device
+
+    def __getitem__(self, rows) -> torch.Tensor:
+        vectors = self.codes[rows].float()
+        if self.scale is not None:
+            vectors = vectors * self.scale + self.offset
+        return vectors
+
+
+def exact_l2_rerank(
+    queries: torch.Tensor, vectors: torch.Tensor, candidates: torch.Tensor, topk: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Re-ranks candidate lists (e.g. from a quantized index) with exact float32 squared L2 distances.
+    Candidates padded with -1 by approximate indexes are ranked last.
+
+    Args:
+        queries (torch.Tensor): Shape: [batch, dim]
+        vectors (torch.Tensor): Exact float32 vectors. Shape: [num_vectors, dim]
+        candidates (torch.Tensor): Candidate indices. Shape: [batch, num_candidates]
+        topk (int): Number of neighbors to keep.
+
+    Returns:
+        distances (torch.Tensor): Squared L2 distances. Shape: [batch, topk]
+        indices (torch.Tensor): Indices of the neighbors. Shape: [batch, topk]
+    """
+    missing = candidates < 0
+    candidates = candidates.clamp(min=0)
+    distances = (vectors[candidates] - queries.unsqueeze(1)).pow(2).sum(dim=-1)
+    distances = distances.masked_fill(missing, float("inf"))
+    distances, order = torch.topk(distances, min(topk, candidates.shape[1]), dim=-1, largest=False)
+    return distances, torch.gather(candidates, 1, order)
+
+
+def merge_topk(
+    scores_a: torch.Tensor,
+    indices_a: torch.Tensor,
+    scores_b: torch.Tensor,
+    indices_b: torch.Tensor,
+    topk: int,
+    largest: bool = True,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Merges two partial top-k results (e.g. from two blocks of entities) into a single top-k result.
+
+    Args:
+        scores_a, indices_a (torch.Tensor): Running top-k scores and their global indices. Shape: [batch, k_a]
+        scores_b, indices_b (torch.Tensor): Top-k scores and global indices of the new block. Shape: [batch, k_b]
+        topk (int): Number of results to keep.
+        largest (bool): If True keep the largest scores (similarities), otherwise the smallest (distances).
+
+    Returns:
+        scores, indices (torch.Tensor): Merged top-k. Shape: [batch, min(topk, k_a + k_b)]
+    """
+    scores = torch.cat([scores_a, scores_b], dim=1)
+    indices = torch.cat([indices_a, indices_b], dim=1)
+    scores, positions = torch.topk(scores, min(topk, scores.shape[1]), dim=1, largest=largest)
+    return scores, torch.gather(indices, 1, positions)
+
+
+def chunked_phase_topk(
+    query_phases: torch.Tensor,
+    phases: torch.Tensor,
+    topk: int,
+    chunk_size: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Retrieves the top-k phase embeddings closest (in chord distance) to each query without ever materializing
+    a [batch, num_entities, dim] tensor. Entities are visited in blocks of `chunk_size`, scored with a single
+    matmul on their unit-circle representation and merged into a running top-k.
+
+    Args:
+        query_phases (torch.Tensor): Query phases in radians. Shape: [batch, D]
+        phases (torch.Tensor): Indexed phases in radians. Shape: [num_entities, D]
+        topk (int): Number of neighbors to retrieve.
+        chunk_size (int): Number of entities scored per block.
+
+    Returns:
+        similarities (torch.Tensor): Unit-circle inner products (larger is closer). Shape: [batch, topk]
+        indices (torch.Tensor): Indices of the retrieved entities. Shape: [batch, topk]
+    """
+    query_units = phase_to_unit_circle(query_phases)
+    best_scores, best_indices = None, None
+    for start in range(0, phases.shape[0], chunk_size):
+        block_units = phase_to_unit_circle(phases[start : start + chunk_size])
+        similarities = query_units @ block_units.T  # [batch, block]
+        block_scores, block_indices = torch.topk(
+            similarities, min(topk, similarities.shape[1]), dim=1
+        )
+        block_indices += start
+        if best_scores is None:
+            best_scores, best_indices = block_scores, block_indices
+        else:
+            best_scores, best_indices = merge_topk(
+                best_scores, best_indices, block_scores, block_indices, topk
+            )
+    return best_scores, best_indices
+
+
+def chunked_angular_topk(
+    query_phases: torch.Tensor,
+    phases: torch.Tensor,
+    topk: int,
+    chunk_size: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Retrieves the top-k phase embeddings closest in wrapped angular L2 distance to each query, scoring the entities
+    in blocks of `chunk_size` rows and merging them into a running top-k. Exact, but each block holds a
+    [batch, chunk_size, D] angular difference tensor, so it is meant for small batches or small blocks.
+
+    Args:
+        query_phases (torch.Tensor): Query phases in radians. Shape: [batch, D]
+        phases (torch.Tensor): Indexed phases in radians. Shape: [num_entities, D]
+        topk (int): Number of neighbors to retrieve.
+        chunk_size (int): Number of entities scored per block.
+
+    Returns:
+        distances (torch.Tensor): Wrapped angular L2 distances. Shape: [batch, topk]
+        indices (torch.Tensor): Indices of the retrieved entities. Shape: [batch, topk]
+    """
+    best_distances, best_indices = None, None
+    for start in range(0, phases.shape[0], chunk_size):
+        distances = angular_difference(
+            query_phases.unsqueeze(1), phases[start : start + chunk_size].unsqueeze(0), smooth=False
+        ).norm(dim=-1)  # [batch, block]
+        block_distances, block_indices = torch.topk(
+            distances, min(topk, distances.shape[1]), dim=1, largest=False
+        )
+        block_indices += start
+        if best_distances is None:
+            best_distances, best_indices = block_distances, block_indices
+        else:
+            best_distances, best_indices = merge_topk(
+                best_distances, best_indices, block_distances, block_indices, topk, largest=False
+            )
+    return best_distances, best_indices
+
+
+def blocked_l2_topk(
+    queries: torch.Tensor,
+    vectors: torch.Tensor,
+    topk: int,
+    block_size: int,
+    vector_sq_norms: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Exact L2 nearest neighbor search with a blocked matmul, on whatever device `queries` and `vectors` live.
+    Mirrors `faiss.IndexFlatL2` (squared distances, ascending) without a device->host round trip.
+
+    Args:
+        queries (torch.Tensor): Shape: [batch, dim]
+        vectors (torch.Tensor): Indexed vectors. Shape: [num_vectors, dim]
+        topk (int): Number of neighbors to retrieve.
+        block_size (int): Number of vectors scored per matmul block.
+        vector_sq_norms (Optional[torch.Tensor]): Precomputed squared norms of `vectors`. Shape: [num_vectors]
+
+    Returns:
+        distances (torch.Tensor): Squared L2 distances. Shape: [batch, topk]
+        indices (torch.Tensor): Indices of the neighbors. Shape: [batch, topk]
+    """
+    if vector_sq_norms is None:
+        vector_sq_norms = (vectors * vectors).sum(dim=1)
+    query_sq_norms = (queries * queries).sum(dim=1, keepdim=True)
+
+    best_distances, best_indices = None, None
+    for start in range(0, vectors.shape[0], block_size):
+        block = vectors[start : start + block_size]
+        distances = query_sq_norms - 2 * (queries @ block.T) + vector_sq_norms[start : start + block_size]
+        block_distances, block_indices = torch.topk(
+            distances, min(topk, distances.shape[1]), dim=1, largest=False
         )
-        hit_at_n_score = hits_at_n / len(ground_truth)
-        return hit_at_n_score
+        block_indices += start
+        if best_distances is None:
+            best_distances, best_indices = block_distances, block_indices
+        else:
+            best_distances, best_indices = merge_topk(
+                best_distances, best_indices, block_distances, block_indices, topk, largest=False
+            )
+    return best_distances.clamp(min=0), best_indices
+
+
+def faiss_gpu_available() -> bool:
+    """
+    Whether the installed FAISS build ships GPU indexes and sees at least one GPU.
+    """
+    return hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+
 
-# TODO: Improve the implementation, it is currently very slow
 class ANN_IndexMan_pRotatE:
     """
+    Nearest neighbor search (wrapped angular L2 distance) for phase (pRotatE) embeddings.
+
+    Candidates are shortlisted with a chunked matmul over the unit-circle (cos θ, sin θ) representation of the
+    phases (see `chunked_phase_topk`) and then re-ranked with the wrapped angular distance used everywhere else
+    in the navigation code, keeping the memory footprint at [batch, chunk_size] instead of [batch, num_entities, dim].
+
+    The shortlist alone is approximate: the chord distance Σ(2 - 2cos Δθ) is only a surrogate of the angular
+    distance. Since Δθ² ≥ 2 - 2cos Δθ for every wrapped angle, no entity left out of the shortlist can be closer
+    than the largest chord distance in it. With `exact=True` (the default) queries whose k-th re-ranked distance
+    does not beat that bound are re-scored against every entity (`chunked_angular_topk`), so the results match a
+    full sort. Top-1 lookups of queries close to an entity, as in navigation, are usually certified by the
+    shortlist; larger k or queries far from every entity mostly fall back to the full scan.
+
+    Attributes:
+        embedding_range (float): Range used by the KGE model to map embeddings to [-π, π].
+        embedding_vectors (Union[torch.Tensor, QuantizedTable]): Phases (in radians) of the indexed embeddings,
+            quantized when `storage` is not 'float32'. Shape: [num_entities, D]
+        exact_embeddings (Optional[torch.Tensor]): The KGE embeddings used for the exact re-ranking of quantized tables.
+        chunk_size (int): Number of entities scored per matmul block.
+        rerank_factor (int): Shortlist size multiplier for the exact angular re-ranking.
+        exact (bool): Whether uncertified shortlists fall back to a full scan (float32 storage only).
     """
 
     def __init__(
         self,
         embeddings_weigths: torch.Tensor,
         embedding_range: float = 1.0,
+        chunk_size: int = 16384,
+        rerank_factor: int = 4,
+        device: Optional[Union[str, torch.device]] = None,
+        storage: str = "float32",
+        exact: bool = True,
     ):
         """
+        Args:
+            embeddings_weigths (torch.Tensor): Embeddings as stored by the KGE model (phases scaled by embedding_range/π).
+            embedding_range (float): The `embedding_range` of the KGE model.
+            chunk_size (int): Number of entities scored per matmul block.
+            rerank_factor (int): The shortlist holds `rerank_factor * topk` candidates before exact re-ranking.
+            device (Optional[Union[str, torch.device]]): Device holding the phase table. Queries are moved there and
+                results are returned there, so a table on the training device avoids any device->host round trip.
+            storage (str): 'float32' (default), 'float16' or 'int8'. The quantized options keep the phase table used
+                for the shortlist as a `QuantizedTable` and re-rank the shortlist against `embeddings_weigths` itself
+                (held by reference, so no float32 copy is made).
+            exact (bool): If True, queries whose shortlist cannot be certified are re-scored against every entity (see
+                the class docstring). If False, the re-ranked shortlist is returned as is (approximate). Quantized
+                tables are always searched approximately.
         """
+        assert chunk_size > 0, "chunk_size must be positive"
+        assert rerank_factor >= 1, "rerank_factor must be at least 1"
         self.embedding_range = embedding_range
-        self.embedding_vectors = (embeddings_weigths/(self.embedding_range/torch.pi)).detach().cpu().float().unsqueeze(0) # [1, embedding_num, embedding_dim]
+        self.chunk_size = chunk_size
+        self.rerank_factor = rerank_factor
+        self.storage = storage
+        self.exact = exact and storage == "float32"
+        device = torch.device(device) if device is not None else torch.device("cpu")
+        phases = (embeddings_weigths/(self.embedding_range/torch.pi)).detach().to(device, torch.float32) # [embedding_num, embedding_dim]
+        if storage == "float32":
+            self.embedding_vectors = phases
+            self.exact_embeddings = None
+        else:
+            self.embedding_vectors = QuantizedTable(phases, storage)
+            self.exact_embeddings = embeddings_weigths.detach()
+
+    def refresh(self, embeddings_weigths: torch.Tensor, tolerance: float = 1e-6) -> torch.Tensor:
+        """
+        Updates only the phases whose rows changed by more than `tolerance` (max. absolute difference, in radians),
+        visiting the table in blocks of `chunk_size` rows. Quantized tables re-encode the rows whose codes change.
+
+        Args:
+            embeddings_weigths (torch.Tensor): The updated embeddings, same shape as the indexed ones.
+            tolerance (float): Rows whose phases all moved by at most `tolerance` are left untouched.
+
+        Returns:
+            torch.Tensor: Ids of the updated embeddings.
+        """
+        assert embeddings_weigths.shape == self.embedding_vectors.shape, "Refresh cannot change the shape of the embeddings"
+        embeddings_weigths = embeddings_weigths.detach()
+        device = self.embedding_vectors.device
+        changed_ids = []
+        for start in range(0, embeddings_weigths.shape[0], self.chunk_size):
+            phases = embeddings_weigths[start : start + self.chunk_size].to(device, torch.float32)/(self.embedding_range/torch.pi)
+            if self.exact_embeddings is None:
+                changed = (phases - self.embedding_vectors[start : start + self.chunk_size]).abs().amax(dim=1) > tolerance
+                self.embedding_vectors[start : start + self.chunk_size][changed] = phases[changed]
+            else:
+                codes = self.embedding_vectors.encode(phases)
+                changed = (codes != self.embedding_vectors.codes[start : start + self.chunk_size]).any(dim=1)
+                self.embedding_vectors.codes[start : start + self.chunk_size][changed] = codes[changed]
+            changed_ids.append(torch.nonzero(changed).squeeze(1) + start)
+
+        if self.exact_embeddings is not None:
+            self.exact_embeddings = embeddings_weigths
+        if not changed_ids:
+            return torch.empty(0, dtype=torch.int64)
+        return torch.cat(changed_ids).cpu()
+
+    def get_phases(self, indices: torch.Tensor) -> torch.Tensor:
+        """
+        Returns the exact float32 phases (in radians) of the given entity indices, on the device of the phase table.
+        """
+        if self.exact_embeddings is None:
+            return self.embedding_vectors[indices]
+        rows = self.exact_embeddings[indices.to(self.exact_embeddings.device)]
+        return rows.to(self.embedding_vectors.device, torch.float32)/(self.embedding_range/torch.pi)
 
     def search(
         self, target_embeddings: torch.Tensor, topk
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """
+        Searches for the top-K nearest neighbors (wrapped angular L2 distance) of the target embeddings.
+
+        Args:
+            target_embeddings (torch.Tensor): Embeddings to search for. Shape: [batch_size, D] or [D]
+            topk (int): Number of nearest neighbors to retrieve.
+
+        Returns:
+            resulting_embeddings (torch.Tensor): Retrieved entity embeddings (in the KGE model scale)
+            indices (torch.Tensor): Indices of the retrieved entities. Shape: [batch_size, topk]
         """
         assert isinstance(
             target_embeddings, torch.Tensor
         ), "Target embeddings must be a torch.Tensor"
 
         assert len(target_embeddings.shape) < 3, "Target embeddings must be a 2D array"
-        if len(target_embeddings.shape) == 2:
-            target_embeddings = target_embeddings.unsqueeze(1) #[batch_size, 1, embedding_dim]
-        else:
-            target_embeddings = target_embeddings.unsqueeze(0).unsqueeze(0) #[1, 1, embedding_dim]
+        if len(target_embeddings.shape) == 1:
+            target_embeddings = target_embeddings.unsqueeze(0) #[1, embedding_dim]
 
-        # Check if tensors are on cuda, if so, move them to cpu
-        if target_embeddings.is_cuda:
-            target_embeddings = target_embeddings.cpu()
+        # Search where the phase table lives
+        target_embeddings = target_embeddings.detach().to(self.embedding_vectors.device)
 
-        target_embeddings = target_embeddings/(self.embedding_range/torch.pi)
+        target_phases = target_embeddings.float()/(self.embedding_range/torch.pi)
 
-        diff = target_embeddings - self.embedding_vectors # [batch_size, embedding_num, embedding_dim]
+        # Shortlist with the unit-circle matmul, then re-rank the shortlist exactly
+        num_embeddings, dim = self.embedding_vectors.shape
+        num_candidates = min(topk * self.rerank_factor, num_embeddings)
+        similarities, candidates = chunked_phase_topk(
+            target_phases, self.embedding_vectors, num_candidates, self.chunk_size
+        ) # [batch_size, num_candidates]
 
-        distances = angular_difference(target_embeddings, self.embedding_vectors, smooth=False).norm(dim=-1)
+        distances = angular_difference(
+            target_phases.unsqueeze(1), self.get_phases(candidates), smooth=False
+        ).norm(dim=-1) # [batch_size, num_candidates]
+        distances, order = torch.topk(distances, min(topk, num_candidates), dim=-1, largest=False)
+        indices = torch.gather(candidates, 1, order)
 
-        distances, indices = torch.sort(distances, dim=-1, descending=False)
+        if self.exact and num_candidates < num_embeddings:
+            # Entities outside the shortlist are at least as far (squared) as its largest chord distance, up to the
+            # float32 error of the matmul. Queries whose k-th distance does not beat that bound are scanned in full.
+            chord_bound = 2 * dim - 2 * similarities[:, -1] - 1e-4 * dim
+            uncertified = torch.nonzero(distances[:, -1].pow(2) > chord_bound).squeeze(1)
+            if uncertified.numel() > 0:
+                _, indices[uncertified] = chunked_angular_topk(
+                    target_phases[uncertified], self.embedding_vectors, topk, max(1, self.chunk_size // dim)
+                )
 
-        distances = distances[:, :topk]
-        indices = indices[:, :topk]
-
-        resulting_embeddings = self.embedding_vectors[0, indices.squeeze(), :] * (self.embedding_range/torch.pi)
+        resulting_embeddings = self.get_embedding(indices)
 
         return resulting_embeddings, indices
 
+    def batch_search(
+        self, target_embeddings: torch.Tensor, topk: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Searches whole trajectories in a single call.
+
+        Args:
+            target_embeddings (torch.Tensor): Embeddings to search for. Shape: [steps, batch_size, D] (any leading dims)
+            topk (int): Number of nearest neighbors to retrieve.
+
+        Returns:
+            resulting_embeddings: Retrieved entity embeddings (in the KGE model scale). Shape: [steps, batch_size, topk, D]
+            indices: Indices of the retrieved entries. Shape: [steps, batch_size, topk]
+        """
+        leading_shape = target_embeddings.shape[:-1]
+        _, indices = self.search(target_embeddings.reshape(-1, target_embeddings.shape[-1]), topk)
+        indices = indices.reshape(*leading_shape, -1)
+        return self.get_phases(indices) * (self.embedding_range/torch.pi), indices
+
     def get_embedding(self, indices: torch.Tensor) -> torch.Tensor:
         """
+        Returns the embeddings (in the KGE model scale) of the given entity indices.
         """
-        return self.embedding_vectors[0, indices.squeeze(), :] * (self.embedding_range/torch.pi)
+        return self.get_phases(indices.squeeze()) * (self.embedding_range/torch.pi)
 
     def calculate_hits_at_n(
         self, ground_truth: np.ndarray, indices: np.ndarray, topk: int
     ) -> float:
-        assert (
-            topk <= indices.shape[1]
-        ), "Topk must be smaller or equal than the size of index length"
         """
         Calculates the hit@N score, which is the fraction of queries where the correct index is within the top N nearest neighbors.
 
@@ -213,8 +1090,524 @@ class ANN_IndexMan_pRotatE:
         Returns:
             float: The hit@N score.
         """
-        hits_at_n = sum(
-            [1 for i, gt in enumerate(ground_truth) if gt in indices[i, :topk]]
+        return calculate_hits_at_n(ground_truth, indices, topk)
+
+    def calculate_ranking_metrics(
+        self, ground_truth: np.ndarray, indices: np.ndarray, topks: Sequence[int] = (1, 3, 10)
+    ) -> Dict[str, float]:
+        """
+        Calculates HITS@k for every k in `topks` and the MRR in a single pass, see `calculate_ranking_metrics`.
+        """
+        return calculate_ranking_metrics(ground_truth, indices, topks)
+
+class ANN_IndexMan_Rotational(ANN_IndexMan_pRotatE):
+    """
+    FAISS-backed nearest neighbor search for rotational (pRotatE entities, pRotatE/RotatE relations) embeddings.
+
+    The phases are mapped to their unit-circle representation (cos θ, sin θ), where the L2 distance is the chord
+    representation. This lets FAISS serve the wrapped angular ranking with its flat, IVF and HNSW
+    indexes. As in `ANN_IndexMan_pRotatE`, the FAISS results are a shortlist that is re-ranked with the wrapped
+    angular distance, so the `search`/`get_embedding`/`calculate_hits_at_n` surface behaves the same. There is no
+    full-scan fallback: the search is approximate even with the flat index (`ANN_IndexMan_pRotatE(exact=False)`).
+
+    Attributes:
+        index_type (str): One of 'flat', 'ivf' or 'hnsw'.
+        index (faiss.Index): The FAISS index holding the unit-circle vectors.
+    """
+
+    def __init__(
+        self,
+        embeddings_weigths: torch.Tensor,
+        embedding_range: float = 1.0,
+        index_type: str = "flat",
+        nlist: int = 100,
+        nprobe: int = 1,
+        hnsw_m: int = 32,
+        rerank_factor: int = 4,
+        cache_dir: Optional[str] = None,
+        storage: str = "float32",
+        table_name: str = "embeddings",
+        search_params: Optional[str] = None,
+    ):
+        """
+        Args:
+            embeddings_weigths (torch.Tensor): Embeddings as stored by the KGE model (phases scaled by embedding_range/π).
+            embedding_range (float): The `embedding_range` of the KGE model.
+            index_type (str): 'flat' for exact chord-distance search, 'ivf' for an inverted file index, 'hnsw' for a graph index.
+            nlist (int): Number of clusters for the IVF index.
+            nprobe (int): Number of clusters visited per query by the IVF index.
+            hnsw_m (int): Number of neighbors per node in the HNSW graph.
+            rerank_factor (int): The FAISS shortlist holds `rerank_factor * topk` candidates before exact re-ranking.
+            cache_dir (Optional[str]): If set, the index is serialized in this directory (see `ANN_IndexMan`).
+            storage (str): 'float32' (default), 'float16' or 'int8'. The quantized options encode the unit-circle vectors
+                of the FAISS index with a scalar quantizer (SQfp16 / per-dimension SQ8) and keep the phase table as a
+                `QuantizedTable`; the shortlist is still re-ranked with the exact phases of `embeddings_weigths`.
+            table_name (str): Name of the table in `cache_dir` (see `ANN_IndexMan`).
+            search_params (Optional[str]): FAISS runtime parameters applied after `nprobe` (e.g. "nprobe=16" or
+                "efSearch=64"), see `ANN_IndexMan.set_search_params`.
+        """
+        if storage not in ("float32", "float16", "int8"):
+            raise ValueError(f"Storage {storage} not supported, expected 'float32', 'float16' or 'int8'.")
+        super().__init__(
+            embeddings_weigths, embedding_range=embedding_range, rerank_factor=rerank_factor, storage=storage,
+            exact=False,
         )
-        hit_at_n_score = hits_at_n / len(ground_truth)
-        return hit_at_n_score
\ No newline at end of file
+        self.index_type = index_type
+
+        unit_vectors = self._unit_vectors()
+
+        cache_path = None
+        if cache_dir is not None:
+            index_signature = {
+                "flat": "rot-flat",
+                "ivf": f"rot-ivf-nlist{nlist}",
+                "hnsw": f"rot-hnsw-m{hnsw_m}",
+            }.get(index_type, index_type)
+            if storage != "float32":
+                index_signature += f"-{storage}"
+            cache_path = index_cache_path(cache_dir, unit_vectors, index_signature, table_name)
+
+        self.nprobe = nprobe
+        self.search_params = search_params
+        self.index_cache_path = cache_path
+        self.index_is_mapped = cache_path is not None and os.path.exists(cache_path)
+        self.index = load_or_build_index(
+            cache_path, lambda: self._build_index(unit_vectors, index_type, nlist, hnsw_m, storage)
+        )
+        self._set_search_params()
+
+    def _set_search_params(self) -> None:
+        if self.index_type == "ivf":
+            self.index.nprobe = self.nprobe
+        if self.search_params:
+            faiss.ParameterSpace().set_index_parameters(self.index, self.search_params)
+
+    @staticmethod
+    def _build_index(
+        unit_vectors: np.ndarray, index_type: str, nlist: int, hnsw_m: int, storage: str = "float32"
+    ) -> faiss.Index:
+        dim = unit_vectors.shape[1]
+        quantizer_type = {
+            "float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit
+        }.get(storage)
+        if index_type == "flat":
+            index = faiss.IndexFlatL2(dim) if quantizer_type is None else faiss.IndexScalarQuantizer(dim, quantizer_type)
+        elif index_type == "ivf":
+            coarse_quantizer = faiss.IndexFlatL2(dim)
+            if quantizer_type is None:
+                index = faiss.IndexIVFFlat(coarse_quantizer, dim, nlist)
+            else:
+                index = faiss.IndexIVFScalarQuantizer(coarse_quantizer, dim, nlist, quantizer_type)
+        elif index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, hnsw_m) if quantizer_type is None else faiss.IndexHNSWSQ(dim, quantizer_type, hnsw_m)
+        else:
+            raise ValueError(f"Index type {index_type} not supported for rotational embeddings.")
+
+        if not index.is_trained:
+            # IVF coarse quantizers and scalar quantizer ranges need training
+            index.train(unit_vectors)  # type: ignore
+        index.add(unit_vectors)  # type: ignore
+        return index
+
+    def _unit_vectors(self, indices: Optional[torch.Tensor] = None) -> np.ndarray:
+        """
+        Unit-circle representation of the exact phases of the given embeddings (all of them by default), in float32
+        for the sake of faiss.
+        """
+        if indices is None:
+            indices = torch.arange(self.embedding_vectors.shape[0])
+        phases = self.get_phases(indices).cpu()
+        return np.ascontiguousarray(phase_to_unit_circle(phases).numpy().astype(np.float32))
+
+    def refresh(self, embeddings_weigths: torch.Tensor, tolerance: float = 1e-6) -> torch.Tensor:
+        """
+        Updates the phases that changed by more than `tolerance` and re-indexes their unit-circle representation,
+        see `ANN_IndexMan_pRotatE.refresh` and `refresh_faiss_index`. Only the changed rows are converted, unless
+        the index has to be refilled (HNSW).
+        """
+        changed_ids = super().refresh(embeddings_weigths, tolerance)
+        if changed_ids.numel() == 0:
+            return changed_ids
+
+        if self.index_is_mapped:
+            self.index = faiss.read_index(self.index_cache_path)
+            self.index_is_mapped = False
+            self._set_search_params()
+        refresh_faiss_index(self.index, changed_ids.numpy(), self._unit_vectors(changed_ids), self._unit_vectors)
+        return changed_ids
+
+    def search(
+        self, target_embeddings: torch.Tensor, topk
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Searches for the top-K nearest neighbors (wrapped angular L2 distance) of the target embeddings.
+
+        Args:
+            target_embeddings (torch.Tensor): Embeddings to search for. Shape: [batch_size, D] or [D]
+            topk (int): Number of nearest neighbors to retrieve.
+
+        Returns:
+            resulting_embeddings (torch.Tensor): Retrieved entity embeddings (in the KGE model scale)
+            indices (torch.Tensor): Indices of the retrieved entities. Shape: [batch_size, topk]
+        """
+        assert isinstance(
+            target_embeddings, torch.Tensor
+        ), "Target embeddings must be a torch.Tensor"
+
+        assert len(target_embeddings.shape) < 3, "Target embeddings must be a 2D array"
+        if len(target_embeddings.shape) == 1:
+            target_embeddings = target_embeddings.unsqueeze(0) #[1, embedding_dim]
+
+        target_phases = target_embeddings.detach().cpu().float()/(self.embedding_range/torch.pi)
+        target_units = np.ascontiguousarray(phase_to_unit_circle(target_phases).numpy())
+
+        num_candidates = min(topk * self.rerank_factor, self.embedding_vectors.shape[0])
+        _, candidates = self.index.search(target_units, num_candidates)  # type: ignore
+        candidates = torch.from_numpy(candidates)
+
+        # Approximate indexes pad with -1 when they find less than num_candidates neighbors
+        missing = candidates < 0
+        candidates = candidates.clamp(min=0)
+
+        distances = angular_difference(
+            target_phases.unsqueeze(1), self.get_phases(candidates), smooth=False
+        ).norm(dim=-1) # [batch_size, num_candidates]
+        distances = distances.masked_fill(missing, float("inf"))
+        distances, order = torch.topk(distances, min(topk, num_candidates), dim=-1, largest=False)
+        indices = torch.gather(candidates, 1, order)
+
+        resulting_embeddings = self.get_embedding(indices)
+
+        return resulting_embeddings, indices
+
+
+class ANN_IndexMan_Sharded:
+    """
+    Nearest neighbor search over an entity table that does not fit in RAM next to its index.
+
+    The table is memory-mapped from the `.npy` file saved by the KGE training and split into `num_shards` contiguous
+    row ranges. Each shard is scanned in blocks of `chunk_size` rows by a worker of a thread pool (the matmuls release
+    the GIL) and the per-shard top-k results are merged with `merge_topk`. Only the blocks being scored are resident,
+    so neither a full float32 copy of the table nor a FAISS copy of it is kept in memory.
+    The thread pool lives as long as the manager: release it with `close()` or by using the manager as a context
+    manager.
+
+    Attributes:
+        embedding_vectors (np.memmap): Memory-mapped embeddings as stored by the KGE model. Shape: [num_entities, D]
+        metric (str): 'l2' mirrors the exact `ANN_IndexMan` (squared L2 distance), 'phase' mirrors `ANN_IndexMan_pRotatE`:
+            a unit-circle shortlist re-ranked with the wrapped angular distance, where queries the shortlist cannot
+            certify are re-scanned shard by shard with `chunked_angular_topk` (unless `exact=False`).
+        shards (List[Tuple[int, int]]): Row range [start, end) of each shard.
+    """
+
+    def __init__(
+        self,
+        embeddings_path: str,
+        num_shards: int = 4,
+        metric: str = "l2",
+        embedding_range: float = 1.0,
+        chunk_size: int = 16384,
+        rerank_factor: int = 4,
+        num_threads: Optional[int] = None,
+        exact: bool = True,
+    ):
+        """
+        Args:
+            embeddings_path (str): Path to the `.npy` embedding table (e.g. `entity_embedding.npy`).
+            num_shards (int): Number of row ranges searched concurrently.
+            metric (str): 'l2' or 'phase', see the class docstring.
+            embedding_range (float): The `embedding_range` of the KGE model, only used by the 'phase' metric.
+            chunk_size (int): Number of rows loaded and scored per block within a shard.
+            rerank_factor (int): For the 'phase' metric, the shortlist holds `rerank_factor * topk` candidates.
+            num_threads (Optional[int]): Size of the thread pool, defaults to `num_shards`.
+            exact (bool): For the 'phase' metric, whether uncertified shortlists fall back to a full scan (see
+                `ANN_IndexMan_pRotatE`). If False, the re-ranked shortlist is returned as is (approximate).
+        """
+        if metric not in ("l2", "phase"):
+            raise ValueError(f"Metric {metric} not supported, expected 'l2' or 'phase'.")
+        assert num_shards > 0, "num_shards must be positive"
+        assert chunk_size > 0, "chunk_size must be positive"
+        assert rerank_factor >= 1, "rerank_factor must be at least 1"
+
+        self.embedding_vectors = np.load(embeddings_path, mmap_mode="r")
+        assert self.embedding_vectors.ndim == 2, "Embedding table must be a 2D array"
+        self.metric = metric
+        self.embedding_range = embedding_range
+        self.chunk_size = chunk_size
+        self.rerank_factor = rerank_factor
+        self.exact = exact
+
+        num_embeddings = self.embedding_vectors.shape[0]
+        bounds = np.linspace(0, num_embeddings, min(num_shards, num_embeddings) + 1).astype(np.int64)
+        self.shards = [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+        self.executor = ThreadPoolExecutor(max_workers=num_threads or len(self.shards))
+
+    def close(self) -> None:
+        """Shuts down the thread pool. Call it once the manager is no longer used (or use it as a context manager)."""
+        self.executor.shutdown()
+
+    def __enter__(self) -> "ANN_IndexMan_Sharded":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _load_rows(self, rows: Union[slice, np.ndarray]) -> torch.Tensor:
+        """Copies the requested rows out of the memory map, as float32 (phases in radians for the 'phase' metric)."""
+        vectors = torch.from_numpy(np.array(self.embedding_vectors[rows], dtype=np.float32))
+        if self.metric == "phase":
+            vectors = vectors / (self.embedding_range / torch.pi)
+        return vectors
+
+    def _search_shard(
+        self, queries: torch.Tensor, shard: Tuple[int, int], topk: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        largest = self.metric == "phase"
+        start, end = shard
+        best_scores, best_indices = None, None
+        for block_start in range(start, end, self.chunk_size):
+            block = self._load_rows(slice(block_start, min(block_start + self.chunk_size, end)))
+            if self.metric == "phase":
+                scores, indices = chunked_phase_topk(queries, block, topk, self.chunk_size)
+            else:
+                scores, indices = blocked_l2_topk(queries, block, topk, self.chunk_size)
+            indices += block_start
+            if best_scores is None:
+                best_scores, best_indices = scores, indices
+            else:
+                best_scores, best_indices = merge_topk(
+                    best_scores, best_indices, scores, indices, topk, largest=largest
+                )
+        return best_scores, best_indices
+
+    def _scan_shard_exact(
+        self, query_phases: torch.Tensor, shard: Tuple[int, int], topk: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        start, end = shard
+        best_distances, best_indices = None, None
+        for block_start in range(start, end, self.chunk_size):
+            block = self._load_rows(slice(block_start, min(block_start + self.chunk_size, end)))
+            distances, indices = chunked_angular_topk(
+                query_phases, block, topk, max(1, self.chunk_size // block.shape[1])
+            )
+            indices += block_start
+            if best_distances is None:
+                best_distances, best_indices = distances, indices
+            else:
+                best_distances, best_indices = merge_topk(
+                    best_distances, best_indices, distances, indices, topk, largest=False
+                )
+        return best_distances, best_indices
+
+    def search(
+        self, target_embeddings: torch.Tensor, topk
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Searches for the top-K nearest neighbors of the target embeddings across all shards.
+
+        Args:
+            target_embeddings (torch.Tensor): Embeddings to search for. Shape: [batch_size, D] or [D]
+            topk (int): Number of nearest neighbors to retrieve.
+
+        Returns:
+            resulting_embeddings (torch.Tensor): Retrieved entity embeddings (in the KGE model scale)
+            indices (torch.Tensor): Indices of the retrieved entities. Shape: [batch_size, topk]
+        """
+        assert isinstance(
+            target_embeddings, torch.Tensor
+        ), "Target embeddings must be a torch.Tensor"
+
+        assert len(target_embeddings.shape) < 3, "Target embeddings must be a 2D array"
+        if len(target_embeddings.shape) == 1:
+            target_embeddings = target_embeddings.unsqueeze(0) #[1, embedding_dim]
+
+        queries = target_embeddings.detach().cpu().float()
+        num_embeddings = self.embedding_vectors.shape[0]
+        if self.metric == "phase":
+            queries = queries / (self.embedding_range / torch.pi)
+            num_candidates = min(topk * self.rerank_factor, num_embeddings)
+        else:
+            num_candidates = min(topk, num_embeddings)
+
+        shard_results = list(
+            self.executor.map(lambda shard: self._search_shard(queries, shard, num_candidates), self.shards)
+        )
+        scores, indices = shard_results[0]
+        for shard_scores, shard_indices in shard_results[1:]:
+            scores, indices = merge_topk(
+                scores, indices, shard_scores, shard_indices, num_candidates, largest=self.metric == "phase"
+            )
+
+        if self.metric == "phase":
+            # Exact re-rank of the merged shortlist, reading only the candidate rows
+            candidate_phases = self._load_rows(indices.reshape(-1).numpy()).view(*indices.shape, -1)
+            distances = angular_difference(
+                queries.unsqueeze(1), candidate_phases, smooth=False
+            ).norm(dim=-1) # [batch_size, num_candidates]
+            distances, order = torch.topk(distances, min(topk, num_candidates), dim=-1, largest=False)
+            similarities, indices = scores, torch.gather(indices, 1, order)
+
+            if self.exact and num_candidates < num_embeddings:
+                # Same certificate as `ANN_IndexMan_pRotatE.search`, the fallback scans every shard
+                dim = queries.shape[-1]
+                chord_bound = 2 * dim - 2 * similarities[:, -1] - 1e-4 * dim
+                uncertified = torch.nonzero(distances[:, -1].pow(2) > chord_bound).squeeze(1)
+                if uncertified.numel() > 0:
+                    scan_topk = min(topk, num_embeddings)
+                    shard_results = list(self.executor.map(
+                        lambda shard: self._scan_shard_exact(queries[uncertified], shard, scan_topk), self.shards
+                    ))
+                    scan_distances, scan_indices = shard_results[0]
+                    for shard_distances, shard_indices in shard_results[1:]:
+                        scan_distances, scan_indices = merge_topk(
+                            scan_distances, scan_indices, shard_distances, shard_indices, scan_topk, largest=False
+                        )
+                    indices[uncertified] = scan_indices
+
+        resulting_embeddings = self.get_embedding(indices)
+
+        return resulting_embeddings, indices
+
+    def batch_search(
+        self, target_embeddings: torch.Tensor, topk: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Searches whole trajectories in a single call.
+
+        Args:
+            target_embeddings (torch.Tensor): Embeddings to search for. Shape: [steps, batch_size, D] (any leading dims)
+            topk (int): Number of nearest neighbors to retrieve.
+
+        Returns:
+            resulting_embeddings: Retrieved entity embeddings (in the KGE model scale). Shape: [steps, batch_size, topk, D]
+            indices: Indices of the retrieved entries. Shape: [steps, batch_size, topk]
+        """
+        leading_shape = target_embeddings.shape[:-1]
+        _, indices = self.search(target_embeddings.reshape(-1, target_embeddings.shape[-1]), topk)
+        indices = indices.reshape(*leading_shape, -1)
+        rows = np.array(self.embedding_vectors[indices.reshape(-1).numpy()], dtype=np.float32)
+        return torch.from_numpy(rows).view(*indices.shape, -1), indices
+
+    def get_embedding(self, indices: torch.Tensor) -> torch.Tensor:
+        """
+        Returns the embeddings (in the KGE model scale) of the given entity indices.
+        """
+        indices = indices.squeeze()
+        rows = np.array(self.embedding_vectors[indices.reshape(-1).numpy()], dtype=np.float32)
+        return torch.from_numpy(rows).view(*indices.shape, -1)
+
+    def calculate_hits_at_n(
+        self, ground_truth: np.ndarray, indices: np.ndarray, topk: int
+    ) -> float:
+        """
+        Calculates the hit@N score, see the module level `calculate_hits_at_n`.
+        """
+        return calculate_hits_at_n(ground_truth, indices, topk)
+
+    def calculate_ranking_metrics(
+        self, ground_truth: np.ndarray, indices: np.ndarray, topks: Sequence[int] = (1, 3, 10)
+    ) -> Dict[str, float]:
+        """
+        Calculates HITS@k and MRR, see the module level `calculate_ranking_metrics`.
+        """
+        return calculate_ranking_metrics(ground_truth, indices, topks)
+
+
+def build_kge_index_managers(
+    kge_model: torch.nn.Module,
+    model_name: str,
+    trained_model_path: str,
+    num_shards: int = 0,
+    index_factory: Optional[str] = None,
+    search_params: Optional[str] = None,
+    storage: str = "float32",
+    device: Optional[Union[str, torch.device]] = None,
+    rotational_index: str = "exact",
+) -> Tuple[
+    Union[ANN_IndexMan, ANN_IndexMan_pRotatE, ANN_IndexMan_Rotational, ANN_IndexMan_Sharded],
+    Union[ANN_IndexMan, ANN_IndexMan_pRotatE],
+]:
+    """
+    Builds the entity and relation vector searchers over the embeddings of a trained KGE model.
+
+    Args:
+        kge_model (torch.nn.Module): The trained KGE model (`KGEModel`).
+        model_name (str): Name of the KGE model; 'pRotatE' gets the rotational searchers.
+        trained_model_path (str): Directory of the trained KGE model, also used as the index cache directory.
+        num_shards (int): If above 1, the entity table is searched from its `.npy` file, shard by shard.
+        index_factory (Optional[str]): FAISS index factory string of the non-rotational entity index.
+        search_params (Optional[str]): FAISS search parameters of the non-rotational entity index, or of the FAISS
+            rotational entity index.
+        storage (str): Storage of the in-memory entity index ('float32', 'float16' or 'int8'): the FAISS index of
+            non-rotational models or the phase table of pRotatE. The quantized options make the pRotatE search approximate.
+        device (Optional[Union[str, torch.device]]): Opt-in device-resident search. If set, the in-memory searchers keep
+            their table on it and return torch tensors there (see the device-resident mode of `ANN_IndexMan`, which
+            rejects the approximate FAISS options without a FAISS GPU build). The sharded entity searcher always runs on CPU.
+        rotational_index (str): Entity searcher of pRotatE. 'exact' (default) is `ANN_IndexMan_pRotatE`; 'flat', 'ivf'
+            and 'hnsw' are the approximate FAISS indexes of `ANN_IndexMan_Rotational` (cached in `trained_model_path`),
+            which run on CPU and cannot be combined with `device`.
+
+    Returns:
+        ann_index_manager_ent: Searcher over the entity embeddings.
+        ann_index_manager_rel: Searcher over the relation embeddings.
+    """
+    if rotational_index not in ("exact", "flat", "ivf", "hnsw"):
+        raise ValueError(f"Rotational index {rotational_index} not supported, expected 'exact', 'flat', 'ivf' or 'hnsw'.")
+    if model_name == "pRotatE" and rotational_index != "exact" and device is not None:
+        raise ValueError("The FAISS rotational indexes run on CPU, they cannot be combined with `device`.")
+
+    embedding_range = kge_model.embedding_range.item()
+    if model_name == "pRotatE": # for rotational kge models, exact wrapped angular search
+        ann_index_manager_rel = ANN_IndexMan_pRotatE(
+            kge_model.get_all_relations_embeddings_wo_dropout(),
+            embedding_range=embedding_range,
+            device=device,
+        )
+    else: # for non-rotational kge models
+        ann_index_manager_rel = ANN_IndexMan(
+            kge_model.get_all_relations_embeddings_wo_dropout(),
+            exact_computation=True,
+            nlist=100,
+            cache_dir=trained_model_path,
+            device=device,
+            table_name="relation",
+        )
+
+    if num_shards > 1: # entity table searched from disk, shard by shard
+        ann_index_manager_ent = ANN_IndexMan_Sharded(
+            os.path.join(trained_model_path, "entity_embedding.npy"),
+            num_shards=num_shards,
+            metric="phase" if model_name == "pRotatE" else "l2",
+            embedding_range=embedding_range,
+        )
+    elif model_name == "pRotatE" and rotational_index != "exact":
+        ann_index_manager_ent = ANN_IndexMan_Rotational(
+            kge_model.get_all_entity_embeddings_wo_dropout(),
+            embedding_range=embedding_range,
+            index_type=rotational_index,
+            cache_dir=trained_model_path,
+            storage=storage,
+            table_name="entity",
+            search_params=search_params,
+        )
+    elif model_name == "pRotatE":
+        ann_index_manager_ent = ANN_IndexMan_pRotatE(
+            kge_model.get_all_entity_embeddings_wo_dropout(),
+            embedding_range=embedding_range,
+            storage=storage,
+            device=device,
+        )
+    else:
+        ann_index_manager_ent = ANN_IndexMan(
+            kge_model.get_all_entity_embeddings_wo_dropout(),
+            exact_computation=True,
+            nlist=100,
+            cache_dir=trained_model_path,
+            index_factory=index_factory,
+            search_params=search_params,
+            storage=storage,
+            device=device,
+            table_name="entity",
+        )
+
+    return ann_index_manager_ent, ann_index_manager_rel
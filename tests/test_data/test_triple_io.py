@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+from multihopkg.data_utils import load_index, load_index_column_wise
+from multihopkg.triple_io import load_triple_ids
+from multihopkg.utils.data_splitting import read_triple
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    rng = np.random.default_rng(0)
+    entities = ["Q{}".format(i) for i in range(50)] + ["null", "NA", 'quote"d']
+    relations = ["P{}".format(i) for i in range(6)]
+    with open(tmp_path / "entity2id.txt", "w") as f:
+        f.writelines("{}\t{}\n".format(e, i) for i, e in enumerate(entities))
+    with open(tmp_path / "relation2id.txt", "w") as f:
+        f.writelines("{}\t{}\n".format(r, i) for i, r in enumerate(relations))
+    lines = [
+        (entities[h], relations[r], entities[t])
+        for h, r, t in rng.integers(0, [len(entities), len(relations), len(entities)], size=(400, 3))
+    ]
+    with open(tmp_path / "train.txt", "w") as f:
+        f.writelines("\t".join(line) + "\n" for line in lines)
+    return tmp_path, lines
+
+
+def test_bulk_loaders_match_the_per_line_parsers(dataset):
+    data_dir, lines = dataset
+    id2entity, entity2id = load_index_column_wise(str(data_dir / "entity2id.txt"))
+    id2relation, relation2id = load_index_column_wise(str(data_dir / "relation2id.txt"))
+    index, rev_index = load_index(str(data_dir / "entity2id.txt"))
+    assert index == entity2id and rev_index == id2entity
+    assert id2entity[50] == "null" and entity2id['quote"d'] == 52
+
+    expected = [(entity2id[h], relation2id[r], entity2id[t]) for h, r, t in lines]
+    assert read_triple(str(data_dir / "train.txt"), entity2id, relation2id) == expected
+
+
+def test_triple_ids_are_cached_by_mtime(dataset):
+    data_dir, lines = dataset
+    path = str(data_dir / "train.txt")
+    _, entity2id = load_index_column_wise(str(data_dir / "entity2id.txt"))
+    _, relation2id = load_index_column_wise(str(data_dir / "relation2id.txt"))
+    vocabularies = (entity2id, relation2id, entity2id)
+
+    triple_ids = load_triple_ids(path, vocabularies, sep="\t")
+    cache_files = [f for f in os.listdir(data_dir) if f.startswith("train.txt.ids-")]
+    assert triple_ids.dtype == np.int32 and len(cache_files) == 1
+    assert np.array_equal(load_triple_ids(path, vocabularies, sep="\t"), triple_ids)
+
+    # Touching the source invalidates the cache, which is replaced
+    with open(path, "a") as f:
+        f.write("Q1\tP1\tQ2\n")
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    reloaded = load_triple_ids(path, vocabularies, sep="\t")
+    assert len(reloaded) == len(lines) + 1
+    assert len([f for f in os.listdir(data_dir) if f.startswith("train.txt.ids-")]) == 1
+
+    with pytest.raises(KeyError):
+        load_triple_ids(path, (entity2id, entity2id, entity2id), sep="\t")
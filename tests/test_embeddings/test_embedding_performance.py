@@ -10,6 +10,7 @@ import torch
 
 from multihopkg.utils.data_splitting import TripleIds
 from multihopkg.datasets import TestDataset
+from multihopkg.ranking import FilteredRanking
 from tests.conftest import ValidatorDict
 
 # Add project root to path
@@ -53,51 +54,55 @@ def test_performance(
     print(f"Test set size after taking a percentage of {test_percent} is {len(test_triples)}")
 
     #Prepare dataloader for evaluation
+    filter_index = TestDataset.build_filter_index(all_true_triples, knowledge_graph.nentity, knowledge_graph.nrelation)
+    test_dataset_head = TestDataset(
+        test_triples, 
+        all_true_triples, 
+        knowledge_graph.nentity, 
+        knowledge_graph.nrelation, 
+        'head-batch',
+        filter_index,
+        with_negative_sample=True,
+    )
     test_dataloader_head = DataLoader(
-        TestDataset(
-            test_triples, 
-            all_true_triples, 
-            knowledge_graph.nentity, 
-            knowledge_graph.nrelation, 
-            'head-batch'
-        ), 
+        test_dataset_head, 
         batch_size=test_batch_size,
         num_workers=max(1, num_cpus//2), 
-        collate_fn=TestDataset.collate_fn
+        collate_fn=test_dataset_head.collate_fn
     )
 
+    test_dataset_tail = TestDataset(
+        test_triples, 
+        all_true_triples, 
+        knowledge_graph.nentity, 
+        knowledge_graph.nrelation, 
+        'tail-batch',
+        filter_index,
+        with_negative_sample=True,
+    )
     test_dataloader_tail = DataLoader(
-        TestDataset(
-            test_triples, 
-            all_true_triples, 
-            knowledge_graph.nentity, 
-            knowledge_graph.nrelation, 
-            'tail-batch'
-        ), 
+        test_dataset_tail, 
         batch_size=test_batch_size,
         num_workers=max(1, num_cpus//2), 
-        collate_fn=TestDataset.collate_fn
+        collate_fn=test_dataset_tail.collate_fn
     )
     
     test_dataset_list = [test_dataloader_head, test_dataloader_tail]
     
-    logs = []
+    ranking = FilteredRanking()
 
     with torch.no_grad():
         for test_dataset in test_dataset_list:
-            for positive_sample, negative_sample, filter_bias, mode in test_dataset:
+            for positive_sample, negative_sample, filter_indices, mode in test_dataset:
                 if cuda:
                     positive_sample = positive_sample.cuda()
                     negative_sample = negative_sample.cuda()
-                    filter_bias = filter_bias.cuda()
+                    filter_indices = filter_indices.cuda()
 
                 batch_size = positive_sample.size(0)
 
                 score = knowledge_graph((positive_sample, negative_sample), mode)
-                score += filter_bias
-
-                #Explicitly sort all the entities to ensure that there is no test exposure bias
-                argsort = torch.argsort(score, dim = 1, descending=True)
+                TestDataset.filter_scores(score, filter_indices)
 
                 if mode == 'head-batch':
                     positive_arg = positive_sample[:, 0]
@@ -106,24 +111,10 @@ def test_performance(
                 else:
                     raise ValueError('mode %s not supported' % mode)
 
-                for i in range(batch_size):
-                    #Notice that argsort is not ranking
-                    ranking = (argsort[i, :] == positive_arg[i]).nonzero()
-                    assert ranking.size(0) == 1
-
-                    #ranking + 1 is the true ranking used in evaluation metrics
-                    ranking = 1 + ranking.item()
-                    logs.append({
-                        'MRR': 1.0/ranking,
-                        'MR': float(ranking),
-                        'HITS@1': 1.0 if ranking <= 1 else 0.0,
-                        'HITS@3': 1.0 if ranking <= 3 else 0.0,
-                        'HITS@10': 1.0 if ranking <= 10 else 0.0,
-                    })
-
-    metrics = {}
-    for metric in logs[0].keys():
-        metrics[metric] = sum([log[metric] for log in logs])/len(logs)
+                #Filtered ranks are counted on-device, no sort over all the entities
+                ranking.update(score, positive_arg)
+
+    metrics = ranking.metrics()
 
     for m_key, m_val in metrics.items():
         validation_lambda = validation_thresholds[m_key]
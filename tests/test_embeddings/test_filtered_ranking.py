@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+
+from multihopkg.datasets import TestDataset
+from multihopkg.ranking import FilteredRanking
+
+
+def test_filtered_ranks_match_the_sorted_positions():
+    generator = torch.Generator().manual_seed(0)
+    ranking = FilteredRanking()
+    expected_ranks = []
+    for _ in range(3):
+        score = torch.randn(16, 200, generator=generator)  # no ties
+        positive_arg = torch.randint(0, 200, (16,), generator=generator)
+        ranks = ranking.update(score, positive_arg)
+        argsort = torch.argsort(score, dim=1, descending=True)
+        expected = [1 + int((argsort[i] == positive_arg[i]).nonzero()) for i in range(16)]
+        assert ranks.tolist() == expected
+        expected_ranks += expected
+
+    expected_ranks = np.array(expected_ranks)
+    metrics = ranking.metrics()
+    assert np.array_equal(ranking.ranks(), expected_ranks)
+    assert np.isclose(metrics["MRR"], (1.0 / expected_ranks).mean())
+    assert np.isclose(metrics["MR"], expected_ranks.mean())
+    for k in (1, 3, 10):
+        assert np.isclose(metrics["HITS@{}".format(k)], (expected_ranks <= k).mean())
+
+
+def test_collate_filters_the_other_known_answers():
+    rng = np.random.default_rng(1)
+    nentity, nrelation = 30, 4
+    all_true_triples = list(set(map(tuple, rng.integers(0, [nentity, nrelation, nentity], (200, 3)).tolist())))
+    test_triples = all_true_triples[:20]
+    true_set = set(all_true_triples)
+    filter_index = TestDataset.build_filter_index(all_true_triples, nentity, nrelation)
+
+    for mode in ("head-batch", "tail-batch"):
+        dataset = TestDataset(test_triples, all_true_triples, nentity, nrelation, mode, filter_index)
+        positive_sample, negative_sample, filter_indices, _ = dataset.collate_fn([dataset[i] for i in range(20)])
+        score = torch.randn(20, nentity, generator=torch.Generator().manual_seed(2))
+        positive_arg = positive_sample[:, 0 if mode == "head-batch" else 2]
+        ranks = FilteredRanking().update(TestDataset.filter_scores(score.clone(), filter_indices), positive_arg)
+
+        assert negative_sample is None
+        legacy_dataset = TestDataset(
+            test_triples, all_true_triples, nentity, nrelation, mode, filter_index, with_negative_sample=True
+        )
+        assert legacy_dataset.collate_fn([legacy_dataset[i] for i in range(20)])[1].shape == (20, nentity)
+        for i, (h, r, t) in enumerate(test_triples):
+            target = h if mode == "head-batch" else t
+            candidates = [
+                e for e in range(nentity)
+                if e == target or ((e, r, t) if mode == "head-batch" else (h, r, e)) not in true_set
+            ]
+            assert int(ranks[i]) == 1 + sum(float(score[i, e]) > float(score[i, target]) for e in candidates)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import torch
+
+from multihopkg.datasets import TrainDataset
+from multihopkg.exogenous.sun_models import KGEModel
+
+NENTITY, NRELATION = 30, 4
+
+MODEL_CONFIGS = {
+    "TransE": {},
+    "DistMult": {},
+    "ComplEx": {"double_entity_embedding": True, "double_relation_embedding": True},
+    "RotatE": {"double_entity_embedding": True},
+    "pRotatE": {},
+}
+
+
+@pytest.mark.parametrize("model_name", list(MODEL_CONFIGS))
+def test_shared_pool_scores_match_per_sample_scores(model_name):
+    torch.manual_seed(0)
+    model = KGEModel(model_name, NENTITY, NRELATION, 8, 6.0, **MODEL_CONFIGS[model_name])
+    model.pool_chunk_size = 7  # Several chunks for the broadcast models
+    positive_sample = torch.stack(
+        [torch.randint(NENTITY, (5,)), torch.randint(NRELATION, (5,)), torch.randint(NENTITY, (5,))], dim=1
+    )
+    pool = torch.randint(NENTITY, (20,))
+
+    with torch.no_grad():
+        for shared_mode, batch_mode in (("head-shared", "head-batch"), ("tail-shared", "tail-batch")):
+            shared_score, _ = model((positive_sample, pool), mode=shared_mode)
+            expected, _ = model((positive_sample, pool.repeat(5, 1)), mode=batch_mode)
+            assert shared_score.shape == (5, 20)
+            assert torch.allclose(shared_score, expected, atol=1e-4)
+
+
+def test_shared_and_in_batch_pools():
+    rng = np.random.default_rng(0)
+    triples = list(set(map(tuple, rng.integers(0, [NENTITY, NRELATION, NENTITY], (100, 3)).tolist())))
+    indices = list(range(16))
+
+    positive_sample, pool, _, mode = TrainDataset(triples, NENTITY, NRELATION, 10, "head-batch", "shared").__getitems__(
+        indices
+    )
+    assert mode == "head-shared" and pool.shape == (10,)
+
+    positive_sample, pool, _, mode = TrainDataset(
+        triples, NENTITY, NRELATION, 10, "tail-batch", "in-batch"
+    ).__getitems__(indices)
+    assert mode == "tail-shared" and torch.equal(pool, positive_sample[:, 2])
+
+
+@pytest.mark.parametrize("model_name", list(MODEL_CONFIGS))
+def test_score_all_entities_streams_chunks_and_top_k(model_name):
+    torch.manual_seed(1)
+    model = KGEModel(model_name, NENTITY, NRELATION, 8, 6.0, **MODEL_CONFIGS[model_name])
+    positive_sample = torch.stack(
+        [torch.randint(NENTITY, (4,)), torch.randint(NRELATION, (4,)), torch.randint(NENTITY, (4,))], dim=1
+    )
+    all_entities = torch.arange(NENTITY).repeat(4, 1)
+
+    with torch.no_grad():
+        expected_tails, _ = model((positive_sample, all_entities), mode="tail-batch")
+        expected_heads, _ = model((positive_sample, all_entities), mode="head-batch")
+        tails = model.score_all_tails(positive_sample[:, 0], positive_sample[:, 1], chunk_size=7)
+        heads = model.score_all_heads(positive_sample[:, 1], positive_sample[:, 2], chunk_size=7)
+        top_scores, top_ids = model.score_all_tails(positive_sample[:, 0], positive_sample[:, 1], chunk_size=7, k=5)
+
+    assert torch.allclose(tails, expected_tails, atol=1e-4)
+    assert torch.allclose(heads, expected_heads, atol=1e-4)
+    assert torch.allclose(top_scores, expected_tails.topk(5, dim=1).values, atol=1e-4)
+    assert torch.allclose(expected_tails.gather(1, top_ids), top_scores, atol=1e-4)
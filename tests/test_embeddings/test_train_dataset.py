@@ -0,0 +1,25 @@
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from multihopkg.datasets import TrainDataset
+
+
+def test_batch_negative_sampler_rejects_true_triples():
+    rng = np.random.default_rng(0)
+    nentity, nrelation = 25, 3
+    triples = list(set(map(tuple, rng.integers(0, [nentity, nrelation, nentity], (300, 3)).tolist())))
+    true_set = set(triples)
+    count = TrainDataset.count_frequency(triples)
+
+    for mode in ("head-batch", "tail-batch"):
+        dataset = TrainDataset(triples, nentity, nrelation, 16, mode)
+        loader = DataLoader(dataset, batch_size=32, shuffle=True, collate_fn=TrainDataset.collate_fn)
+        positive_sample, negative_sample, subsampling_weight, batch_mode = next(iter(loader))
+
+        assert batch_mode == mode and negative_sample.shape == (32, 16)
+        for (h, r, t), negatives, weight in zip(positive_sample.tolist(), negative_sample.tolist(), subsampling_weight):
+            for e in negatives:
+                assert ((e, r, t) if mode == "head-batch" else (h, r, e)) not in true_set
+            expected = torch.sqrt(1 / torch.Tensor([count[(h, r)] + count[(t, -r - 1)]]))
+            assert torch.allclose(weight, expected)
@@ -0,0 +1,65 @@
+import numpy as np
+import torch
+
+from multihopkg.answer_index import AnswerIndex
+
+NUM_ENTITIES = 40
+NUM_RELATIONS = 6
+
+
+def random_triples(num_triples: int = 300, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.stack(
+        [
+            rng.integers(0, NUM_ENTITIES, num_triples),
+            rng.integers(0, NUM_RELATIONS, num_triples),
+            rng.integers(0, NUM_ENTITIES, num_triples),
+        ],
+        axis=1,
+    )
+
+
+def nested_sets(triples: np.ndarray):
+    objects, subjects = {}, {}
+    for e1, r, e2 in triples.tolist():
+        objects.setdefault(e1, {}).setdefault(r, set()).add(e2)
+        subjects.setdefault(e2, {}).setdefault(r, set()).add(e1)
+    return objects, subjects
+
+
+def test_batched_answers_match_nested_sets():
+    triples = random_triples()
+    answers = AnswerIndex(triples[:, 0], triples[:, 1], triples[:, 2], NUM_ENTITIES, NUM_RELATIONS)
+    objects, subjects = nested_sets(triples)
+
+    e1 = torch.randint(0, NUM_ENTITIES, (50,))
+    r = torch.randint(0, NUM_RELATIONS, (50,))
+    padded, mask = answers.batch_objects(e1, r, padding_value=-1)
+    for i in range(50):
+        expected = objects.get(int(e1[i]), {}).get(int(r[i]), set())
+        assert set(padded[i][mask[i]].tolist()) == expected
+        assert (padded[i][~mask[i]] == -1).all()
+
+    padded, mask = answers.batch_subjects(e1, r)
+    for i in range(50):
+        assert set(padded[i][mask[i]].tolist()) == subjects.get(int(e1[i]), {}).get(int(r[i]), set())
+
+    assert answers.object_sets() == objects
+    assert answers.subject_sets() == subjects
+
+
+def test_masks_match_per_row_membership():
+    triples = random_triples(seed=1)
+    answers = AnswerIndex(triples[:, 0], triples[:, 1], triples[:, 2], NUM_ENTITIES, NUM_RELATIONS)
+    objects, subjects = nested_sets(triples)
+
+    e = torch.randint(0, NUM_ENTITIES, (30,))
+    r = torch.randint(0, NUM_RELATIONS, (30,))
+    candidates = torch.randint(0, NUM_ENTITIES, (30, 25))
+    object_mask = answers.object_mask(e, r, candidates)
+    subject_mask = answers.subject_mask(e, r, candidates)
+    for i in range(30):
+        expected_objects = objects.get(int(e[i]), {}).get(int(r[i]), set())
+        expected_subjects = subjects.get(int(e[i]), {}).get(int(r[i]), set())
+        assert object_mask[i].tolist() == [int(c) in expected_objects for c in candidates[i]]
+        assert subject_mask[i].tolist() == [int(c) in expected_subjects for c in candidates[i]]
@@ -0,0 +1,190 @@
+import collections
+import os
+import pickle
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from multihopkg.data_utils import DUMMY_ENTITY_ID, DUMMY_RELATION_ID, NO_OP_RELATION_ID
+from multihopkg.graph_csr import GraphCSR, bucket_action_space, packed_action_space, padded_action_space
+from multihopkg.graph_csr import prune_by_page_rank, unique_relation_space
+from multihopkg.knowledge_graph import KnowledgeGraph
+from multihopkg.graph_csr import convert_pickled_graph, ensure_graph_store, graph_store_is_stale, load_graph_store
+from multihopkg.utils.ops import gather_segments, group_by_key, inverse_permutation, segment_softmax, unpack_segments
+
+NUM_ENTITIES = 60
+NUM_RELATIONS = 7
+BANDWIDTH = 8
+
+
+def random_adj_list(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    adj_list = collections.defaultdict(dict)
+    for _ in range(600):
+        e1, r, e2 = rng.integers(2, NUM_ENTITIES), rng.integers(3, NUM_RELATIONS), rng.integers(2, NUM_ENTITIES)
+        adj_list[int(e1)].setdefault(int(r), set()).add(int(e2))
+    return dict(adj_list)
+
+
+def reference_action_space(adj_list, page_rank_scores, e1):
+    """The per-entity loop the CSR builder replaces."""
+    action_space = []
+    if e1 in adj_list:
+        for r in adj_list[e1]:
+            for e2 in adj_list[e1][r]:
+                action_space.append((r, e2))
+        if len(action_space) + 1 >= BANDWIDTH:
+            action_space = sorted(action_space, key=lambda x: page_rank_scores[x[1]], reverse=True)[:BANDWIDTH]
+    action_space.insert(0, (NO_OP_RELATION_ID, e1))
+    return action_space
+
+
+def test_padded_action_space_matches_per_entity_loop():
+    adj_list = random_adj_list()
+    page_rank_scores = np.random.default_rng(1).permutation(NUM_ENTITIES).astype(np.float64)  # no ties
+
+    graph = prune_by_page_rank(GraphCSR.from_adj_list(adj_list, NUM_ENTITIES), page_rank_scores, BANDWIDTH)
+    r_space, e_space, action_mask = padded_action_space(graph, NO_OP_RELATION_ID, DUMMY_RELATION_ID, DUMMY_ENTITY_ID)
+
+    for e1 in range(NUM_ENTITIES):
+        expected = reference_action_space(adj_list, page_rank_scores, e1)
+        num_actions = int(action_mask[e1].sum())
+        actions = list(zip(r_space[e1, :num_actions].tolist(), e_space[e1, :num_actions].tolist()))
+        assert num_actions == len(expected)
+        assert actions[0] == expected[0]
+        if len(expected) - 1 >= BANDWIDTH - 1:  # pruned: ordered by PageRank
+            assert [e for _, e in actions] == [e for _, e in expected]
+        else:
+            assert sorted(actions) == sorted(expected)
+        assert (r_space[e1, num_actions:] == DUMMY_RELATION_ID).all()
+
+
+def test_buckets_hold_the_padded_action_spaces():
+    adj_list = random_adj_list(seed=2)
+    graph = GraphCSR.from_adj_list(adj_list, NUM_ENTITIES)
+    r_space, e_space, _ = padded_action_space(graph, NO_OP_RELATION_ID, DUMMY_RELATION_ID, DUMMY_ENTITY_ID)
+    buckets, entity2bucketid = bucket_action_space(graph, 4, NO_OP_RELATION_ID, DUMMY_RELATION_ID, DUMMY_ENTITY_ID)
+
+    assert sum(len(bucket[0]) for bucket in buckets.values()) == NUM_ENTITIES
+    for e1 in range(NUM_ENTITIES):
+        key, row = entity2bucketid[e1]
+        bucket_r_space, bucket_e_space, bucket_mask = buckets[key]
+        num_actions = int(bucket_mask[row].sum())
+        assert num_actions == graph.out_degrees[e1] + 1
+        assert bucket_r_space.shape[1] == key * 4
+        assert (bucket_r_space[row, :num_actions] == r_space[e1, :num_actions]).all()
+        assert (bucket_e_space[row, :num_actions] == e_space[e1, :num_actions]).all()
+
+
+def test_bucket_dispatch_restores_the_batch_order():
+    graph = GraphCSR.from_adj_list(random_adj_list(seed=4), NUM_ENTITIES)
+    _, entity2bucketid = bucket_action_space(graph, 4, NO_OP_RELATION_ID, DUMMY_RELATION_ID, DUMMY_ENTITY_ID)
+    e = torch.from_numpy(np.random.default_rng(5).integers(0, NUM_ENTITIES, 200))
+    key1 = torch.from_numpy(entity2bucketid)[e, 0]
+
+    bucket_keys, batch_refs = group_by_key(key1)
+    assert bucket_keys == sorted(set(key1.tolist()))
+    for key, refs in zip(bucket_keys, batch_refs):
+        assert (key1[refs] == key).all() and (refs.diff() > 0).all()
+
+    inv_offset = inverse_permutation(torch.cat(batch_refs))
+    assert torch.equal(torch.cat([e[refs] for refs in batch_refs])[inv_offset], e)
+
+
+def test_packed_action_space_scores_like_the_padded_one():
+    graph = GraphCSR.from_adj_list(random_adj_list(seed=6), NUM_ENTITIES)
+    r_space, e_space, action_mask = padded_action_space(graph, NO_OP_RELATION_ID, DUMMY_RELATION_ID, DUMMY_ENTITY_ID)
+    offsets, packed_r, packed_e = packed_action_space(graph, NO_OP_RELATION_ID)
+
+    e = torch.from_numpy(np.random.default_rng(7).integers(0, NUM_ENTITIES, 32))
+    positions, segment_ids, batch_offsets = gather_segments(torch.from_numpy(offsets), e)
+    padded_r = unpack_segments(torch.from_numpy(packed_r)[positions], segment_ids, batch_offsets, DUMMY_RELATION_ID)
+    padded_e = unpack_segments(torch.from_numpy(packed_e)[positions], segment_ids, batch_offsets, DUMMY_ENTITY_ID)
+    width = padded_r.shape[1]
+    assert torch.equal(padded_r, torch.from_numpy(r_space)[e, :width])
+    assert torch.equal(padded_e, torch.from_numpy(e_space)[e, :width])
+
+    scores = torch.randn(len(positions))
+    dist = unpack_segments(segment_softmax(scores, segment_ids, len(e)), segment_ids, batch_offsets, 0.0)
+    mask = torch.from_numpy(action_mask)[e, :width]
+    padded_scores = unpack_segments(scores, segment_ids, batch_offsets, 0.0) - (1 - mask) * 1e31
+    assert torch.allclose(dist, torch.softmax(padded_scores, dim=-1), atol=1e-6)
+
+
+def test_unique_relation_space_lists_the_relations_of_every_entity():
+    adj_list = random_adj_list(seed=8)
+    offsets, relations = unique_relation_space(GraphCSR.from_adj_list(adj_list, NUM_ENTITIES))
+    for e1 in range(NUM_ENTITIES):
+        assert relations[offsets[e1] : offsets[e1 + 1]].tolist() == sorted(adj_list.get(e1, {}))
+
+
+def test_virtual_step_propagates_the_whole_batch():
+    adj_list = random_adj_list(seed=9)
+    graph = GraphCSR.from_adj_list(adj_list, NUM_ENTITIES)
+    offsets, r_space, e_space = (torch.from_numpy(x) for x in packed_action_space(graph, NO_OP_RELATION_ID))
+    relations, unique_r_offsets = (torch.from_numpy(x) for x in unique_relation_space(graph)[::-1])
+    kg = SimpleNamespace(
+        packed_action_space=((r_space, e_space), offsets),
+        unique_r_space=(relations, unique_r_offsets),
+        _unique_r_keys=None,
+        num_entities=NUM_ENTITIES,
+        num_relations=NUM_RELATIONS,
+        self_edge=NO_OP_RELATION_ID,
+        dummy_e=DUMMY_ENTITY_ID,
+    )
+    kg.has_relation = lambda e, r: KnowledgeGraph.has_relation(kg, e, r)
+    rng = np.random.default_rng(10)
+    e_set = torch.from_numpy(rng.integers(0, NUM_ENTITIES, (16, 5)))
+    r = torch.from_numpy(rng.integers(3, NUM_RELATIONS, 16))
+
+    e_set_out = KnowledgeGraph.virtual_step(kg, e_set, r)
+    e_set_mask = KnowledgeGraph.virtual_step(kg, e_set, r, as_mask=True)
+    for i in range(len(e_set)):
+        expected = set()
+        for e1 in e_set[i].tolist():
+            expected |= adj_list.get(e1, {}).get(int(r[i]), set())
+        assert set(e_set_out[i].tolist()) - {DUMMY_ENTITY_ID} == expected - {DUMMY_ENTITY_ID}
+        assert set(e_set_mask[i].nonzero().view(-1).tolist()) == expected
+
+
+def test_graph_store_round_trips_the_pickled_adj_list(tmp_path):
+    adj_list = random_adj_list(seed=3)
+    entity2typeid = list(range(NUM_ENTITIES))
+    with open(tmp_path / "adj_list.pkl", "wb") as f:
+        pickle.dump(adj_list, f)
+    with open(tmp_path / "entity2typeid.pkl", "wb") as f:
+        pickle.dump(entity2typeid, f)
+    with open(tmp_path / "entity2id.txt", "w") as f:
+        f.writelines(f"e{i}\t1\n" for i in range(NUM_ENTITIES))
+
+    store_dir = convert_pickled_graph(str(tmp_path))
+    graph, stored_types = load_graph_store(store_dir)
+
+    assert isinstance(graph.targets, np.memmap)
+    assert graph.num_entities == NUM_ENTITIES
+    assert graph.to_adj_list() == adj_list
+    assert stored_types.tolist() == entity2typeid
+    assert sorted(os.listdir(store_dir)) == [
+        "entity2typeid.npy", "header.json", "indptr.npy", "relations.npy", "targets.npy"
+    ]
+
+
+def test_graph_store_is_converted_again_when_the_pickles_are_newer(tmp_path):
+    with open(tmp_path / "entity2id.txt", "w") as f:
+        f.writelines(f"e{i}\t1\n" for i in range(NUM_ENTITIES))
+    with open(tmp_path / "adj_list.pkl", "wb") as f:
+        pickle.dump(random_adj_list(seed=4), f)
+    store_dir = ensure_graph_store(str(tmp_path))
+    assert not graph_store_is_stale(store_dir, str(tmp_path))
+
+    adj_list = random_adj_list(seed=5)
+    with open(tmp_path / "adj_list.pkl", "wb") as f:
+        pickle.dump(adj_list, f)
+    header_mtime = os.path.getmtime(os.path.join(store_dir, "header.json"))
+    os.utime(tmp_path / "adj_list.pkl", (header_mtime + 10, header_mtime + 10))
+    assert graph_store_is_stale(store_dir, str(tmp_path))
+
+    graph, _ = load_graph_store(ensure_graph_store(str(tmp_path)))
+    assert graph.to_adj_list() == adj_list
+    assert not graph_store_is_stale(store_dir, str(tmp_path))
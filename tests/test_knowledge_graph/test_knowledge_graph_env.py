@@ -0,0 +1,143 @@
+import collections
+import pickle
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from multihopkg.data_utils import DUMMY_ENTITY, DUMMY_RELATION, NO_OP_ENTITY, NO_OP_RELATION, START_RELATION
+from multihopkg.knowledge_graph import KnowledgeGraph
+from multihopkg.rl.graph_search.beam_search import beam_search
+from multihopkg.rl.graph_search.pn import GraphSearchPolicy
+
+NUM_ENTITIES = 30
+NUM_BASE_RELATIONS = 3  # Every relation r also has its r_inv
+DIM = 8
+
+
+def write_kg_data(data_dir, seed: int = 0):
+    """Writes a small random knowledge graph in the data directory layout read by `KnowledgeGraph`."""
+    rng = np.random.default_rng(seed)
+    entities = [DUMMY_ENTITY, NO_OP_ENTITY] + ["e{}".format(i) for i in range(2, NUM_ENTITIES)]
+    relations = [DUMMY_RELATION, START_RELATION, NO_OP_RELATION]
+    for i in range(NUM_BASE_RELATIONS):
+        relations += ["r{}".format(i), "r{}_inv".format(i)]
+
+    triples = set()
+    for _ in range(120):
+        e1, e2 = rng.integers(2, NUM_ENTITIES, 2)
+        triples.add((int(e1), int(e2), 3 + 2 * int(rng.integers(NUM_BASE_RELATIONS))))
+    triples = sorted(triples)
+    adj_list = collections.defaultdict(dict)
+    for e1, e2, r in triples:
+        adj_list[e1].setdefault(r, set()).add(e2)
+        adj_list[e2].setdefault(r + 1, set()).add(e1)
+
+    def write_lines(name, lines):
+        with open(data_dir / name, "w") as f:
+            f.writelines(line + "\n" for line in lines)
+
+    def triple_lines(subset):
+        return ["{}\t{}\t{}".format(entities[e1], entities[e2], relations[r]) for e1, e2, r in subset]
+
+    write_lines("entity2id.txt", ["{}\t1".format(e) for e in entities])
+    write_lines("relation2id.txt", ["{}\t1".format(r) for r in relations])
+    write_lines("type2id.txt", ["DUMMY_TYPE\t1"])
+    write_lines("raw.pgrk", ["{}: {}".format(e, score) for e, score in zip(entities, rng.random(NUM_ENTITIES))])
+    write_lines("raw.kb", triple_lines(triples[:80]))
+    write_lines("train.triples", triple_lines(triples[80:100]))
+    write_lines("dev.triples", triple_lines(triples[100:110]))
+    write_lines("test.triples", triple_lines(triples[110:]))
+    with open(data_dir / "adj_list.pkl", "wb") as f:
+        pickle.dump(dict(adj_list), f)
+    with open(data_dir / "entity2typeid.pkl", "wb") as f:
+        pickle.dump([0] * NUM_ENTITIES, f)
+    return dict(adj_list)
+
+
+def build_kg(data_dir, model, use_action_space_bucketing=False, use_action_space_packing=False):
+    kg = KnowledgeGraph(
+        bandwidth=400,
+        data_dir=str(data_dir),
+        model=model,
+        entity_dim=DIM,
+        relation_dim=DIM,
+        emb_dropout_rate=0.0,
+        num_graph_convolution_layers=0,
+        use_action_space_bucketing=use_action_space_bucketing,
+        bucket_interval=4,
+        test=False,
+        relation_only=False,
+        use_action_space_packing=use_action_space_packing,
+    )
+    kg.args = SimpleNamespace(save_beam_search_paths=False, mask_test_false_negatives=False)
+    return kg
+
+
+def test_graph_tables_of_non_point_models(tmp_path):
+    adj_list = write_kg_data(tmp_path)
+    kg = build_kg(tmp_path, "complex")
+    assert kg.action_space is None and kg.packed_action_space is None
+
+    e = torch.arange(NUM_ENTITIES)
+    unique_r = kg.get_unique_r_space(e)
+    for e1 in range(NUM_ENTITIES):
+        assert set(unique_r[e1].tolist()) - {kg.dummy_r} == set(adj_list.get(e1, {}))
+
+    r = torch.full_like(e, 3)
+    assert kg.has_relation(e, r).tolist() == [3 in adj_list.get(e1, {}) for e1 in range(NUM_ENTITIES)]
+
+    reachable = kg.relation_adjacency.reachable(e, [3])
+    for e1 in range(NUM_ENTITIES):
+        assert set(reachable[e1].nonzero().view(-1).tolist()) == adj_list.get(e1, {}).get(3, set())
+
+
+@pytest.mark.parametrize("use_action_space_packing", [False, True])
+def test_virtual_step(tmp_path, use_action_space_packing):
+    adj_list = write_kg_data(tmp_path, seed=1)
+    kg = build_kg(tmp_path, "point", use_action_space_packing=use_action_space_packing)
+    assert (kg.packed_action_space is not None) == use_action_space_packing
+
+    rng = np.random.default_rng(2)
+    e_set = torch.from_numpy(rng.integers(0, NUM_ENTITIES, (12, 4)))
+    r = torch.from_numpy(rng.integers(3, 3 + 2 * NUM_BASE_RELATIONS, 12))
+    e_set_out = kg.virtual_step(e_set, r)
+    for i in range(len(e_set)):
+        expected = set()
+        for e1 in e_set[i].tolist():
+            expected |= adj_list.get(e1, {}).get(int(r[i]), set())
+        assert set(e_set_out[i].tolist()) - {kg.dummy_e} == expected - {kg.dummy_e}
+
+
+def run_beam_search(kg, e_s, q, e_t):
+    torch.manual_seed(0)
+    pn = GraphSearchPolicy(
+        relation_only=False,
+        history_dim=DIM,
+        history_num_layers=1,
+        entity_dim=DIM,
+        relation_dim=DIM,
+        ff_dropout_rate=0.0,
+        xavier_initialization=True,
+        relation_only_in_path=False,
+        reward_module=None,
+    )
+    with torch.no_grad():
+        return beam_search(pn, e_s, q, e_t, kg, num_steps=2, beam_size=5)
+
+
+def test_beam_search_with_packed_action_spaces(tmp_path):
+    write_kg_data(tmp_path, seed=3)
+    bucketed_kg = build_kg(tmp_path, "point", use_action_space_bucketing=True)
+    packed_kg = build_kg(tmp_path, "point", use_action_space_packing=True)
+    packed_kg.load_state_dict(bucketed_kg.state_dict())
+
+    rng = np.random.default_rng(4)
+    e_s, e_t = (torch.from_numpy(rng.integers(2, NUM_ENTITIES, 6)) for _ in range(2))
+    q = torch.from_numpy(rng.integers(3, 3 + 2 * NUM_BASE_RELATIONS, 6))
+
+    expected = run_beam_search(bucketed_kg, e_s, q, e_t)
+    output = run_beam_search(packed_kg, e_s, q, e_t)
+    assert output["pred_e2s"].shape[0] == len(e_s)
+    assert torch.allclose(output["pred_e2_scores"], expected["pred_e2_scores"], atol=1e-5)
@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+
+from multihopkg.graph_csr import GraphCSR
+from multihopkg.relation_adjacency import RelationAdjacency
+
+NUM_ENTITIES = 40
+NUM_RELATIONS = 5
+
+
+def random_graph(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    triples = rng.integers(0, [NUM_ENTITIES, NUM_RELATIONS, NUM_ENTITIES], size=(300, 3))
+    graph = GraphCSR.from_triples(triples[:, 0], triples[:, 1], triples[:, 2], NUM_ENTITIES)
+    adj_list = graph.to_adj_list()
+    return graph, adj_list
+
+
+def follow(adj_list, entities, relation_path):
+    """Reference walk over the adjacency list."""
+    for r in relation_path:
+        entities = set().union(*[adj_list.get(e1, {}).get(r, set()) for e1 in entities])
+    return entities
+
+
+def test_reachable_and_propagate_follow_relation_paths():
+    graph, adj_list = random_graph()
+    adjacency = RelationAdjacency(graph, NUM_RELATIONS)
+    e = torch.arange(NUM_ENTITIES)
+    # A single index array for all the relations, nothing per (relation, entity)
+    assert adjacency.indices.shape == (2, graph.num_facts) and adjacency.relation_offsets.shape == (NUM_RELATIONS + 1,)
+
+    shared_path = [1, 3]
+    reachable = adjacency.reachable(e, shared_path)
+    row_paths = torch.from_numpy(np.random.default_rng(1).integers(0, NUM_RELATIONS, (NUM_ENTITIES, 3)))
+    reachable_per_row = adjacency.reachable(e, row_paths)
+    for e1 in range(NUM_ENTITIES):
+        assert set(reachable[e1].nonzero().view(-1).tolist()) == follow(adj_list, {e1}, shared_path)
+        expected = follow(adj_list, {e1}, row_paths[e1].tolist())
+        assert set(reachable_per_row[e1].nonzero().view(-1).tolist()) == expected
+
+    # Normalized propagation keeps the mass of entities which have an edge for every hop
+    x = torch.eye(NUM_ENTITIES)
+    mass = adjacency.propagate(x, [2]).sum(dim=1)
+    has_edge = torch.tensor([2 in adj_list.get(e1, {}) for e1 in range(NUM_ENTITIES)])
+    assert torch.allclose(mass, has_edge.float())
+
+
+def test_edge_mask_validates_trajectory_hops():
+    graph, adj_list = random_graph(seed=2)
+    adjacency = RelationAdjacency(graph, NUM_RELATIONS)
+    rng = np.random.default_rng(3)
+    e1, r, e2 = (torch.from_numpy(rng.integers(0, n, 500)) for n in (NUM_ENTITIES, NUM_RELATIONS, NUM_ENTITIES))
+    expected = [b in adj_list.get(a, {}).get(c, set()) for a, c, b in zip(e1.tolist(), r.tolist(), e2.tolist())]
+    assert adjacency.edge_mask(e1, r, e2).tolist() == expected
@@ -0,0 +1,370 @@
+import sys
+from types import SimpleNamespace
+
+import faiss
+import numpy as np
+import pytest
+import torch
+
+from multihopkg.emb.operations import angular_difference
+from multihopkg.vector_search import (
+    ANN_IndexMan,
+    ANN_IndexMan_pRotatE,
+    ANN_IndexMan_Rotational,
+    ANN_IndexMan_Sharded,
+    blocked_l2_topk,
+    build_kge_index_managers,
+    build_lookup_table,
+    calculate_hits_at_n,
+    calculate_ranking_metrics,
+    chunked_phase_topk,
+    index2data,
+)
+
+EMBEDDING_RANGE = 0.5
+
+
+def brute_force_phase_search(embeddings: torch.Tensor, queries: torch.Tensor, topk: int) -> torch.Tensor:
+    """Reference implementation: full angular difference tensor followed by a sort."""
+    scale = EMBEDDING_RANGE / torch.pi
+    distances = angular_difference(
+        (queries / scale).unsqueeze(1), (embeddings / scale).unsqueeze(0), smooth=False
+    ).norm(dim=-1)
+    return torch.argsort(distances, dim=-1)[:, :topk]
+
+
+def random_phase_embeddings(num: int, dim: int, seed: int = 0) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    return (torch.rand(num, dim, generator=generator) * 2 - 1) * EMBEDDING_RANGE
+
+
+def test_chunked_phase_topk_matches_full_matmul():
+    phases = random_phase_embeddings(500, 16) * torch.pi
+    queries = random_phase_embeddings(7, 16, seed=1) * torch.pi
+
+    _, chunked = chunked_phase_topk(queries, phases, topk=10, chunk_size=64)
+    full = torch.cat([torch.cos(queries), torch.sin(queries)], -1) @ torch.cat(
+        [torch.cos(phases), torch.sin(phases)], -1
+    ).T
+    _, expected = torch.topk(full, 10, dim=1)
+
+    assert torch.equal(chunked, expected)
+
+
+def test_protate_search_is_exact_on_random_queries():
+    embeddings = random_phase_embeddings(5000, 64)
+    queries = random_phase_embeddings(50, 64, seed=2)
+    expected = brute_force_phase_search(embeddings, queries, 10)
+
+    _, indices = ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE, chunk_size=512).search(queries, 10)
+    assert torch.equal(indices, expected)
+
+    # Without the full-scan fallback the shortlist alone is approximate
+    approximate_man = ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE, chunk_size=512, exact=False)
+    _, indices = approximate_man.search(queries, 10)
+    recall = np.mean([len(set(row.tolist()) & set(gt.tolist())) / 10 for row, gt in zip(indices, expected)])
+    assert 0.9 <= recall < 1.0
+
+
+def test_protate_search_finds_perturbed_entities():
+    embeddings = random_phase_embeddings(1000, 32)
+    queries = embeddings[:50] + 0.01 * random_phase_embeddings(50, 32, seed=3)
+
+    index = ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE, chunk_size=128)
+    resulting_embeddings, indices = index.search(queries, 3)
+
+    assert indices.shape == (50, 3)
+    assert index.calculate_hits_at_n(np.arange(50), indices.numpy(), 1) == 1.0
+    assert torch.allclose(resulting_embeddings[:, 0], embeddings[:50], atol=1e-6)
+
+
+def test_rotational_faiss_indexes_match_torch_search():
+    embeddings = random_phase_embeddings(1000, 32)
+    queries = embeddings[:50] + 0.01 * random_phase_embeddings(50, 32, seed=4)
+
+    _, expected = ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE).search(queries, 3)
+    for index_type in ["flat", "ivf", "hnsw"]:
+        for storage in ["float32", "float16", "int8"]:
+            index = ANN_IndexMan_Rotational(
+                embeddings, embedding_range=EMBEDDING_RANGE, index_type=index_type, nlist=10, nprobe=10, storage=storage
+            )
+            _, indices = index.search(queries, 3)
+            assert indices.shape == (50, 3)
+            assert index.calculate_hits_at_n(np.arange(50), indices.numpy(), 1) == 1.0, (index_type, storage)
+            assert torch.equal(indices[:, 0], expected[:, 0]), (index_type, storage)
+
+
+def test_device_resident_search_matches_faiss_flat():
+    generator = torch.Generator().manual_seed(0)
+    embeddings = torch.randn(700, 24, generator=generator)
+    queries = torch.randn(9, 24, generator=generator)
+
+    faiss_embeddings, faiss_indices = ANN_IndexMan(embeddings, exact_computation=True).search(queries, 5)
+    device_man = ANN_IndexMan(embeddings, exact_computation=True, device="cpu", block_size=128)
+    device_embeddings, device_indices = device_man.search(queries, 5)
+
+    assert isinstance(device_indices, torch.Tensor)
+    assert np.array_equal(device_indices.numpy(), faiss_indices)
+    assert np.allclose(device_embeddings.numpy(), faiss_embeddings)
+
+    distances, _ = blocked_l2_topk(queries, embeddings, 5, block_size=128)
+    expected = torch.cdist(queries, embeddings).pow(2).topk(5, largest=False).values
+    assert torch.allclose(distances, expected, atol=1e-3)
+
+
+def test_device_and_numpy_managers_coexist():
+    generator = torch.Generator().manual_seed(1)
+    embeddings = torch.randn(300, 16, generator=generator)
+    queries = torch.randn(7, 16, generator=generator)
+
+    device_man = ANN_IndexMan(embeddings, exact_computation=True, device="cpu")
+    numpy_man = ANN_IndexMan(embeddings, exact_computation=True)
+    # Stand-in for the GPU clone: the FAISS index is only reached through the numpy boundary
+    device_man.gpu_index = numpy_man.index
+
+    _, device_indices = device_man.search(queries, 4)
+    _, numpy_indices = numpy_man.search(queries, 4)
+    assert isinstance(device_indices, torch.Tensor) and device_indices.device == torch.device("cpu")
+    assert isinstance(numpy_indices, np.ndarray) and isinstance(numpy_man.index.search(queries.numpy(), 4)[1], np.ndarray)
+    assert np.array_equal(device_indices.numpy(), numpy_indices)
+    assert "faiss.contrib.torch_utils" not in sys.modules
+
+
+def test_device_resident_mode_keeps_a_single_copy():
+    generator = torch.Generator().manual_seed(2)
+    embeddings = torch.randn(400, 16, generator=generator)
+    tuned = embeddings.clone()
+    tuned[::5] += 1.0
+
+    device_man = ANN_IndexMan(embeddings, exact_computation=True, device="cpu")
+    assert device_man.embedding_vectors is None and device_man.index is None
+    assert device_man.device_embeddings.data_ptr() != embeddings.data_ptr()
+
+    # Without FAISS GPU the exact matmul cannot serve the approximate options, they are rejected instead of dropped
+    for kwargs in ({"storage": "int8"}, {"index_factory": "IVF16,PQ4"}, {"exact_computation": False}):
+        with pytest.raises(ValueError):
+            ANN_IndexMan(embeddings, device="cpu", **kwargs)
+
+    assert len(device_man.refresh(tuned)) == len(range(0, 400, 5))
+    assert len(device_man.refresh(tuned)) == 0
+    _, indices = device_man.search(tuned[:10] + 0.01, 3)
+    _, expected = ANN_IndexMan(tuned, exact_computation=True).search(tuned[:10] + 0.01, 3)
+    assert np.array_equal(indices.numpy(), expected)
+
+
+def test_sharded_search_matches_in_memory_search(tmp_path):
+    embeddings = random_phase_embeddings(1000, 16)
+    queries = embeddings[:6] + 0.01
+    embeddings_path = str(tmp_path / "entity_embedding.npy")
+    np.save(embeddings_path, embeddings.numpy())
+
+    with ANN_IndexMan_Sharded(embeddings_path, num_shards=3, metric="l2", chunk_size=128) as l2_man:
+        _, sharded_indices = l2_man.search(queries, 5)
+    with pytest.raises(RuntimeError):  # The thread pool is shut down on exit
+        l2_man.search(queries, 5)
+    _, faiss_indices = ANN_IndexMan(embeddings, exact_computation=True).search(queries, 5)
+    assert np.array_equal(sharded_indices.numpy(), faiss_indices)
+
+    with ANN_IndexMan_Sharded(
+        embeddings_path, num_shards=3, metric="phase", embedding_range=EMBEDDING_RANGE, chunk_size=128
+    ) as phase_man:
+        sharded_embeddings, sharded_indices = phase_man.search(queries, 5)
+    _, in_memory_indices = ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE).search(queries, 5)
+    assert torch.equal(sharded_indices, in_memory_indices)
+    assert torch.allclose(sharded_embeddings, embeddings[sharded_indices])
+
+    # Random queries are not certified by the shortlist and fall back to the exact scan of every shard
+    wide_embeddings = random_phase_embeddings(4000, 64)
+    random_queries = random_phase_embeddings(20, 64, seed=5)
+    np.save(embeddings_path, wide_embeddings.numpy())
+    with ANN_IndexMan_Sharded(
+        embeddings_path, num_shards=3, metric="phase", embedding_range=EMBEDDING_RANGE, chunk_size=512
+    ) as phase_man:
+        _, sharded_indices = phase_man.search(random_queries, 10)
+    assert torch.equal(sharded_indices, brute_force_phase_search(wide_embeddings, random_queries, 10))
+
+
+def test_batch_search_matches_per_element_search(tmp_path):
+    embeddings = random_phase_embeddings(300, 12)
+    trajectories = embeddings[torch.randint(0, 300, (4, 5))] + 0.01  # [steps, batch, dim]
+    embeddings_path = str(tmp_path / "entity_embedding.npy")
+    np.save(embeddings_path, embeddings.numpy())
+
+    managers = [
+        ANN_IndexMan(embeddings, exact_computation=True),
+        ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE),
+        ANN_IndexMan_Sharded(embeddings_path, num_shards=2, metric="phase", embedding_range=EMBEDDING_RANGE),
+    ]
+    for manager in managers:
+        batch_embeddings, batch_indices = manager.batch_search(trajectories, 3)
+        assert tuple(batch_indices.shape) == (4, 5, 3)
+        assert tuple(batch_embeddings.shape) == (4, 5, 3, 12)
+        for element_id in range(5):
+            _, indices = manager.search(trajectories[:, element_id], 3)
+            assert np.array_equal(np.asarray(batch_indices[:, element_id]), np.asarray(indices))
+    managers[-1].close()
+
+
+def test_quantized_storage_reranks_to_exact_results():
+    embeddings = random_phase_embeddings(800, 16)
+    queries = embeddings[:10] + 0.01
+
+    _, exact_indices = ANN_IndexMan(embeddings, exact_computation=True).search(queries, 5)
+    _, expected_phase_indices = ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE).search(queries, 5)
+    for storage in ("float16", "int8"):
+        _, indices = ANN_IndexMan(embeddings, exact_computation=True, storage=storage, rerank_factor=8).search(queries, 5)
+        assert calculate_hits_at_n(exact_indices[:, 0], indices, 1) == 1.0
+
+        phase_man = ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE, storage=storage, rerank_factor=8)
+        phase_embeddings, phase_indices = phase_man.search(queries, 5)
+        assert calculate_hits_at_n(expected_phase_indices[:, 0].numpy(), phase_indices.numpy(), 1) == 1.0
+        assert torch.allclose(phase_embeddings, embeddings[phase_indices])
+
+
+def test_refresh_matches_full_rebuild(tmp_path):
+    embeddings = random_phase_embeddings(600, 16)
+    tuned = embeddings.clone()
+    tuned[::7] = random_phase_embeddings(600, 16, seed=3)[::7]
+    queries = tuned[::7][:20] + 0.01
+    num_changed = len(range(0, 600, 7))
+
+    for kwargs in ({"exact_computation": True}, {"exact_computation": False, "nlist": 8}):
+        manager = ANN_IndexMan(embeddings, cache_dir=str(tmp_path), **kwargs)
+        manager = ANN_IndexMan(embeddings, cache_dir=str(tmp_path), **kwargs)  # memory-mapped from the cache
+        assert len(manager.refresh(tuned)) == num_changed
+        assert len(manager.refresh(tuned)) == 0
+        _, indices = manager.search(queries, 3)
+        _, expected = ANN_IndexMan(tuned, **kwargs).search(queries, 3)
+        assert calculate_hits_at_n(expected[:, 0], indices, 1) >= 0.95
+
+    for manager in (
+        ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE),
+        ANN_IndexMan_pRotatE(embeddings, embedding_range=EMBEDDING_RANGE, storage="int8"),
+        ANN_IndexMan_Rotational(embeddings, embedding_range=EMBEDDING_RANGE, index_type="flat"),
+        ANN_IndexMan_Rotational(embeddings, embedding_range=EMBEDDING_RANGE, index_type="ivf", nlist=8, nprobe=8),
+        ANN_IndexMan_Rotational(embeddings, embedding_range=EMBEDDING_RANGE, index_type="hnsw"),
+    ):
+        assert len(manager.refresh(tuned)) == num_changed
+        assert len(manager.refresh(tuned)) == 0
+        _, indices = manager.search(queries, 3)
+        assert torch.equal(indices, brute_force_phase_search(tuned, queries, 3))
+
+    empty_man = ANN_IndexMan_pRotatE(torch.empty(0, 16), embedding_range=EMBEDDING_RANGE)
+    changed_ids = empty_man.refresh(torch.empty(0, 16))
+    assert changed_ids.dtype == torch.int64 and changed_ids.numel() == 0
+
+
+def test_index_cache_is_reused_and_keyed_by_content(tmp_path):
+    embeddings = torch.randn(500, 16)
+    queries = embeddings[:10]
+
+    first = ANN_IndexMan(embeddings, exact_computation=False, nlist=8, cache_dir=str(tmp_path))
+    cached_files = list(tmp_path.glob("*.faiss"))
+    assert len(cached_files) == 1
+
+    second = ANN_IndexMan(embeddings, exact_computation=False, nlist=8, cache_dir=str(tmp_path))
+    assert list(tmp_path.glob("*.faiss")) == cached_files
+    assert np.array_equal(first.search(queries, 5)[1], second.search(queries, 5)[1])
+
+    # Other index types and other tables (even of the same shape) get their own file
+    ANN_IndexMan_Rotational(embeddings, index_type="hnsw", cache_dir=str(tmp_path))
+    ANN_IndexMan(embeddings + 2.0, exact_computation=False, nlist=8, cache_dir=str(tmp_path), table_name="relation")
+    assert len(list(tmp_path.glob("*.faiss"))) == 3
+
+    # A new version of the same table replaces its stale index, even when its number of rows changes
+    ANN_IndexMan(embeddings[:400] + 1.0, exact_computation=False, nlist=8, cache_dir=str(tmp_path))
+    cache_files = list(tmp_path.glob("*.faiss"))
+    assert len(cache_files) == 3 and cached_files[0] not in cache_files
+    assert len(list(tmp_path.glob("ann_index_relation_*.faiss"))) == 1
+
+
+def test_factory_index_recall_sweep():
+    embeddings = torch.randn(2000, 16)
+    queries = embeddings[:100] + 0.01 * torch.randn(100, 16)
+
+    index = ANN_IndexMan(embeddings, index_factory="IVF16,Flat", search_params="nprobe=1")
+    results = index.benchmark_recall(queries, ["nprobe=1", "nprobe=16"], topks=(1, 10))
+
+    assert [row["search_params"] for row in results] == ["nprobe=1", "nprobe=16"]
+    assert results[1]["recall@1"] == 1.0
+    assert results[0]["recall@10"] <= results[1]["recall@10"]
+    assert all(row["latency_ms"] >= 0 for row in results)
+
+    # The sweep leaves the live operating point untouched
+    assert index.search_params == "nprobe=1" and faiss.extract_index_ivf(index.index).nprobe == 1
+    untuned_index = ANN_IndexMan(embeddings, index_factory="IVF16,Flat")
+    untuned_index.benchmark_recall(queries, ["nprobe=16"])
+    assert untuned_index.search_params is None and faiss.extract_index_ivf(untuned_index.index).nprobe == 1
+
+
+def test_ranking_metrics_match_python_loop():
+    rng = np.random.default_rng(0)
+    indices = rng.integers(0, 20, size=(200, 10))
+    ground_truth = rng.integers(0, 20, size=200)
+
+    metrics = calculate_ranking_metrics(ground_truth, indices, topks=(1, 3, 10))
+
+    for topk in (1, 3, 10):
+        expected = sum(1 for i, gt in enumerate(ground_truth) if gt in indices[i, :topk]) / len(ground_truth)
+        assert metrics[f"HITS@{topk}"] == calculate_hits_at_n(ground_truth, indices, topk) == expected
+    expected_mrr = np.mean([
+        1.0 / (list(row).index(gt) + 1) if gt in row else 0.0 for row, gt in zip(indices, ground_truth)
+    ])
+    assert np.isclose(metrics["MRR"], expected_mrr)
+
+
+def test_index2data_maps_whole_arrays():
+    id2entity = {0: "m.a", 1: "m.b", 2: "m.c"}
+    table = build_lookup_table(id2entity)
+
+    mapped = index2data(torch.tensor([[2, 0, 1], [1, 1, 0]]), table, max_results=2)
+
+    assert mapped.tolist() == [["m.c", "m.a"], ["m.b", "m.b"]]
+    assert build_lookup_table({}).shape == (0,)
+
+
+def test_kge_index_managers_pass_the_storage(tmp_path):
+    entities, relations = random_phase_embeddings(200, 16), random_phase_embeddings(10, 16, seed=1)
+    np.save(tmp_path / "entity_embedding.npy", entities.numpy())
+    kge_model = SimpleNamespace(
+        embedding_range=torch.tensor(EMBEDDING_RANGE),
+        get_all_entity_embeddings_wo_dropout=lambda: entities,
+        get_all_relations_embeddings_wo_dropout=lambda: relations,
+    )
+
+    ent_man, rel_man = build_kge_index_managers(kge_model, "pRotatE", str(tmp_path))
+    assert isinstance(ent_man, ANN_IndexMan_pRotatE) and ent_man.exact
+    assert isinstance(rel_man, ANN_IndexMan_pRotatE) and rel_man.exact
+
+    ent_man, rel_man = build_kge_index_managers(kge_model, "pRotatE", str(tmp_path), storage="int8")
+    assert ent_man.storage == "int8" and not ent_man.exact
+    assert rel_man.storage == "float32" and rel_man.exact
+
+    ent_man, rel_man = build_kge_index_managers(kge_model, "TransE", str(tmp_path), storage="float16")
+    assert isinstance(ent_man, ANN_IndexMan) and ent_man.storage == "float16"
+    assert isinstance(rel_man, ANN_IndexMan)
+
+    for model_name in ("pRotatE", "TransE"):
+        ent_man, rel_man = build_kge_index_managers(kge_model, model_name, str(tmp_path), device="cpu")
+        _, indices = ent_man.search(entities[:4], 1)
+        assert isinstance(indices, torch.Tensor) and indices[:, 0].tolist() == [0, 1, 2, 3]
+        _, indices = rel_man.search(relations[:4], 1)
+        assert isinstance(indices, torch.Tensor) and indices[:, 0].tolist() == [0, 1, 2, 3]
+
+    for index_type in ("flat", "ivf", "hnsw"):
+        ent_man, rel_man = build_kge_index_managers(
+            kge_model, "pRotatE", str(tmp_path), rotational_index=index_type, search_params="nprobe=8" if index_type == "ivf" else None
+        )
+        assert isinstance(ent_man, ANN_IndexMan_Rotational) and ent_man.index_type == index_type
+        assert isinstance(rel_man, ANN_IndexMan_pRotatE) and rel_man.exact
+        _, indices = ent_man.search(entities[:10] + 0.001, 1)
+        assert indices[:, 0].tolist() == list(range(10))
+    assert faiss.extract_index_ivf(
+        build_kge_index_managers(kge_model, "pRotatE", str(tmp_path), rotational_index="ivf", search_params="nprobe=8")[0].index
+    ).nprobe == 8
+    with pytest.raises(ValueError):
+        build_kge_index_managers(kge_model, "pRotatE", str(tmp_path), rotational_index="hnsw", device="cpu")
+
+    ent_man, _ = build_kge_index_managers(kge_model, "pRotatE", str(tmp_path), num_shards=2)
+    assert isinstance(ent_man, ANN_IndexMan_Sharded) and ent_man.metric == "phase"
+    ent_man.close()